@@ -0,0 +1,327 @@
+"""
+Empirical tuning of the tile size of the tiled specializations (see
+:py:class:`minivect.specializers.CTiledStridedSpecializer`).
+
+A :py:class:`BlocksizeTuner` times the tiled specialization of a function
+with a number of candidate tile sizes and records the fastest in a
+:py:class:`TuningTable`. Tile sizes are recorded per machine, specializer,
+dtype, number of dimensions and shape class (see :py:func:`shape_class`).
+
+An :py:class:`OpenMPCalibrator` finds the data size above which the
+parallel version of a specialization is faster than the serial version,
+and records it as the OpenMP threshold (``omp_size``) of the kernel.
+
+A :py:class:`minivect.dispatch.Dispatcher` whose context has a tuning table
+(see ``Context.tuning_table_dir``) compiles specializations with the
+recorded OpenMP threshold, and tiled specializations with the tile sizes
+tuned for the shape of the operands.
+"""
+
+import os
+import timeit
+import operator
+import platform
+import tempfile
+import itertools
+import cPickle as pickle
+
+def machine_id():
+    "Return a string identifying the machine the tile sizes are tuned on"
+    system, node, release, version, machine, processor = platform.uname()
+    return "%s-%s-%s" % (node, machine, processor)
+
+def tiled_dimensions(specializer_cls, ndim):
+    "Return the two dimensions tiled by a tiled specializer"
+    if specializer_cls.order == 'C':
+        return ndim - 2, ndim - 1
+    else:
+        return 0, 1
+
+def shape_class(shape, dims):
+    """
+    Return the class of a shape: the number of bits of the extents in the
+    given dimensions. Shapes whose extents are within the same powers of
+    two share their tile sizes.
+
+    >>> shape_class((3, 100, 1000), (1, 2))
+    (7, 10)
+    """
+    return tuple(int(shape[dim]).bit_length() for dim in dims)
+
+def tuning_key(specializer_cls, dtype, shape):
+    """
+    Return the key of the tile sizes for a tiled specializer, the dtype of
+    the operands and the broadcast shape.
+    """
+    dims = tiled_dimensions(specializer_cls, len(shape))
+    return (specializer_cls.__name__, str(dtype), len(shape),
+            shape_class(shape, dims))
+
+def kernel_key(specializer_cls, function_digest):
+    """
+    Return the key of the OpenMP threshold of the specialization of a
+    function, given the digest of its structural key (see
+    :py:func:`minivect.minicache.digest`).
+    """
+    return ('omp_size', specializer_cls.__name__, function_digest)
+
+_tuned_specializers = {}
+
+def tuned_specializer(specializer_cls, blocksizes=None, omp_size=None):
+    """
+    Return a subclass of a specializer that tiles with the given tile sizes
+    (see ``CTiledStridedSpecializer.blocksizes``) and starts a parallel
+    section for data sizes over ``omp_size``. Classes are created once, so
+    the specializations are cached by the context.
+    """
+    attributes = {}
+    suffixes = []
+    if blocksizes is not None:
+        attributes['blocksizes'] = tuple(blocksizes)
+        suffixes.append("x".join(str(blocksize) for blocksize in blocksizes))
+    if omp_size is not None:
+        attributes['omp_size'] = omp_size
+        suffixes.append("omp%d" % omp_size)
+
+    key = specializer_cls, tuple(sorted(attributes.iteritems()))
+    if key not in _tuned_specializers:
+        name = "_".join([specializer_cls.__name__] + suffixes)
+        _tuned_specializers[key] = type(name, (specializer_cls,), attributes)
+
+    return _tuned_specializers[key]
+
+def time_specializer(dispatcher, specializer_cls, operands, repeat):
+    """
+    Return the fastest of a number of calls of the specialization of a
+    dispatcher's function with the operands.
+    """
+    ctypes_func, args = dispatcher.prepare_specializer(specializer_cls,
+                                                       *operands)
+    timer = timeit.default_timer
+    best = None
+    for i in range(repeat):
+        start = timer()
+        ctypes_func(*args)
+        elapsed = timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+class TuningTable(object):
+    """
+    Table of tuned tile sizes and OpenMP thresholds, kept in a single file
+    in the given directory. The table may be shared by multiple machines,
+    entries are only visible on the machine that recorded them.
+
+    The file is replaced atomically, so multiple processes can read and
+    update the table. Concurrent updates may however lose an entry.
+    """
+
+    filename = 'minivect.tuning'
+    temp_prefix = '.tmp-'
+
+    def __init__(self, directory, machine=None):
+        self.directory = directory
+        self.machine = machine or machine_id()
+        self.path = os.path.join(directory, self.filename)
+
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+
+    def entries(self):
+        "Return a dict mapping (machine,) + key to the tuned value"
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            return {}
+
+        try:
+            return pickle.loads(data)
+        except Exception:
+            # Corrupt table, e.g. written by an incompatible version
+            return {}
+
+    def get(self, key):
+        "Return the value for a key (see tuning_key and kernel_key) or None"
+        return self.entries().get((self.machine,) + key)
+
+    def put(self, key, value):
+        "Record the value for a key"
+        entries = self.entries()
+        entries[(self.machine,) + key] = value
+
+        data = pickle.dumps(entries, pickle.HIGHEST_PROTOCOL)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory,
+                                         prefix=self.temp_prefix)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.rename(temp_path, self.path)
+        except:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+class BlocksizeTuner(object):
+    """
+    Time the tiled specialization a dispatcher selects for some operands
+    with each candidate tile size, and record the fastest in the tuning
+    table of the dispatcher's context. The context must produce callable
+    code (see :py:class:`minivect.dispatch.Dispatcher`).
+
+    :param dispatcher: the :py:class:`minivect.dispatch.Dispatcher` of the
+                       function to tune
+    :param two_dimensional: whether to time all pairs of candidates for the
+                            two tiled dimensions, instead of square tiles
+    :param candidates: the candidate tile sizes
+
+    .. attribute:: timings
+
+        list of ``(seconds, blocksizes)`` measured by the last call to
+        :py:meth:`tune`
+    """
+
+    candidates = (16, 32, 64, 128, 256)
+    # the best of this many calls is taken for each candidate
+    repeat = 5
+
+    def __init__(self, dispatcher, two_dimensional=False, candidates=None):
+        self.dispatcher = dispatcher
+        self.two_dimensional = two_dimensional
+        if candidates is not None:
+            self.candidates = tuple(candidates)
+
+        self.timings = []
+
+    def candidate_blocksizes(self):
+        "Return the tile sizes to time"
+        if self.two_dimensional:
+            return list(itertools.product(self.candidates, repeat=2))
+        else:
+            return [(blocksize, blocksize) for blocksize in self.candidates]
+
+    def time(self, specializer_cls, operands):
+        "Return the fastest time of calling a specialization with operands"
+        return time_specializer(self.dispatcher, specializer_cls, operands,
+                                self.repeat)
+
+    def tune(self, *operands):
+        """
+        Tune the tile sizes for the operands, record them in the tuning
+        table and return them. The operands are overwritten.
+        """
+        dispatcher = self.dispatcher
+        table = dispatcher.context.tuning_table
+        assert table is not None, "The context has no tuning_table_dir"
+
+        arrays = operands[:len(dispatcher.array_arguments)]
+        shape, layouts = dispatcher.layouts(arrays)
+        specializer_cls = dispatcher._select(layouts)
+        if not specializer_cls.is_tiled_specializer:
+            raise ValueError("Operands are not processed by a tiled "
+                             "specialization")
+
+        self.timings = []
+        for blocksizes in self.candidate_blocksizes():
+            tuned_cls = tuned_specializer(specializer_cls, blocksizes)
+            self.timings.append((self.time(tuned_cls, operands), blocksizes))
+
+        seconds, blocksizes = min(self.timings)
+        table.put(dispatcher.tuning_key(specializer_cls, shape), blocksizes)
+        dispatcher.tunings.clear()
+        return blocksizes
+
+class OpenMPCalibrator(object):
+    """
+    Find the OpenMP threshold (``omp_size``) of the specialization a
+    dispatcher selects for some operands, and record it in the tuning table
+    of the dispatcher's context. The context must produce callable code
+    that is compiled with OpenMP.
+
+    The specialization is timed serially and in parallel on the operands
+    and on views that halve their outermost dimension, down to an extent
+    of one. The threshold is the largest data size timed below the sizes
+    at which the parallel version is always faster, so smaller arrays
+    skip the parallel section and larger arrays always go parallel. If
+    the parallel version is never faster, the threshold is the largest
+    size timed.
+
+    Operands should therefore be large, with a long outermost dimension.
+    They are overwritten.
+
+    .. attribute:: timings
+
+        list of ``(size, serial_seconds, parallel_seconds)`` measured by the
+        last call to :py:meth:`calibrate`, in ascending order of size
+    """
+
+    # the best of this many calls is taken for each size
+    repeat = 5
+
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+        self.timings = []
+
+    def views(self, operands, shape, layouts):
+        """
+        Return a list of ``(size, operands)`` in ascending order of size,
+        halving the outermost dimension of the array operands in each step.
+        """
+        dispatcher = self.dispatcher
+        dim = dispatcher.outer_dimension(shape, layouts)
+
+        result = []
+        extent = shape[dim]
+        while extent >= 1:
+            views = dispatcher.slice_operands(operands, layouts, dim, 0, extent)
+            view_shape = list(shape)
+            view_shape[dim] = extent
+            size = reduce(operator.mul, view_shape, 1)
+            result.append((size, views))
+            extent //= 2
+
+        return result[::-1]
+
+    def calibrate(self, *operands):
+        """
+        Calibrate the OpenMP threshold for the operands, record it in the
+        tuning table and return it.
+        """
+        dispatcher = self.dispatcher
+        table = dispatcher.context.tuning_table
+        assert table is not None, "The context has no tuning_table_dir"
+        assert dispatcher.function_digest is not None, (
+                            "The function has no stable structural key")
+
+        arrays = operands[:len(dispatcher.array_arguments)]
+        shape, layouts = dispatcher.layouts(arrays)
+        specializer_cls = dispatcher._select(layouts)
+
+        views = self.views(operands, shape, layouts)
+        max_size = views[-1][0]
+        serial_cls = tuned_specializer(specializer_cls, omp_size=max_size)
+        parallel_cls = tuned_specializer(specializer_cls, omp_size=0)
+
+        self.timings = []
+        for size, view_operands in views:
+            self.timings.append((size,
+                time_specializer(dispatcher, serial_cls, view_operands,
+                                 self.repeat),
+                time_specializer(dispatcher, parallel_cls, view_operands,
+                                 self.repeat)))
+
+        omp_size = 0
+        for size, serial_seconds, parallel_seconds in self.timings:
+            if serial_seconds <= parallel_seconds:
+                omp_size = size
+
+        table.put(dispatcher.kernel_key(specializer_cls), omp_size)
+        dispatcher.tunings.clear()
+        return omp_size
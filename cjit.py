@@ -0,0 +1,143 @@
+"""
+Compile generated C code with the system C compiler and load it with ctypes
+(see :py:class:`minivect.miniast.CJitContext`).
+"""
+
+import os
+import atexit
+import ctypes
+import shutil
+import tempfile
+import threading
+import subprocess
+import distutils.sysconfig
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import minierror
+import minicache
+from ctypes_conversion import convert_to_ctypes
+
+prelude = """\
+#include <Python.h>
+#ifdef MINIVECT_NUMPY
+#include <numpy/npy_common.h>
+#endif
+#if defined(__x86_64__) || defined(__i386__)
+#include <immintrin.h>
+#endif
+
+"""
+
+_temp_build_dir = None
+_temp_build_dir_lock = threading.Lock()
+
+def temp_build_dir():
+    """
+    Return the temporary build directory shared by all compilers of the
+    process that are not given a build directory. It is removed at exit.
+    """
+    global _temp_build_dir
+
+    with _temp_build_dir_lock:
+        if _temp_build_dir is None:
+            _temp_build_dir = tempfile.mkdtemp(prefix='minivect-')
+            atexit.register(shutil.rmtree, _temp_build_dir, True)
+
+    return _temp_build_dir
+
+class CCompiler(object):
+    """
+    Compile C code into shared objects and load them.
+
+    :param cc: the C compiler command
+    :param cflags: list of compiler flags, e.g. optimization flags
+    :param build_dir: the directory for sources and shared objects, the
+                      temporary directory of the process (see
+                      :py:func:`temp_build_dir`) if ``None``
+
+    Shared objects are named after a digest of their source and the
+    compiler command, so a build directory shared between processes
+    compiles each source once.
+    """
+
+    def __init__(self, cc, cflags, build_dir=None):
+        self.cc = cc
+        self.cflags = list(cflags)
+        if build_dir is None:
+            build_dir = temp_build_dir()
+
+        self.build_dir = build_dir
+
+        try:
+            os.makedirs(build_dir)
+        except OSError:
+            if not os.path.isdir(build_dir):
+                raise
+
+    def include_dirs(self):
+        include_dirs = [distutils.sysconfig.get_python_inc()]
+        if numpy is not None:
+            include_dirs.append(numpy.get_include())
+        return include_dirs
+
+    def command(self, source_path, so_path):
+        "Return the command compiling a source into a shared object"
+        command = [self.cc] + self.cflags + ['-fPIC', '-shared']
+        command.extend('-I' + include_dir
+                           for include_dir in self.include_dirs())
+        if numpy is not None:
+            command.append('-DMINIVECT_NUMPY')
+        return command + ['-o', so_path, source_path]
+
+    def build(self, code):
+        """
+        Compile C code, prefixed with the headers it needs, and return the
+        path of the shared object.
+        """
+        source = prelude + code
+        digest = minicache.digest((source, tuple(self.command('', ''))))
+        so_path = os.path.join(self.build_dir, 'minivect_%s.so' % digest)
+        if os.path.exists(so_path):
+            return so_path
+
+        fd, source_path = tempfile.mkstemp(suffix='.c', dir=self.build_dir)
+        temp_so_path = source_path[:-2] + '.so'
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(source)
+
+            process = subprocess.Popen(self.command(source_path, temp_so_path),
+                                       stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT)
+            output, _ = process.communicate()
+            if process.returncode != 0:
+                raise minierror.CCompilerError(
+                    "%s failed with exit status %d:\n%s" % (
+                                    self.cc, process.returncode, output))
+
+            os.rename(temp_so_path, so_path)
+        finally:
+            for path in source_path, temp_so_path:
+                if os.path.exists(path):
+                    os.remove(path)
+
+        return so_path
+
+    def load_function(self, code, function):
+        """
+        Compile the C code of a function and return a ctypes function.
+
+        :param function: the :py:class:`minivect.miniast.FunctionNode`,
+                         with the name of the C function in ``mangled_name``
+        """
+        return self.load(self.build(code), function)
+
+    def load(self, so_path, function):
+        "Load a function from a shared object built by :py:meth:`build`"
+        library = ctypes.CDLL(so_path)
+        ctypes_func_type = convert_to_ctypes(function.type)
+        return ctypes_func_type((function.mangled_name, library))
@@ -43,6 +43,21 @@ class CodeGen(minivisitor.TreeVisitor):
             return
         return self.visit(node)
 
+    def dump_cached_code(self, node):
+        """
+        Return a picklable object for the code generated for the given
+        FunctionNode, to be stored in a :py:class:`minivect.minicache.KernelCache`,
+        or None if the generated code cannot be cached.
+        """
+        return None
+
+    def load_cached_code(self, node, cached_code):
+        """
+        Load code previously returned by :py:meth:`dump_cached_code` instead
+        of visiting the FunctionNode. Returns whether the code could be used.
+        """
+        return False
+
 class CodeGenCleanup(CodeGen):
     def visit_Node(self, node):
         self.visitchildren(node)
@@ -83,6 +98,12 @@ class CCodeGen(CodeGen):
     label_counter = 0
     disposal_point = None
 
+    # Stands in for the function name in cached code
+    cached_name_placeholder = "__mini_cached_function_name__"
+
+    # The return type and storage class of generated functions
+    function_prefix = "static int"
+
     def __init__(self, context, codewriter):
         super(CCodeGen, self).__init__(context, codewriter)
         self.declared_temps = set()
@@ -99,11 +120,11 @@ class CCodeGen(CodeGen):
         self.specializer = node.specializer
         self.function = node
 
-        name = code.mangle(node.mangled_name + node.specialization_name)
+        name = self._function_name(node)
         node.mangled_name = name
 
         args = self.results(node.arguments + node.scalar_arguments)
-        proto = "static int %s(%s)" % (name, ", ".join(args))
+        proto = "%s %s(%s)" % (self.function_prefix, name, ", ".join(args))
         code.proto_code.putln(proto + ';')
         code.putln("%s {" % proto)
         code.declaration_levels.append(code.insertion_point())
@@ -113,6 +134,30 @@ class CCodeGen(CodeGen):
         code.declaration_levels.pop()
         code.putln("}")
 
+    def _function_name(self, node):
+        return self.code.mangle(node.mangled_name + node.specialization_name)
+
+    def dump_cached_code(self, node):
+        placeholder = self.cached_name_placeholder
+        proto = "".join(self.code.proto_code.buffer.getvalue())
+        impl = "".join(self.code.buffer.getvalue())
+        return dict(backend='c',
+                    proto=proto.replace(node.mangled_name, placeholder),
+                    impl=impl.replace(node.mangled_name, placeholder))
+
+    def load_cached_code(self, node, cached_code):
+        if cached_code.get('backend') != 'c':
+            return False
+
+        name = self._function_name(node)
+        node.mangled_name = name
+
+        placeholder = self.cached_name_placeholder
+        self.code.proto_code.write(cached_code['proto'].replace(placeholder,
+                                                                name))
+        self.code.write(cached_code['impl'].replace(placeholder, name))
+        return True
+
     def _argument_variables(self, variables):
         return ", ".join("%s %s" % (v.type, self.visit(v))
                              for v in variables if v is not None)
@@ -147,8 +192,18 @@ class CCodeGen(CodeGen):
         if node.privates:
             privates = " private(%s)" % ", ".join(self.results(node.privates))
 
-        pragma = "#pragma omp parallel for if(%s) lastprivate(%s)%s default(none)"
-        self.code.putln(pragma % (if_clause, lastprivates, privates))
+        reductions = "".join(
+            " reduction(%s:%s)" % (operator, self.visit(temp))
+                for operator, temp in zip(node.reduction_operators,
+                                          node.reductions))
+
+        # The arguments and hoisted constants are shared. Since OpenMP 4.0
+        # const variables are no longer predetermined shared, so
+        # default(none) would need to list them.
+        pragma = ("#pragma omp parallel for if(%s) lastprivate(%s)%s%s "
+                  "default(shared)")
+        self.code.putln(pragma % (if_clause, lastprivates, privates,
+                                  reductions))
         self.code.putln("#endif")
         self.visit(node.for_node)
 
@@ -265,7 +320,8 @@ class CCodeGen(CodeGen):
         if (node.rhs.is_binop and node.rhs.operator == '+' and
                 node.rhs.rhs.is_constant and node.rhs.rhs.value == 1):
             return "%s++" % self.visit(node.rhs.lhs)
-        elif node.rhs.is_binop and node.lhs == node.rhs.lhs:
+        elif (node.rhs.is_binop and node.lhs == node.rhs.lhs and
+                  not node.rhs.type.is_vector):
             return "(%s %s= %s)" % (self.visit(node.lhs),
                                     node.rhs.operator,
                                     self.visit(node.rhs.rhs))
@@ -347,14 +403,27 @@ class CCodeGen(CodeGen):
 
 
 class VectorCodegen(CCodeGen):
+    """
+    Generate SSE, AVX and AVX-512 intrinsics for the vector nodes.
+
+    Integer vectors need SSE4.1 (SSE4.2 to compare 64-bit integers), and
+    AVX2 for 256-bit vectors. See
+    :py:class:`minivect.specializers.CanVectorizeVisitor` for the operations
+    that are vectorized.
+    """
 
     types = {
         minitypes.VectorType(minitypes.float_, 4) : '_mm_%s_ps',
         minitypes.VectorType(minitypes.float_, 8) : '_mm256_%s_ps',
+        minitypes.VectorType(minitypes.float_, 16) : '_mm512_%s_ps',
         minitypes.VectorType(minitypes.double, 4) : '_mm_%s_pd',
         minitypes.VectorType(minitypes.double, 8) : '_mm256_%s_pd',
+        minitypes.VectorType(minitypes.double, 16) : '_mm512_%s_pd',
     }
 
+    # Prefixes of the integer intrinsics, by vector size
+    prefixes = {4: '_mm', 8: '_mm256', 16: '_mm512'}
+
     binops = {
         '+': 'add',
         '*': 'mul',
@@ -364,38 +433,374 @@ class VectorCodegen(CCodeGen):
         # floordiv not supported
         # mod not supported
 
-        '<': 'cmplt',
-        '<=': 'cmple',
-        '==': 'cmpeq',
-        '!=': 'cmpne',
-        '>=': 'cmpge',
-        '>': 'cmpgt',
+        'min': 'min',
+        'max': 'max',
+
+        # integers only
+        '&': 'and',
+        '|': 'or',
+        '^': 'xor',
+    }
+
+    # SSE compares floats with one intrinsic per comparison, AVX and AVX-512
+    # with a predicate. != holds for unordered operands, like in C.
+    float_comparisons = {
+        '<': ('cmplt', '_CMP_LT_OQ'),
+        '<=': ('cmple', '_CMP_LE_OQ'),
+        '==': ('cmpeq', '_CMP_EQ_OQ'),
+        '!=': ('cmpneq', '_CMP_NEQ_UQ'),
+        '>=': ('cmpge', '_CMP_GE_OQ'),
+        '>': ('cmpgt', '_CMP_GT_OQ'),
     }
 
+    # SSE and AVX2 only compare integers for equality and 'greater than'.
+    # Map each comparison to (intrinsic, swap operands, negate result).
+    int_comparisons = {
+        '<': ('cmpgt', True, False),
+        '<=': ('cmpgt', False, True),
+        '==': ('cmpeq', False, False),
+        '!=': ('cmpeq', False, True),
+        '>=': ('cmpgt', True, True),
+        '>': ('cmpgt', False, False),
+    }
+
+    # AVX-512 compares integers into a mask with one of these predicates
+    int_mask_comparisons = {
+        '<': '_MM_CMPINT_LT',
+        '<=': '_MM_CMPINT_LE',
+        '==': '_MM_CMPINT_EQ',
+        '!=': '_MM_CMPINT_NE',
+        '>=': '_MM_CMPINT_NLT',
+        '>': '_MM_CMPINT_NLE',
+    }
+
+    def int_intrinsic(self, type, name, suffix=None):
+        """
+        Return the name of an integer intrinsic, e.g. _mm256_add_epi64. The
+        suffix defaults to the signed element type.
+        """
+        if suffix is None:
+            suffix = 'epi%d' % (type.element_type.itemsize * 8)
+        return '%s_%s_%s' % (self.prefixes[type.vector_size], name, suffix)
+
+    def register_suffix(self, type):
+        "Suffix of intrinsics operating on the entire register, e.g. si128"
+        return 'si%d' % (type.vector_size * 32)
+
+    def int_set1(self, type, value):
+        suffix = 'epi%d' % (type.element_type.itemsize * 8)
+        if type.element_type.itemsize == 8 and type.vector_size < 16:
+            suffix += 'x'
+        return '%s(%s)' % (self.int_intrinsic(type, 'set1', suffix), value)
+
+    def int_comparison(self, operator, type, lhs, rhs):
+        """
+        Compare integer vectors. Like scalar comparisons, this results in 1
+        where the comparison holds and 0 elsewhere.
+        """
+        bits = type.element_type.itemsize * 8
+        if type.vector_size == 16:
+            sign = type.element_type.signed and 'i' or 'u'
+            compare = self.int_intrinsic(type, 'cmp',
+                                         'ep%s%d_mask' % (sign, bits))
+            mask = '%s(%s, %s, %s)' % (compare, lhs, rhs,
+                                       self.int_mask_comparisons[operator])
+            return '%s(%s, 1)' % (self.int_intrinsic(type, 'maskz_set1'),
+                                  mask)
+
+        name, swap, negate = self.int_comparisons[operator]
+        if swap:
+            lhs, rhs = rhs, lhs
+
+        # The elements of the mask are -1 where the comparison holds
+        mask = '%s(%s, %s)' % (self.int_intrinsic(type, name), lhs, rhs)
+        if negate:
+            return '%s(%s, %s)' % (self.int_intrinsic(type, 'add'), mask,
+                                   self.int_set1(type, 1))
+        else:
+            setzero = self.int_intrinsic(type, 'setzero',
+                                         self.register_suffix(type))
+            return '%s(%s(), %s)' % (self.int_intrinsic(type, 'sub'),
+                                     setzero, mask)
+
+    def float_comparison(self, operator, type, lhs, rhs):
+        """
+        Compare float vectors. Like scalar comparisons, this results in 1.0
+        where the comparison holds and 0.0 elsewhere.
+        """
+        intrinsic = self.types[type]
+        name, predicate = self.float_comparisons[operator]
+        one = '%s(1.0)' % (intrinsic % 'set1')
+        if type.vector_size == 16:
+            mask = '%s_mask(%s, %s, %s)' % (intrinsic % 'cmp', lhs, rhs,
+                                            predicate)
+            return '%s(%s, %s)' % (intrinsic % 'maskz_mov', mask, one)
+
+        # The elements of the mask have all bits set where the comparison
+        # holds
+        if type.vector_size == 4:
+            mask = '%s(%s, %s)' % (intrinsic % name, lhs, rhs)
+        else:
+            mask = '%s(%s, %s, %s)' % (intrinsic % 'cmp', lhs, rhs, predicate)
+        return '%s(%s, %s)' % (intrinsic % 'and', mask, one)
+
+    def remainder_mask(self, type, remainder):
+        """
+        Return a mask selecting the first ``remainder`` elements of a vector.
+        AVX-512 uses a bit mask, AVX a vector with the sign bits set in the
+        selected elements.
+        """
+        n_elements = type.vector_size * 4 / type.element_type.itemsize
+        if type.vector_size == 16:
+            return '(__mmask%d) ((1 << %s) - 1)' % (n_elements, remainder)
+
+        if type.element_type.itemsize == 4:
+            mask_type = minitypes.VectorType(minitypes.int32, type.vector_size)
+            set_ = self.int_intrinsic(mask_type, 'set')
+        else:
+            mask_type = minitypes.VectorType(minitypes.int64, type.vector_size)
+            set_ = self.int_intrinsic(mask_type, 'set', 'epi64x')
+
+        indices = ', '.join(map(str, reversed(range(n_elements))))
+        return '%s(%s, %s(%s))' % (self.int_intrinsic(mask_type, 'cmpgt'),
+                                   self.int_set1(mask_type, remainder),
+                                   set_, indices)
+
+    def masked_intrinsic(self, type, name):
+        if type.element_type.is_int:
+            return self.int_intrinsic(type, name)
+        return self.types[type] % name
+
+    def masked_pointer(self, type, pointer):
+        "AVX takes int and long long pointers to integer data"
+        if type.element_type.is_int and type.vector_size < 16:
+            if type.element_type.itemsize == 4:
+                return '(int *) %s' % pointer
+            return '(long long *) %s' % pointer
+        return pointer
+
+    def masked_load(self, node):
+        type = node.type
+        mask = self.remainder_mask(type, self.visit(node.remainder))
+        pointer = self.masked_pointer(type, self.visit(node.operand))
+        if type.vector_size == 16:
+            load = self.masked_intrinsic(type, 'maskz_loadu')
+            return '%s(%s, %s)' % (load, mask, pointer)
+        else:
+            load = self.masked_intrinsic(type, 'maskload')
+            return '%s(%s, %s)' % (load, pointer, mask)
+
+    def masked_store(self, node):
+        type = node.rhs.type
+        if type.vector_size == 16:
+            store = self.masked_intrinsic(type, 'mask_storeu')
+        else:
+            store = self.masked_intrinsic(type, 'maskstore')
+
+        return '%s(%s, %s, %s)' % (
+                    store, self.masked_pointer(type, self.visit(node.lhs)),
+                    self.remainder_mask(type, self.visit(node.remainder)),
+                    self.visit(node.rhs))
+
+    def gather(self, node):
+        """
+        Load the elements of a vector that are ``node.stride`` elements
+        apart. Wider vectors need AVX2 and their indices of 32-bit elements
+        are 32-bit. SSE has no gathers, so the elements of 4-lane vectors
+        are loaded one by one.
+        """
+        type = node.type
+        element_type = type.element_type
+        bits = element_type.itemsize * 8
+        n_elements = type.vector_size * 4 / element_type.itemsize
+
+        stride = self.visit(node.stride)
+        if type.vector_size == 4:
+            if element_type.is_int:
+                set_ = self.int_intrinsic(type, 'set',
+                                          bits == 64 and 'epi64x' or None)
+            else:
+                set_ = self.types[type] % 'set'
+
+            pointer = self.visit(node.operand)
+            elements = ['(%s)[%d * %s]' % (pointer, i, stride)
+                            for i in range(n_elements)]
+            return '%s(%s)' % (set_, ', '.join(elements[::-1]))
+
+        index_dtype = bits == 32 and minitypes.int32 or minitypes.int64
+        index_type = minitypes.VectorType(index_dtype, type.vector_size)
+        if bits == 64 and type.vector_size < 16:
+            set_ = self.int_intrinsic(index_type, 'set', 'epi64x')
+        else:
+            set_ = self.int_intrinsic(index_type, 'set')
+
+        indices = ['%d * %s' % (i, stride) for i in range(1, n_elements)]
+        indices = '%s(%s)' % (set_, ', '.join(indices[::-1] + ['0']))
+
+        name = 'i%dgather' % bits
+        pointer = self.masked_pointer(type, self.visit(node.operand))
+        if element_type.is_int:
+            gather = self.int_intrinsic(type, name)
+        else:
+            gather = self.types[type] % name
+
+        if type.vector_size == 16:
+            return '%s(%s, %s, %d)' % (gather, indices, pointer,
+                                       element_type.itemsize)
+        return '%s(%s, %s, %d)' % (gather, pointer, indices,
+                                   element_type.itemsize)
+
     def visit_VectorVariable(self, node):
         return self.visit(node.variable)
 
+    def aligned_access(self, aligned, access):
+        """
+        Return the aligned or the unaligned access generated by ``access``,
+        e.g. _mm_load_pd(p) or _mm_loadu_pd(p), or choose between them at
+        runtime if ``aligned`` is an expression node.
+        """
+        if aligned is True:
+            return access(aligned=True)
+        elif aligned is False:
+            return access(aligned=False)
+        else:
+            return '(%s ? %s : %s)' % (self.visit(aligned),
+                                       access(aligned=True),
+                                       access(aligned=False))
+
     def visit_VectorLoadNode(self, node):
-        load = self.types[node.type] % 'loadu'
-        return '%s(%s)' % (load, self.visit(node.operand))
+        if node.remainder is not None:
+            return self.masked_load(node)
+        elif node.stride is not None:
+            return self.gather(node)
+
+        type = node.type
+        pointer = self.visit(node.operand)
+
+        def access(aligned):
+            name = aligned and 'load' or 'loadu'
+            if type.element_type.is_int:
+                load = self.int_intrinsic(type, name,
+                                          self.register_suffix(type))
+                return '%s((%s *) %s)' % (load, type, pointer)
+
+            return '%s(%s)' % (self.types[type] % name, pointer)
+
+        return self.aligned_access(node.aligned, access)
 
     def visit_VectorStoreNode(self, node):
         # Assignment to data pointer
-        store = self.types[node.rhs.type] % 'storeu'
-        return '%s(%s, %s)' % (store, self.visit(node.lhs),
-                               self.visit(node.rhs))
+        type = node.rhs.type
+        if node.remainder is not None:
+            return self.masked_store(node)
+
+        pointer = self.visit(node.lhs)
+        value = self.visit(node.rhs)
+
+        def store(name):
+            if type.element_type.is_int:
+                store = self.int_intrinsic(type, name,
+                                           self.register_suffix(type))
+                return '%s((%s *) %s, %s)' % (store, type, pointer, value)
+
+            return '%s(%s, %s)' % (self.types[type] % name, pointer, value)
+
+        def access(aligned):
+            return store(aligned and 'store' or 'storeu')
+
+        result = self.aligned_access(node.aligned, access)
+        if node.nontemporal is not False:
+            result = '(%s ? %s : %s)' % (self.visit(node.nontemporal),
+                                         store('stream'), result)
+        return result
 
     def visit_VectorBinopNode(self, node):
+        type = node.lhs.type
+        if type.element_type.is_int:
+            return self.int_binop(node.operator, type, self.visit(node.lhs),
+                                  self.visit(node.rhs))
+
+        if node.operator in self.float_comparisons:
+            return self.float_comparison(node.operator, type,
+                                         self.visit(node.lhs),
+                                         self.visit(node.rhs))
+
         binop_name = self.binops[node.operator]
-        func_name =  self.types[node.lhs.type] % binop_name
+        func_name =  self.types[type] % binop_name
         return '%s(%s, %s)' % (func_name, self.visit(node.lhs),
                                           self.visit(node.rhs))
 
+    def int_binop(self, operator, type, lhs, rhs):
+        element_type = type.element_type
+        if operator in self.int_comparisons:
+            return self.int_comparison(operator, type, lhs, rhs)
+        elif operator in ('&', '|', '^'):
+            func_name = self.int_intrinsic(type, self.binops[operator],
+                                           self.register_suffix(type))
+        elif operator == '*':
+            # Keep the low half of the products
+            func_name = self.int_intrinsic(type, 'mullo')
+        elif operator in ('min', 'max') and not element_type.signed:
+            func_name = self.int_intrinsic(
+                        type, operator, 'epu%d' % (element_type.itemsize * 8))
+        else:
+            func_name = self.int_intrinsic(type, self.binops[operator])
+
+        return '%s(%s, %s)' % (func_name, lhs, rhs)
+
     def visit_ConstantVectorNode(self, node):
+        if node.type.element_type.is_int:
+            if node.constant == 0:
+                setzero = self.int_intrinsic(node.type, 'setzero',
+                                             self.register_suffix(node.type))
+                return '%s()' % setzero
+            return self.int_set1(node.type, node.constant)
+
         func_template = self.types[node.type]
         if node.constant == 0:
-            return func_template % 'setzero'
+            return '%s()' % (func_template % 'setzero')
         else:
-            func = func_template % 'set'
-            c = node.constant
-            return '%s(%s, %s, %s, %s)' % (func, c, c, c, c)
\ No newline at end of file
+            return '%s(%s)' % (func_template % 'set1', node.constant)
+
+    def visit_VectorSplatNode(self, node):
+        if node.type.element_type.is_int:
+            return self.int_set1(node.type, self.visit(node.operand))
+
+        func = self.types[node.type] % 'set1'
+        return '%s(%s)' % (func, self.visit(node.operand))
+
+    def visit_VectorExtractNode(self, node):
+        return '((%s *) &%s)[%d]' % (node.type, self.visit(node.operand),
+                                     node.index)
+
+
+class CJitCodeGen(VectorCodegen):
+    """
+    Generate C code and compile it with the C compiler of the context (see
+    :py:class:`minivect.miniast.CJitContext`). The ctypes function is
+    stored in the ``ctypes_func`` attribute of the code writer. It is
+    ``None`` if the context defers builds, in which case the context
+    compiles the code later.
+    """
+
+    function_prefix = "int"
+
+    def visit_FunctionNode(self, node):
+        super(CJitCodeGen, self).visit_FunctionNode(node)
+        self.load_function(node)
+
+    def load_cached_code(self, node, cached_code):
+        if not super(CJitCodeGen, self).load_cached_code(node, cached_code):
+            return False
+
+        self.load_function(node)
+        return True
+
+    def load_function(self, node):
+        if self.context.defer_builds:
+            self.code.ctypes_func = None
+            return
+
+        impl = "".join(self.code.buffer.getvalue())
+        self.code.ctypes_func = self.context.c_compiler.load_function(impl,
+                                                                      node)
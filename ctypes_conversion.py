@@ -64,6 +64,15 @@ def get_ctypes_func(func, llvm_func, llvm_execution_engine, context):
     p = llvm_execution_engine.get_pointer_to_function(llvm_func)
     return ctypes_func_type(p)
 
+def set_function_pointer(ctypes_func, address):
+    """
+    Make a ctypes function call the function at the given address. The
+    address is written with a single pointer-sized store, so threads that
+    call the ctypes function meanwhile call either the old or the new
+    function.
+    """
+    ctypes.c_void_p.from_address(ctypes.addressof(ctypes_func)).value = address
+
 def get_data_pointer(numpy_array, array_type):
     dtype_pointer = array_type.dtype.pointer()
     return numpy_array.ctypes.data_as(convert_to_ctypes(dtype_pointer))
@@ -9,6 +9,7 @@ import time
 import numpy as np
 
 import miniast
+import dispatch
 import specializers
 import minitypes
 import codegen
@@ -62,46 +63,23 @@ class Lazy(object):
         shapevar = b.variable(minitypes.NPyIntp().pointer(), 'shape')
         func = b.build_function(variables, body, 'lazy%d' % func_counter,
                                 shapevar=shapevar)
-
-        # TODO: select an appropriate specializer
-        # specializer = specializers.ContigSpecializer
-        specializer = specializers.StridedCInnerContigSpecializer
-
-        specialized_func, (llvm_func, ctypes_func) = specialize(specializer, func)
         func_counter += 1
 
-        # print specialize_c(specializer, func)[1]
-        # print specialized_func.print_tree(context)
-        print llvm_func
-
-        return ctypes_func, variables, specializer, llvm_func
+        return dispatch.Dispatcher(context, func), variables
 
     def getfunc(self):
-        ctypes_func, variables, specializer, llvm_func = self.map()
-
-        fist_array = variables[0].value
-        shape = fist_array.shape
+        dispatcher, variables = self.map()
         for variable in variables:
-            for dim, extent in enumerate(variable.value.shape):
-                if extent != shape[dim] and extent != 1:
-                    raise ValueError("Differing extents in dim %d (%s, %s)" %
-                                                    (dim, extent, shape[dim]))
-
-        args = [fist_array.ctypes.shape]
-        for variable in variables:
-            if variable.type.is_array:
-                numpy_array = variable.value
-                data_pointer = get_data_pointer(numpy_array, variable.type)
-                args.append(data_pointer)
-                if not specializer.is_contig_specializer:
-                    args.append(numpy_array.ctypes.strides)
-            else:
+            if not variable.type.is_array:
                 raise NotImplementedError
 
-        return ctypes_func, args
+        return dispatcher.prepare(*[variable.value for variable in variables])
 
     def getpointer(self):
-        ctypes_func, variables, specializer, llvm_func = self.map()
+        dispatcher, variables = self.map()
+        specializer = dispatcher.select(*[variable.value
+                                              for variable in variables])
+        _, _, _, (llvm_func, ctypes_func) = dispatcher.compile(specializer)
         return get_pointer(context, llvm_func)
 
     def eval(self):
@@ -0,0 +1,696 @@
+"""
+Select a specialization at call time. A :py:class:`Dispatcher` inspects the
+flags, strides and broadcasting of the operands of each call and routes the
+call to the fastest specialization that is valid for that data layout,
+compiling specializations as they are needed.
+
+The context must produce callable code, i.e. ``(func, ctypes_func)`` pairs
+like the LLVM backend and :py:class:`minivect.miniast.CJitContext`.
+
+For the C backend, :py:class:`CDispatcherGenerator` generates a single
+translation unit with all specializations of a function and an entry point
+that makes the same decision in C.
+"""
+
+import copy
+import operator
+
+import autotune
+import miniast
+import miniutils
+import minicache
+import specializers
+import treepath
+from ctypes_conversion import get_data_pointer, convert_to_ctypes
+
+def broadcast_shape(shapes):
+    """
+    Return the broadcast shape of the given shapes, or raise a ValueError.
+
+    >>> broadcast_shape([(10, 1), (5,), (1, 1)])
+    (10, 5)
+    """
+    ndim = max(len(shape) for shape in shapes)
+    result = [1] * ndim
+    for shape in shapes:
+        offset = ndim - len(shape)
+        for dim, extent in enumerate(shape):
+            if result[offset + dim] == 1:
+                result[offset + dim] = extent
+            elif extent != 1 and extent != result[offset + dim]:
+                raise ValueError("Differing extents in dim %d (%s, %s)" % (
+                                 offset + dim, extent, result[offset + dim]))
+
+    return tuple(result)
+
+class OperandLayout(object):
+    """
+    Data layout of an array operand with respect to the broadcast shape.
+
+    .. attribute:: strides
+
+        the strides in bytes, 0 in broadcasting dimensions
+
+    .. attribute:: broadcasting
+
+        tuple indicating for each dimension whether the operand broadcasts
+    """
+
+    def __init__(self, array, shape):
+        self.shape = shape
+        self.ndim = array.ndim
+        self.offset = len(shape) - array.ndim
+        self.itemsize = array.itemsize
+
+        self.strides = []
+        self.broadcasting = []
+        for dim, (extent, stride) in enumerate(zip(array.shape, array.strides)):
+            broadcasting = extent != shape[self.offset + dim]
+            self.broadcasting.append(broadcasting)
+            self.strides.append(0 if broadcasting else stride)
+
+        self.broadcasting = tuple(self.broadcasting)
+        self.strides = tuple(self.strides)
+
+        no_broadcasting = self.offset == 0 and not miniutils.any(
+                                                        self.broadcasting)
+        self.is_c_contig = no_broadcasting and array.flags['C_CONTIGUOUS']
+        self.is_f_contig = no_broadcasting and array.flags['F_CONTIGUOUS']
+
+    def is_inner_contig(self, order):
+        "Whether the first (F) or last (C) dimension is contiguous"
+        if order == 'C':
+            dim = len(self.shape) - 1
+        else:
+            dim = 0
+
+        if self.shape[dim] <= 1:
+            return True
+        elif dim < self.offset:
+            # leading broadcasting dimension
+            return False
+
+        return self.strides[dim - self.offset] == self.itemsize
+
+    @property
+    def order(self):
+        """
+        The order ('C' or 'F') in which the operand is traversed most
+        efficiently, or None if it does not matter.
+        """
+        strides = [abs(stride) for stride in self.strides if stride]
+        if len(strides) < 2 or strides[0] == strides[-1]:
+            return None
+        elif strides[-1] < strides[0]:
+            return 'C'
+        else:
+            return 'F'
+
+    @property
+    def key(self):
+        "Summary of the layout that determines the specialization"
+        return (self.is_c_contig, self.is_f_contig,
+                self.is_inner_contig('C'), self.is_inner_contig('F'),
+                self.order)
+
+class Dispatcher(object):
+    """
+    Dispatch calls of a minivect function to the fastest valid specialization:
+
+        1) contiguous, if all operands are C contiguous or all are Fortran
+           contiguous and nothing broadcasts
+        2) inner contiguous, if all operands are contiguous in the last (C)
+           or first (Fortran) dimension
+        3) tiled, if operands have mixed C and Fortran layouts (transposes)
+        4) strided otherwise
+
+    The output operands of reductions (see
+    :py:meth:`minivect.miniast.ASTBuilder.reduction`) broadcast in the
+    reduced dimensions. They are not considered for 1) if the function
+    reduces over all dimensions, and not for 2) if it reduces over the
+    first (Fortran) or last (C) dimension.
+
+    If the context optimizes broadcasting, operands whose array type
+    declares them to broadcast in all dimensions are not considered for 1),
+    and operands declared to broadcast in the first (Fortran) or last (C)
+    dimension are not considered for 2). Their elements are loaded outside
+    the contiguous loop (see
+    :py:class:`minivect.optimize.HoistBroadcastingExpressions`).
+
+    Vectorized equivalents of these specializers are preferred if the
+    context supports explicit vectorization and the expression can be
+    vectorized. The widest vectors up to the context's ``max_vector_size``
+    (by default the widest the host supports) are tried first.
+
+    If the context has a tuning table, specializations are compiled with
+    their calibrated OpenMP threshold, and tiled specializations with the
+    tile sizes tuned for the shape of the operands (see
+    :py:mod:`minivect.autotune`).
+
+    Operands are passed in the order of the function's array arguments,
+    followed by its scalar arguments. Array operands are NumPy arrays that
+    broadcast to a common shape. Their number of dimensions and any
+    contiguity or broadcasting declared in the array types must match.
+    Functions with position information (the ``posinfo`` argument of
+    :py:meth:`minivect.miniast.ASTBuilder.function`) are not supported, as
+    the dispatcher only returns the error code of a call.
+
+    :param context: the :py:class:`minivect.miniast.Context` used to compile
+    :param function: the unspecialized :py:class:`minivect.miniast.FunctionNode`
+    """
+
+    contig_specializer = specializers.ContigSpecializer
+    inner_contig_specializers = {
+        'C': specializers.StridedCInnerContigSpecializer,
+        'F': specializers.StridedFortranInnerContigSpecializer,
+    }
+    tiled_specializers = {
+        'C': specializers.CTiledStridedSpecializer,
+        'F': specializers.FTiledStridedSpecializer,
+    }
+    strided_specializers = {
+        'C': specializers.StridedSpecializer,
+        'F': specializers.StridedFortranSpecializer,
+    }
+
+    def __init__(self, context, function, vectorize=True):
+        if function.posinfo:
+            raise ValueError("Functions with position information cannot "
+                             "be dispatched")
+
+        self.context = context
+        self.function = function
+        self.vectorize = vectorize and context.explicit_vectorization
+        self.max_vector_size = context.max_vector_size
+        if self.max_vector_size is None:
+            self.max_vector_size = miniast.host_vector_size()
+
+        self.array_arguments = function.arguments[1:]
+        self.scalar_arguments = function.scalar_arguments
+
+        # output operand name -> reduced axes
+        self.reductions = dict(
+            (node.lhs.name, specializers.reduction_axes(function, node))
+                for node in treepath.iterfind(function, '//ReductionNode'))
+
+        # specializer class -> result of context.run()
+        self.compiled = {}
+        # layout key -> specializer class
+        self.selections = {}
+        # (specializer class, tuning key) -> tuned specializer class
+        self.tunings = {}
+        self.function_digest = minicache.digest(
+                                    minicache.structural_key(function))
+
+    def layouts(self, arrays):
+        "Return the broadcast shape and the OperandLayout of each array"
+        shape = broadcast_shape([array.shape for array in arrays])
+        if len(shape) != self.function.ndim:
+            raise ValueError("Expected %d dimensions, got %d" % (
+                                            self.function.ndim, len(shape)))
+
+        layouts = []
+        for array, arg in zip(arrays, self.array_arguments):
+            layout = OperandLayout(array, shape)
+            self.verify_layout(arg, array, layout)
+            layouts.append(layout)
+
+        return shape, layouts
+
+    def verify_layout(self, arg, array, layout):
+        "Verify that the array matches the declared array type"
+        type = arg.type
+        if array.ndim != type.ndim:
+            raise ValueError("Operand %s has %d dimensions, expected %d" % (
+                                            arg.name, array.ndim, type.ndim))
+        if array.itemsize != type.dtype.itemsize:
+            raise ValueError("Operand %s has itemsize %d, expected %d" % (
+                             arg.name, array.itemsize, type.dtype.itemsize))
+        if ((type.is_c_contig and not array.flags['C_CONTIGUOUS']) or
+                (type.is_f_contig and not array.flags['F_CONTIGUOUS'])):
+            raise ValueError("Operand %s is not contiguous" % arg.name)
+
+        for dim, broadcasting in enumerate(type.broadcasting):
+            if (broadcasting and not layout.broadcasting[dim] and
+                    layout.shape[layout.offset + dim] != 1):
+                raise ValueError(
+                    "Operand %s is declared to broadcast in dimension %d" % (
+                                                            arg.name, dim))
+
+    def candidates(self, layouts):
+        "Return the valid specializer classes for the layouts, fastest first"
+        result = []
+        ndim = self.function.ndim
+        full_reductions = miniutils.all(
+            len(axes) == ndim for axes in self.reductions.itervalues())
+        contig_layouts = [layout for arg, layout in zip(self.array_arguments,
+                                                        layouts)
+                              if arg.name not in self.reductions and
+                                 not specializers.broadcasts_in_inner_dim(
+                                    self.context, self.function, arg.type)]
+        if full_reductions and (
+                miniutils.all(layout.is_c_contig for layout in contig_layouts) or
+                miniutils.all(layout.is_f_contig for layout in contig_layouts)):
+            result.append(self.contig_specializer)
+
+        for order, inner_dim in (('C', ndim - 1), ('F', 0)):
+            if miniutils.all(
+                    layout.is_inner_contig(order) or
+                    inner_dim in self.reductions.get(arg.name, ()) or
+                    specializers.broadcasts_in_inner_dim(
+                            self.context, self.function, arg.type, order)
+                        for arg, layout in zip(self.array_arguments, layouts)):
+                result.append(self.inner_contig_specializers[order])
+
+        orders = [layout.order for layout in layouts if layout.order]
+        preferred_order = orders and orders[0] or 'C'
+        if self.function.ndim >= 2 and len(set(orders)) > 1:
+            result.append(self.tiled_specializers[preferred_order])
+
+        result.append(self.strided_specializers[preferred_order])
+
+        return [cls for specializer_cls in result
+                        for cls in self.vectorized_candidates(specializer_cls)]
+
+    def vectorized_candidates(self, specializer_cls):
+        """
+        Return the vectorized equivalents (widest first) of a specializer
+        that are applicable, followed by the specializer itself.
+        """
+        result = []
+        if self.vectorize and specializer_cls.vectorized_equivalents:
+            for vectorized_cls in specializer_cls.vectorized_equivalents[::-1]:
+                if (vectorized_cls.vector_size <= self.max_vector_size
+                        and vectorized_cls.can_vectorize(self.context,
+                                                         self.function)):
+                    result.append(vectorized_cls)
+
+        result.append(specializer_cls)
+        return result
+
+    def select(self, *operands):
+        "Return the specializer class to be used for the given operands"
+        arrays = operands[:len(self.array_arguments)]
+        shape, layouts = self.layouts(arrays)
+        return self._select(layouts)
+
+    def _select(self, layouts):
+        key = tuple(layout.key for layout in layouts)
+        if key not in self.selections:
+            self.selections[key] = self.candidates(layouts)[0]
+
+        return self.selections[key]
+
+    def tuning_key(self, specializer_cls, shape):
+        "Return the key of the tuned tile sizes for a tiled specializer"
+        return autotune.tuning_key(specializer_cls,
+                                   self.array_arguments[0].type.dtype, shape)
+
+    def kernel_key(self, specializer_cls):
+        "Return the key of the OpenMP threshold of a specialization"
+        return autotune.kernel_key(specializer_cls, self.function_digest)
+
+    def tuned(self, specializer_cls, shape):
+        """
+        Return the specializer with the OpenMP threshold calibrated for the
+        function and, if tiled, the tile sizes tuned for the shape on this
+        machine (see :py:mod:`minivect.autotune`), if the context has a
+        tuning table with such entries. Otherwise return the specializer
+        itself.
+        """
+        table = self.context.tuning_table
+        if table is None:
+            return specializer_cls
+
+        tuning_key = None
+        if specializer_cls.is_tiled_specializer:
+            tuning_key = self.tuning_key(specializer_cls, shape)
+
+        key = specializer_cls, tuning_key
+        if key not in self.tunings:
+            blocksizes = omp_size = None
+            if tuning_key is not None:
+                blocksizes = table.get(tuning_key)
+            if self.function_digest is not None:
+                omp_size = table.get(self.kernel_key(specializer_cls))
+
+            if blocksizes is None and omp_size is None:
+                self.tunings[key] = specializer_cls
+            else:
+                self.tunings[key] = autotune.tuned_specializer(
+                                    specializer_cls, blocksizes, omp_size)
+
+        return self.tunings[key]
+
+    def compile(self, specializer_cls):
+        """
+        Specialize the function with the given specializer class, and
+        return the result of :py:meth:`minivect.miniast.Context.run`.
+        """
+        if specializer_cls not in self.compiled:
+            result = iter(self.context.run(self.function,
+                                           [specializer_cls])).next()
+            self.compiled[specializer_cls] = result
+
+        return self.compiled[specializer_cls]
+
+    def prepare(self, *operands):
+        """
+        Select and compile a specialization for the operands and return
+        the ctypes function with its arguments. Use this to call the same
+        specialization repeatedly without any dispatch overhead.
+        """
+        n_arrays = len(self.array_arguments)
+        if len(operands) != n_arrays + len(self.scalar_arguments):
+            raise TypeError("Expected %d operands, got %d" % (
+                    n_arrays + len(self.scalar_arguments), len(operands)))
+
+        arrays, scalars = operands[:n_arrays], operands[n_arrays:]
+        shape, layouts = self.layouts(arrays)
+        specializer_cls = self.tuned(self._select(layouts), shape)
+        return self._prepare(specializer_cls, shape, layouts, arrays, scalars)
+
+    def prepare_specializer(self, specializer_cls, *operands):
+        """
+        Like :py:meth:`prepare`, but use the given specializer class, which
+        must be valid for the operands.
+        """
+        n_arrays = len(self.array_arguments)
+        arrays, scalars = operands[:n_arrays], operands[n_arrays:]
+        shape, layouts = self.layouts(arrays)
+        return self._prepare(specializer_cls, shape, layouts, arrays, scalars)
+
+    def _prepare(self, specializer_cls, shape, layouts, arrays, scalars):
+        specializer, specialized_ast, codewriter, (_, ctypes_func) = (
+                                            self.compile(specializer_cls))
+
+        shape_type = convert_to_ctypes(self.function.shape.type.base_type)
+        args = [(shape_type * len(shape))(*shape)]
+        for arg, array, layout in zip(self.array_arguments, arrays, layouts):
+            args.append(get_data_pointer(array, arg.type))
+            if not specializer.is_contig_specializer:
+                strides_type = convert_to_ctypes(
+                                    arg.strides_pointer.type.base_type)
+                args.append((strides_type * len(layout.strides))(
+                                                    *layout.strides))
+
+        for arg, scalar in zip(self.scalar_arguments, scalars):
+            args.append(convert_to_ctypes(arg.type)(scalar))
+
+        return ctypes_func, args
+
+    def outer_dimension(self, shape, layouts):
+        "Return the outermost dimension in the order of the operands"
+        orders = [layout.order for layout in layouts if layout.order]
+        if orders and orders[0] == 'F':
+            return len(shape) - 1
+        else:
+            return 0
+
+    def slice_operands(self, operands, layouts, dim, start, stop):
+        """
+        Return the operands with the array operands sliced from start to
+        stop in dimension dim of the broadcast shape. Operands that
+        broadcast in that dimension are not sliced.
+        """
+        result = list(operands)
+        for i, layout in enumerate(layouts):
+            array_dim = dim - layout.offset
+            if array_dim >= 0 and not layout.broadcasting[array_dim]:
+                index = [slice(None)] * layout.ndim
+                index[array_dim] = slice(start, stop)
+                result[i] = operands[i][tuple(index)]
+
+        return tuple(result)
+
+    def chunks(self, *operands):
+        """
+        Split the operands along the outermost dimension into chunks of
+        about the context's ``thread_chunk_size`` elements. Returns None if
+        the call should not be split: if the context's ``thread_pool_size``
+        is less than two, the operands are too small, a reduction reduces
+        over the outermost dimension, or slicing would break the declared
+        contiguity of an operand.
+        """
+        if self.context.thread_pool_size < 2:
+            return None
+
+        n_arrays = len(self.array_arguments)
+        shape, layouts = self.layouts(operands[:n_arrays])
+        dim = self.outer_dimension(shape, layouts)
+        size = reduce(operator.mul, shape, 1)
+        n_chunks = min(shape[dim], size // self.context.thread_chunk_size)
+        if n_chunks < 2:
+            return None
+
+        for axes in self.reductions.itervalues():
+            if dim in axes:
+                return None
+
+        for arg, layout in zip(self.array_arguments, layouts):
+            array_dim = dim - layout.offset
+            if array_dim < 0:
+                continue
+            if ((arg.type.is_c_contig and array_dim > 0) or
+                    (arg.type.is_f_contig and array_dim < layout.ndim - 1)):
+                return None
+
+        bounds = [shape[dim] * i // n_chunks for i in range(n_chunks + 1)]
+        return [self.slice_operands(operands, layouts, dim, start, stop)
+                    for start, stop in zip(bounds[:-1], bounds[1:])]
+
+    def __call__(self, *operands):
+        chunks = self.chunks(*operands)
+        if chunks is None:
+            ctypes_func, args = self.prepare(*operands)
+            return ctypes_func(*args)
+
+        # Compile in this thread, ctypes releases the GIL during the calls
+        calls = [self.prepare(*chunk) for chunk in chunks]
+        results = self.context.thread_pool.map(_call, calls)
+        for result in results:
+            if result != self.function.success_value.value:
+                return result
+
+        return results[0]
+
+def _call(call):
+    ctypes_func, args = call
+    return ctypes_func(*args)
+
+def layout_kind(specializer_cls):
+    """
+    Return the kind of data layout a specializer handles: 'contig',
+    'inner_contig', 'tiled' or 'strided'.
+    """
+    if specializer_cls.is_contig_specializer:
+        return 'contig'
+    elif specializer_cls.is_tiled_specializer:
+        return 'tiled'
+    elif specializer_cls.is_strided_specializer:
+        return 'strided'
+    else:
+        return 'inner_contig'
+
+dispatch_helpers = """
+#ifndef __MINI_DISPATCH_HELPERS
+#define __MINI_DISPATCH_HELPERS
+/* Whether an operand with ndim dimensions (broadcasting in the leading
+   dimensions of shape) is contiguous in C (c_order) or Fortran order */
+static int __mini_mangle_is_contig(const Py_ssize_t *shape, int shape_ndim,
+                                   const Py_ssize_t *strides, int ndim,
+                                   Py_ssize_t itemsize, int c_order) {
+    int i, dim, offset = shape_ndim - ndim;
+    Py_ssize_t stride = itemsize;
+    for (i = 0; i < shape_ndim; i++) {
+        dim = c_order ? shape_ndim - i - 1 : i;
+        if (shape[dim] == 1)
+            continue;
+        if (dim < offset || strides[dim - offset] != stride)
+            return 0;
+        stride *= shape[dim];
+    }
+    return 1;
+}
+
+/* Whether the last (c_order) or first dimension is contiguous */
+static int __mini_mangle_is_inner_contig(const Py_ssize_t *shape,
+                                         int shape_ndim,
+                                         const Py_ssize_t *strides, int ndim,
+                                         Py_ssize_t itemsize, int c_order) {
+    int dim = c_order ? shape_ndim - 1 : 0, offset = shape_ndim - ndim;
+    if (shape[dim] <= 1)
+        return 1;
+    return dim >= offset && strides[dim - offset] == itemsize;
+}
+
+/* The order in which an operand is traversed most efficiently: 'C', 'F',
+   or 0 if it does not matter */
+static char __mini_mangle_order(const Py_ssize_t *strides, int ndim) {
+    Py_ssize_t first = 0, last = 0;
+    int i, n = 0;
+    for (i = 0; i < ndim; i++) {
+        if (strides[i]) {
+            last = strides[i] < 0 ? -strides[i] : strides[i];
+            if (!n++)
+                first = last;
+        }
+    }
+    if (n < 2 || first == last)
+        return 0;
+    return last < first ? 'C' : 'F';
+}
+#endif
+"""
+
+class CDispatcherGenerator(object):
+    """
+    Generate one C translation unit with the specializations of a function
+    for the given specializer classes, and an entry point that checks the
+    shape and strides at runtime and calls the best applicable
+    specialization, in the same order of preference as
+    :py:class:`Dispatcher`. This lets embedders call a single symbol.
+
+    The entry point takes the arguments of a strided specialization:
+    the shape, the data and strides pointers of each array operand, and the
+    scalar arguments. Strides must be 0 in broadcasting dimensions. If no
+    specialization applies (e.g. only a contiguous specialization was
+    generated), the function's error value is returned. Usage::
+
+        generator = CDispatcherGenerator(context)
+        proto, impl = generator.generate(function, specializer_classes)
+    """
+
+    rank = dict(contig=0, inner_contig=1, tiled=2, strided=3)
+
+    def __init__(self, context):
+        self.context = context
+
+    def generate(self, function, specializer_classes, name=None):
+        """
+        Return the prototype and implementation of the entry point named
+        ``name`` (the function name by default) along with the
+        specializations it calls.
+        """
+        results = list(self.context.run(function, specializer_classes))
+        results.sort(key=lambda result: self.preference(result[0]))
+
+        # Render the arguments of the unspecialized function
+        function = copy.deepcopy(function)
+        codegen = self.context.codegen_cls(self.context,
+                                           self.context.codewriter_cls(
+                                                                self.context))
+        args = codegen.results(function.arguments + function.scalar_arguments)
+        proto = "int %s(%s)" % (name or function.name, ", ".join(args))
+
+        body, used_asts = self.dispatch(function, codegen, results)
+        impl = [dispatch_helpers]
+        for specializer, specialized_ast, codewriter, (_, variant) in results:
+            if id(specialized_ast) in used_asts:
+                impl.append(variant)
+
+        impl.append(proto + " {")
+        impl.extend(body)
+        impl.append("}\n")
+        return proto + ';\n', "\n".join(impl)
+
+    def preference(self, specializer):
+        "Sort key for a specializer (class), most preferred first"
+        return (self.rank[layout_kind(specializer)],
+                getattr(specializer, 'order', 'C') != 'C',
+                -getattr(specializer, 'vector_size', 0))
+
+    def dispatch(self, function, codegen, results):
+        """
+        Return the lines of the body of the entry point, and the ids of the
+        specialized ASTs it calls. Specializations that can never be
+        selected are left out.
+        """
+        shape = codegen.visit(function.shape)
+        array_args = function.arguments[1:]
+        lines = []
+
+        def all_operands(check, c_order, order=None):
+            # Skip operands that are loaded outside the contiguous loop
+            return " && ".join(
+                "__mini_mangle_%s(%s, %d, %s, %d, sizeof(%s), %d)" % (
+                    check, shape, function.ndim,
+                    codegen.visit(arg.strides_pointer), arg.type.ndim,
+                    arg.type.dtype, c_order)
+                        for arg in array_args
+                            if not specializers.broadcasts_in_inner_dim(
+                                    self.context, function, arg.type,
+                                    order)) or "1"
+
+        orders = ["__mini_mangle_order(%s, %d)" % (
+                        codegen.visit(arg.strides_pointer), arg.type.ndim)
+                            for arg in array_args]
+        lines.append("    char __mini_mangle_orders[] = { %s };" %
+                                                        ", ".join(orders))
+        lines.append("    char __mini_mangle_preferred_order = 0;")
+        lines.append("    int __mini_mangle_mixed = 0, __mini_mangle_i;")
+        lines.append("    for (__mini_mangle_i = %d; __mini_mangle_i >= 0; "
+                     "__mini_mangle_i--) {" % (len(orders) - 1))
+        lines.append("        if (__mini_mangle_orders[__mini_mangle_i]) {")
+        lines.append("            __mini_mangle_mixed |= "
+                     "__mini_mangle_preferred_order && "
+                     "__mini_mangle_preferred_order != "
+                     "__mini_mangle_orders[__mini_mangle_i];")
+        lines.append("            __mini_mangle_preferred_order = "
+                     "__mini_mangle_orders[__mini_mangle_i];")
+        lines.append("        }")
+        lines.append("    }")
+        lines.append("    if (!__mini_mangle_preferred_order)")
+        lines.append("        __mini_mangle_preferred_order = 'C';")
+
+        contig_condition = "(%s) || (%s)" % (all_operands('is_contig', 1),
+                                             all_operands('is_contig', 0))
+        # condition -> id of the specialized ast
+        conditions = {}
+        fallback = None
+        for specializer, specialized_ast, codewriter, code_obj in results:
+            kind = layout_kind(specializer)
+            c_order = int(getattr(specializer, 'order', 'C') == 'C')
+            if kind == 'contig':
+                condition = contig_condition
+            elif kind == 'inner_contig':
+                condition = all_operands('is_inner_contig', c_order,
+                                         specializer.order)
+            elif kind == 'tiled':
+                condition = ("__mini_mangle_mixed && "
+                             "__mini_mangle_preferred_order == '%s'" %
+                                                    specializer.order)
+            else:
+                condition = ("__mini_mangle_preferred_order == '%s'" %
+                                                    specializer.order)
+
+            if condition in conditions:
+                # e.g. a vectorized specialization that precedes it
+                continue
+
+            conditions[condition] = id(specialized_ast)
+            call = self.call(function, codegen, specialized_ast,
+                             contig=kind == 'contig')
+            lines.append("    if (%s)" % condition)
+            lines.append("        return %s;" % call)
+            if kind in ('tiled', 'strided') and fallback is None:
+                fallback = call
+
+        if fallback is None:
+            fallback = codegen.visit(function.error_value)
+
+        lines.append("    return %s;" % fallback)
+        return lines, set(conditions.values())
+
+    def call(self, function, codegen, specialized_ast, contig):
+        "Return a call to a specialization"
+        args = [codegen.visit(function.shape)]
+        for arg in function.arguments[1:]:
+            args.append(codegen.visit(arg.data_pointer))
+            if not contig:
+                args.append(codegen.visit(arg.strides_pointer))
+
+        args.extend(codegen.visit(variable)
+                        for arg in function.scalar_arguments
+                            for variable in arg.variables)
+        return "%s(%s)" % (specialized_ast.mangled_name, ", ".join(args))
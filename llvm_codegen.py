@@ -1,4 +1,5 @@
 import sys
+import StringIO
 
 try:
     import llvm.core
@@ -11,7 +12,6 @@ import codegen
 import minierror
 import minitypes
 import minivisitor
-import ctypes_conversion
 
 class LLVMCodeGen(codegen.CodeGen):
 
@@ -26,6 +26,7 @@ class LLVMCodeGen(codegen.CodeGen):
         self.blocks = []
         self.symtab = {}
         self.llvm_temps = {}
+        self.string_constants = {}
 
         import llvm # raise an error at this point if llvm-py is not installed
 
@@ -38,35 +39,23 @@ class LLVMCodeGen(codegen.CodeGen):
         self.blocks.append(bb)
         return bb
 
-    def optimize(self):
-        llvm_fpm = llvm.passes.FunctionPassManager.new(self.llvm_module)
-        for llvm_pass in self.context.llvm_passes():
-            llvm_fpm.add(llvm_pass)
-
-        llvm_fpm.initialize()
-        llvm_fpm.run(self.lfunc)
-        llvm_fpm.finalize()
-
-        # self.context.llvm_fpm.run(self.lfunc)
-
-    def optimize(self):
-        llvm_fpm = llvm.passes.FunctionPassManager.new(self.llvm_module)
-        # target_data = llvm.ee.TargetData(self.context.llvm_ee)
-        llvm_fpm.add(self.context.llvm_ee.target_data)
-        pmb = llvm.passes.PassManagerBuilder.new()
-        pmb.opt_level = 3
-        pmb.vectorize = True
-
-        pmb.populate(llvm_fpm)
-        llvm_fpm.run(self.lfunc)
-
     def visit_FunctionNode(self, node):
+        """
+        Generate the function in a new module, which is linked into a
+        module of the execution engine after optimization (see
+        :py:class:`minivect.llvm_modules.ModuleManager`).
+        """
+        with self.context.llvm_modules.lock:
+            self.generate_function(node)
+
+    def generate_function(self, node):
         self.specializer = node.specializer
         self.function = node
-        self.llvm_module = self.context.llvm_module
 
-        name = node.name + node.specialization_name
+        name = self.context.mangle_function_name(node.name +
+                                                 node.specialization_name)
         node.mangled_name = name
+        self.llvm_module = self.context.llvm_modules.new_module(name)
 
         lfunc_type = node.type.to_llvm(self.context)
         self.lfunc = self.llvm_module.add_function(lfunc_type, node.mangled_name)
@@ -78,14 +67,54 @@ class LLVMCodeGen(codegen.CodeGen):
         self.visit(node.body)
 
         self.lfunc.verify()
-        self.optimize()
+        self.context.llvm_modules.optimize(self.llvm_module)
         # print self.lfunc
 
+        self.bitcode = None
+        if self.context.kernel_cache is not None:
+            bitcode = StringIO.StringIO()
+            self.llvm_module.to_bitcode(bitcode)
+            self.bitcode = bitcode.getvalue()
+
+        self.link_function(node)
+
+    def link_function(self, node):
+        """
+        Link the module with the generated function into a module of the
+        execution engine and write the function and its ctypes equivalent.
+        """
+        self.lfunc, ctypes_func = self.context.llvm_modules.add(
+                                                self.llvm_module, node)
         self.code.write(self.lfunc)
-        ctypes_func = ctypes_conversion.get_ctypes_func(
-                    node, self.lfunc, self.context.llvm_ee, self.context)
         self.code.write(ctypes_func)
 
+    def dump_cached_code(self, node):
+        if self.bitcode is None:
+            return None
+        return dict(backend='llvm', name=node.mangled_name,
+                    bitcode=self.bitcode)
+
+    def load_cached_code(self, node, cached_code):
+        if cached_code.get('backend') != 'llvm':
+            return False
+
+        self.function = node
+        with self.context.llvm_modules.lock:
+            self.llvm_module = llvm.core.Module.from_bitcode(
+                                StringIO.StringIO(cached_code['bitcode']))
+
+            # Rename the function, its old name may already be taken
+            name = self.context.mangle_function_name(node.name +
+                                                     node.specialization_name)
+            self.lfunc = self.llvm_module.get_function_named(
+                                                    cached_code['name'])
+            self.lfunc.name = name
+            node.mangled_name = name
+
+            self.link_function(node)
+
+        return True
+
     def add_arguments(self, function):
         i = 0
         for arg in function.arguments + function.scalar_arguments:
@@ -150,7 +179,7 @@ class LLVMCodeGen(codegen.CodeGen):
         else:
             bb_false = bb_endif
 
-        self.builder.cbranch(test, bb_true, bb_false)
+        self.builder.cbranch(cond, bb_true, bb_false)
 
         # if cond
         self.builder.position_at_end(bb_true)
@@ -166,6 +195,10 @@ class LLVMCodeGen(codegen.CodeGen):
         # endif
         self.builder.position_at_end(bb_endif)
 
+    def visit_IfElseExprNode(self, node):
+        return self.builder.select(self.visit(node.cond), self.visit(node.lhs),
+                                   self.visit(node.rhs))
+
     def visit_ReturnNode(self, node):
         self.builder.ret(self.visit(node.operand))
 
@@ -389,13 +422,13 @@ class LLVMCodeGen(codegen.CodeGen):
     def handle_string_constant(self, b, constant):
         #lchar = minitypes.char.to_llvm(self.context)
         #ltype = llvm.core.Type.array(lchar, len(constant) + 1)
-        string_constants = self.context.string_constants = getattr(
-                                    self.context, 'string_constants', {})
+        # String constants are globals of the module of this function
+        string_constants = self.string_constants
         if constant in string_constants:
             lvalue = string_constants[constant]
         else:
             lstring = llvm.core.Constant.stringz(constant)
-            lvalue = self.context.llvm_module.add_global_variable(
+            lvalue = self.llvm_module.add_global_variable(
                         lstring.type, "__string_%d" % len(string_constants))
             lvalue.initializer = lstring
             lvalue.linkage = llvm.core.LINKAGE_INTERNAL
@@ -433,12 +466,144 @@ class LLVMCodeGen(codegen.CodeGen):
 
     def visit_FuncNameNode(self, node):
         try:
-            printf = self.context.llvm_module.get_function_named('printf')
+            func = self.llvm_module.get_function_named(node.name)
         except llvm.LLVMException:
             func_type = node.type.to_llvm(self.context)
-            printf = self.context.llvm_module.add_function(func_type, node.name)
+            func = self.llvm_module.add_function(func_type, node.name)
 
-        return printf
+        return func
 
     def visit_FuncRefNode(self, node):
-        raise NotImplementedError
\ No newline at end of file
+        raise NotImplementedError
+
+    #
+    ### Vector nodes, see specializers.VectorizingSpecializer
+    #
+
+    def lane(self, index):
+        return llvm.core.Constant.int(llvm.core.Type.int(32), index)
+
+    def vector_pointer(self, pointer, type):
+        "Cast a pointer to the first element of a vector to a vector pointer"
+        lpointer_type = llvm.core.Type.pointer(type.to_llvm(self.context))
+        return self.builder.bitcast(self.visit(pointer), lpointer_type)
+
+    def alignment(self, aligned, type):
+        """
+        Vectors are aligned to their size if known to be aligned. Runtime
+        alignment checks are not evaluated, the vector is accessed
+        unaligned.
+        """
+        if aligned is True:
+            return type.vector_size * 4
+        return type.element_type.itemsize
+
+    def unsupported(self, node, what):
+        raise minierror.CompileError(
+                node, "%s are not supported by the LLVM backend" % what)
+
+    def visit_VectorVariable(self, node):
+        return self.visit(node.variable)
+
+    def visit_VectorLoadNode(self, node):
+        if node.remainder is not None:
+            self.unsupported(node, "Masked vector loads")
+        elif node.stride is not None:
+            return self.gather(node)
+
+        load = self.builder.load(self.vector_pointer(node.operand, node.type))
+        load.alignment = self.alignment(node.aligned, node.type)
+        return load
+
+    def gather(self, node):
+        "Load the elements of a vector that are node.stride elements apart"
+        pointer = self.visit(node.operand)
+        stride = self.visit(node.stride)
+
+        result = llvm.core.Constant.undef(node.type.to_llvm(self.context))
+        for i in range(node.type.element_count):
+            index = self.builder.mul(stride,
+                                     llvm.core.Constant.int(stride.type, i))
+            element = self.builder.load(self.builder.gep(pointer, [index]))
+            result = self.builder.insert_element(result, element,
+                                                 self.lane(i))
+
+        return result
+
+    def visit_VectorStoreNode(self, node):
+        # Non-temporal stores are regular stores
+        if node.remainder is not None:
+            self.unsupported(node, "Masked vector stores")
+
+        type = node.rhs.type
+        pointer = self.vector_pointer(node.lhs, type)
+        store = self.builder.store(self.visit(node.rhs), pointer)
+        store.alignment = self.alignment(node.aligned, type)
+        return store
+
+    def vector_compare(self, operator, element_type, lhs, rhs):
+        "Compare vectors into a vector of i1"
+        if element_type.is_float:
+            return self.builder.fcmp(self._compare_mapping_float[operator],
+                                     lhs, rhs)
+        elif element_type.signed:
+            return self.builder.icmp(self._compare_mapping_sint[operator],
+                                     lhs, rhs)
+        else:
+            return self.builder.icmp(self._compare_mapping_uint[operator],
+                                     lhs, rhs)
+
+    def visit_VectorBinopNode(self, node):
+        type = node.lhs.type
+        element_type = type.element_type
+        lhs = self.visit(node.lhs)
+        rhs = self.visit(node.rhs)
+
+        operator = node.operator
+        if operator in ('min', 'max'):
+            compare = operator == 'min' and '<' or '>'
+            mask = self.vector_compare(compare, element_type, lhs, rhs)
+            return self.builder.select(mask, lhs, rhs)
+        elif operator in self._compare_mapping_float:
+            # Like the scalar comparisons, this results in 1 or 0
+            mask = self.vector_compare(operator, element_type, lhs, rhs)
+            ltype = type.to_llvm(self.context)
+            if element_type.is_float:
+                return self.builder.uitofp(mask, ltype)
+            return self.builder.zext(mask, ltype)
+
+        if element_type.is_float:
+            llvm_method_name = self._binops[operator][0]
+        else:
+            llvm_method_name = self._binops[operator][1 + element_type.signed]
+
+        return getattr(self.builder, llvm_method_name)(lhs, rhs)
+
+    def visit_ConstantVectorNode(self, node):
+        element_type = node.type.element_type
+        lelement_type = element_type.to_llvm(self.context)
+        if element_type.is_float:
+            lconstant = llvm.core.Constant.real(lelement_type, node.constant)
+        else:
+            lconstant = llvm.core.Constant.int(lelement_type, node.constant)
+
+        return llvm.core.Constant.vector(
+                        [lconstant] * node.type.element_count)
+
+    def visit_VectorSplatNode(self, node):
+        type = node.type
+        ltype = type.to_llvm(self.context)
+        vector = self.builder.insert_element(
+                    llvm.core.Constant.undef(ltype), self.visit(node.operand),
+                    self.lane(0))
+
+        # Shuffle the first element into all elements
+        lmask_type = llvm.core.Type.vector(llvm.core.Type.int(32),
+                                           type.element_count)
+        return self.builder.shuffle_vector(vector,
+                                           llvm.core.Constant.undef(ltype),
+                                           llvm.core.Constant.null(lmask_type))
+
+    def visit_VectorExtractNode(self, node):
+        return self.builder.extract_element(self.visit(node.operand),
+                                            self.lane(node.index))
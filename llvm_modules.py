@@ -0,0 +1,247 @@
+"""
+Management of the LLVM modules of JIT compiled kernels.
+
+Kernels are optimized by a single pass pipeline shared by all kernels, and
+are linked in batches into modules of the execution engine. Once a batch is
+full and the ctypes functions of all its kernels have been garbage
+collected, its module is removed from the execution engine. The memory use
+of a process that compiles many kernels is therefore bounded by the kernels
+it still references, e.g. through the specialization cache of the context.
+
+With tiered compilation, kernels are first optimized by a cheap pipeline,
+so that they can be called right away. A background thread then
+recompiles them with the full pipeline, and makes their ctypes functions
+call the optimized code (see
+:py:func:`minivect.ctypes_conversion.set_function_pointer`).
+"""
+
+import weakref
+import StringIO
+import threading
+import multiprocessing.pool
+
+try:
+    import llvm.core
+    import llvm.ee
+    import llvm.passes
+except ImportError:
+    llvm = None
+
+import ctypes_conversion
+
+class ModuleBatch(object):
+    """
+    A module of the execution engine holding a batch of kernels.
+
+    .. attribute:: size
+
+        The number of kernels linked into the module
+
+    .. attribute:: live
+
+        The number of kernels whose ctypes functions are still referenced
+    """
+
+    def __init__(self, module):
+        self.module = module
+        self.size = 0
+        self.live = 0
+        self.refs = set()
+
+    def track(self, ctypes_func):
+        "Track the ctypes function of a kernel linked into the module"
+        self.size += 1
+        self.live += 1
+        self.refs.add(weakref.ref(ctypes_func, self.release))
+
+    def release(self, ref):
+        self.refs.discard(ref)
+        self.live -= 1
+
+class ModuleManager(object):
+    """
+    Own the execution engine, the shared optimization pipeline and the
+    modules of the kernels.
+
+    :param target_machine: the LLVM target machine to generate code for
+    :param passes: extra passes run after the standard pipeline
+    :param batch_size: the number of kernels linked into a module before
+                       a new module is started
+    :param tiered: whether to compile kernels with the pipeline of
+                   ``tier0_opt_level`` first, and recompile them in the
+                   background
+
+    LLVM is not thread-safe, code that creates LLVM objects must hold
+    :py:attr:`lock`.
+
+    .. attribute:: default_module
+
+        The initial module of the execution engine. It is never freed and
+        may be used for code that is not managed by this class.
+
+    .. attribute:: batches
+
+        The :py:class:`ModuleBatch` objects in the execution engine, the
+        last one receiving newly added kernels
+
+    .. attribute:: lock
+
+        Reentrant lock serializing the use of LLVM
+    """
+
+    opt_level = 3
+    tier0_opt_level = 1
+    batch_size = 16
+
+    def __init__(self, target_machine, passes=(), batch_size=None,
+                 tiered=False):
+        self.target_machine = target_machine
+        if batch_size is not None:
+            self.batch_size = batch_size
+
+        self.tiered = tiered
+        self.lock = threading.RLock()
+        self.pending = []
+        self._recompile_pool = None
+
+        self.default_module = self.new_module('default_module')
+        builder = llvm.ee.EngineBuilder.new(self.default_module)
+        self.engine = builder.force_jit().opt(self.opt_level).create(
+                                                        target_machine)
+        self.pass_manager = self.create_pass_manager(self.opt_level, True,
+                                                     passes)
+        self.tier0_pass_manager = self.create_pass_manager(
+                                    self.tier0_opt_level, False, ())
+
+        self.batch_counter = 0
+        self.batches = []
+        self.new_batch()
+
+    def new_module(self, name):
+        "Create a module for the target machine"
+        module = llvm.core.Module.new(name)
+        module.target = self.target_machine.triple
+        module.data_layout = str(self.target_machine.target_data)
+        return module
+
+    def create_pass_manager(self, opt_level, vectorize, passes):
+        pass_manager = llvm.passes.PassManager.new()
+        pass_manager.add(self.target_machine.target_data)
+
+        pmb = llvm.passes.PassManagerBuilder.new()
+        pmb.opt_level = opt_level
+        pmb.vectorize = vectorize
+        pmb.populate(pass_manager)
+
+        for llvm_pass in passes:
+            pass_manager.add(llvm_pass)
+
+        return pass_manager
+
+    def optimize(self, module):
+        """
+        Optimize a module with the shared pipeline, or with the pipeline of
+        the first tier if compilation is tiered
+        """
+        if self.tiered:
+            self.tier0_pass_manager.run(module)
+        else:
+            self.pass_manager.run(module)
+
+    @property
+    def recompile_pool(self):
+        "The thread recompiling kernels"
+        if self._recompile_pool is None:
+            self._recompile_pool = multiprocessing.pool.ThreadPool(1)
+        return self._recompile_pool
+
+    def new_batch(self):
+        module = self.new_module('batch_%d' % self.batch_counter)
+        self.batch_counter += 1
+        self.engine.add_module(module)
+        self.batches.append(ModuleBatch(module))
+
+    def add(self, module, function):
+        """
+        Link a module holding the function of a kernel into the current
+        batch, and return the LLVM function and its ctypes function. The
+        module is consumed.
+
+        :param function: the :py:class:`minivect.miniast.FunctionNode` of
+                         the kernel
+        """
+        with self.lock:
+            bitcode = None
+            if self.tiered:
+                bitcode = StringIO.StringIO()
+                module.to_bitcode(bitcode)
+
+            lfunc, pointer = self.link(module, function.mangled_name)
+            ctypes_func_type = ctypes_conversion.convert_to_ctypes(
+                                                        function.type)
+            ctypes_func = ctypes_func_type(pointer)
+            self.track(ctypes_func)
+
+            if bitcode is not None:
+                self.pending = [result for result in self.pending
+                                           if not result.ready()]
+                self.pending.append(self.recompile_pool.apply_async(
+                    self.recompile, (bitcode.getvalue(), function.mangled_name,
+                                     weakref.ref(ctypes_func))))
+
+        return lfunc, ctypes_func
+
+    def recompile(self, bitcode, name, ctypes_func_ref):
+        """
+        Optimize the function ``name`` of a module in bitcode with the full
+        pipeline, and make the ctypes function call the result. Nothing is
+        done if the ctypes function was garbage collected.
+        """
+        with self.lock:
+            ctypes_func = ctypes_func_ref()
+            if ctypes_func is None:
+                return
+
+            module = llvm.core.Module.from_bitcode(StringIO.StringIO(bitcode))
+            optimized_name = name + '_optimized'
+            module.get_function_named(name).name = optimized_name
+            self.pass_manager.run(module)
+
+            lfunc, pointer = self.link(module, optimized_name)
+            # The unoptimized code is kept, other threads may be running it
+            self.track(ctypes_func)
+            ctypes_conversion.set_function_pointer(ctypes_func, pointer)
+
+    def wait(self):
+        "Wait until all kernels are recompiled"
+        while self.pending:
+            self.pending.pop(0).get()
+
+    def link(self, module, name):
+        """
+        Link a module into the current batch and return the LLVM function
+        ``name`` and its address.
+        """
+        batch = self.batches[-1]
+        batch.module.link_in(module)
+        lfunc = batch.module.get_function_named(name)
+        return lfunc, self.engine.get_pointer_to_function(lfunc)
+
+    def track(self, ctypes_func):
+        """
+        Track a kernel linked into the current batch. Starts a new batch if
+        the current one is full and frees unreferenced batches.
+        """
+        batch = self.batches[-1]
+        batch.track(ctypes_func)
+        if batch.size >= self.batch_size:
+            self.new_batch()
+
+        self.collect()
+
+    def collect(self):
+        "Remove the full batches whose kernels are no longer referenced"
+        for batch in self.batches[:-1]:
+            if batch.live == 0:
+                self.engine.remove_module(batch.module)
+                self.batches.remove(batch)
@@ -5,9 +5,11 @@ etc. Subclass and override ASTBuilder's method to provide alternative
 AST nodes or different implementations.
 """
 
+import os
 import copy
 import string
 import types
+import multiprocessing.pool
 
 import minitypes
 import miniutils
@@ -15,8 +17,12 @@ import minivisitor
 import specializers
 import type_promoter
 import minicode
+import minicache
+import autotune
 import codegen
+import cjit
 import llvm_codegen
+import llvm_modules
 import graphviz
 
 try:
@@ -37,8 +43,76 @@ def make_cls(cls1, cls2):
     name = "%s_%s" % (cls1.__name__, cls2.__name__)
     return type(name, (cls1, cls2), {})
 
-data_layout =  "e-p:64:64:64-i1:8:8-i8:8:8-i16:16:16-i32:32:32-i64:64:64-f32:32:32-f64:64:64-v64:64:64-v128:128:128-a0:0:64-s0:64:64-f80:128:128-n8:16:32:64"
-target = "x86_64-apple-darwin10.0.0"
+# CPU flags as listed in /proc/cpuinfo -> LLVM target features
+llvm_cpu_features = [
+    ('pni', 'sse3'),
+    ('ssse3', 'ssse3'),
+    ('sse4_1', 'sse4.1'),
+    ('sse4_2', 'sse4.2'),
+    ('popcnt', 'popcnt'),
+    ('avx', 'avx'),
+    ('f16c', 'f16c'),
+    ('fma', 'fma'),
+    ('bmi1', 'bmi'),
+    ('bmi2', 'bmi2'),
+    ('avx2', 'avx2'),
+    ('avx512f', 'avx512f'),
+    ('avx512cd', 'avx512cd'),
+    ('avx512dq', 'avx512dq'),
+    ('avx512bw', 'avx512bw'),
+    ('avx512vl', 'avx512vl'),
+]
+
+def host_cpu_flags():
+    "Return the flags of the host CPU from /proc/cpuinfo, or None"
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('flags'):
+                    return line.split(':', 1)[1].split()
+    except IOError:
+        pass
+
+    return None
+
+def host_vector_size(cpu_flags=None):
+    """
+    Return the widest vector, in 32-bit operands, of the vectorized
+    specializations the host can run, or 0 if it cannot run any. The
+    8-lane specializations use AVX2 and the 16-lane ones AVX-512BW.
+
+    >>> host_vector_size(['sse2', 'sse4_1', 'sse4_2', 'avx'])
+    4
+    >>> host_vector_size(['sse2', 'sse4_1', 'sse4_2', 'avx', 'avx2'])
+    8
+    """
+    if cpu_flags is None:
+        cpu_flags = host_cpu_flags()
+        if cpu_flags is None:
+            # Unknown host, assume x86-64 with SSE4.2
+            return 4
+
+    cpu_flags = set(cpu_flags)
+    if 'avx512f' in cpu_flags and 'avx512bw' in cpu_flags:
+        return 16
+    elif 'avx2' in cpu_flags:
+        return 8
+    elif 'sse4_2' in cpu_flags:
+        return 4
+    return 0
+
+def llvm_features(cpu_flags):
+    """
+    Return the LLVM feature string for the given CPU flags. Features
+    missing from the flags are disabled, as virtual machines may not
+    support all features of their CPU model.
+
+    >>> llvm_features(['sse2', 'pni', 'avx', 'fma'])[:29]
+    '+sse3,-ssse3,-sse4.1,-sse4.2,'
+    """
+    cpu_flags = set(cpu_flags)
+    return ",".join((flag in cpu_flags and '+' or '-') + feature
+                        for flag, feature in llvm_cpu_features)
 
 class Context(object):
     """
@@ -93,6 +167,131 @@ class Context(object):
         Visitor to generate a Graphviz graph. See the :py:module:`graphviz`
         module.
 
+    .. attribute:: specialization_cache_size
+
+        The maximum number of specializations kept in the
+        :py:class:`minivect.minicache.SpecializationCache` of the context
+        (``context.specialization_cache``). Set to 0 to disable caching.
+
+    .. attribute:: kernel_cache_dir
+
+        Directory of a :py:class:`minivect.minicache.KernelCache` that keeps
+        generated code across processes (``context.kernel_cache``), or
+        ``None`` to not cache on disk. Entries are also keyed on
+        ``minicache.kernel_format_version`` and the LLVM target, so code
+        generated by other versions or for other CPUs is not reused.
+
+    .. attribute:: kernel_cache_max_size
+
+        Size in bytes at which the kernel cache starts evicting entries
+
+    .. attribute:: tuning_table_dir
+
+        Directory of a :py:class:`minivect.autotune.TuningTable` with the
+        tile sizes found by :py:class:`minivect.autotune.BlocksizeTuner` and
+        the OpenMP thresholds found by
+        :py:class:`minivect.autotune.OpenMPCalibrator`
+        (``context.tuning_table``), or ``None``. The dispatcher compiles
+        specializations with the values tuned for this machine.
+
+    .. attribute:: thread_pool_size
+
+        The number of threads a :py:class:`minivect.dispatch.Dispatcher`
+        runs a kernel on, for backends without OpenMP support like LLVM.
+        Calls with large enough operands are split along the outermost
+        dimension into chunks that are run on a pool of threads
+        (``context.thread_pool``). ctypes releases the GIL during the calls.
+        A size of 1 runs all calls in the calling thread.
+
+    .. attribute:: thread_chunk_size
+
+        The minimum number of elements of the broadcast shape processed by
+        a chunk of a call split over the thread pool
+
+    .. attribute:: llvm_triple
+
+        The target triple of the LLVM backend, or ``None`` for the host
+
+    .. attribute:: llvm_cpu
+
+        The CPU the LLVM backend generates code for, or ``None`` for the
+        host CPU. To target an older baseline, set this and
+        ``llvm_features``, e.g. to ``'x86-64'`` and ``''``.
+
+    .. attribute:: llvm_features
+
+        The LLVM target feature string, e.g. ``'+avx2,+fma'``, or ``None``
+        for the features of the host CPU (see :py:func:`llvm_features`)
+
+    .. attribute:: llvm_batch_size
+
+        The number of kernels the LLVM backend links into a module of the
+        execution engine. Modules are freed once all their kernels are
+        unreferenced (see :py:class:`minivect.llvm_modules.ModuleManager`).
+
+    .. attribute:: llvm_tiered
+
+        Whether the LLVM backend first compiles kernels with cheap
+        optimizations, and recompiles them with the full pipeline in a
+        background thread. The ctypes functions of the kernels switch to
+        the optimized code once it is ready. Cached kernels hold the
+        cheaply optimized code, and are recompiled when loaded.
+
+    .. attribute:: explicit_vectorization
+
+        Whether the code generator supports the vector nodes produced by the
+        vectorizing specializers. See :py:class:`minivect.dispatch.Dispatcher`.
+
+    .. attribute:: masked_remainder
+
+        Whether vectorized specializations process the elements remaining
+        after the last full vector of the inner loop in one iteration with
+        masked loads and stores, instead of in a scalar loop. Requires AVX
+        (AVX2 for 256-bit vectors of integers or doubles, and AVX-512 for
+        16-wide vectors). Loops that accumulate reductions over the
+        contiguous dimension keep the scalar loop.
+
+    .. attribute:: align_vectors
+
+        Whether vectorized contiguous and inner contiguous specializations
+        peel scalar iterations off the inner loop until the element stored
+        to is aligned to the vector size, and then use aligned stores. Other
+        operands are loaded with aligned loads if a runtime check finds them
+        equally misaligned.
+
+    .. attribute:: streaming_store_threshold
+
+        Vectorized specializations store with non-temporal (streaming)
+        stores that bypass the cache if the data size, i.e. the number of
+        elements of the broadcast shape times the size of the elements of
+        the stored operand, exceeds this number of bytes. Streaming stores
+        need aligned vectors, so this implies ``align_vectors``. An sfence
+        after the vectorized loop orders the stores. ``None`` disables
+        streaming stores.
+
+    .. attribute:: prefetch_strided
+
+        Whether strided and tiled specializations prefetch the strided
+        operands of the inner loop with ``__builtin_prefetch``, a number of
+        iterations ahead given by the ``prefetch_distance`` attribute of the
+        specializer.
+
+    .. attribute:: max_vector_size
+
+        The widest vector, in 32-bit operands, the dispatcher selects
+        vectorized specializations for: 4 for SSE, 8 for AVX2 and 16 for
+        AVX-512. ``None`` selects the widest vectors the host supports (see
+        :py:func:`host_vector_size`). Specializations using wider vectors
+        are only generated when asked for explicitly.
+
+    .. attribute:: array_temp_cost
+
+        The estimated cost, in operations, of loading a broadcasting
+        expression from a temporary array instead of computing it. Expressions
+        that can only be hoisted partially out of the loop nest are computed
+        into a temporary array if they are more expensive than this (see
+        :py:class:`minivect.optimize.HoistBroadcastingExpressions`).
+
     Use subclass :py:class:`CContext` to get the defaults for C code generation.
     """
 
@@ -100,6 +299,13 @@ class Context(object):
 
     use_llvm = False
     optimize_broadcasting = True
+    array_temp_cost = 1
+    explicit_vectorization = True
+    max_vector_size = None
+    masked_remainder = False
+    align_vectors = False
+    streaming_store_threshold = None
+    prefetch_strided = False
 
     codegen_cls = UndocClassAttribute(codegen.VectorCodegen)
     cleanup_codegen_cls = UndocClassAttribute(codegen.CodeGenCleanup)
@@ -114,25 +320,49 @@ class Context(object):
 
     final_specializer = specializers.FinalSpecializer
 
+    specialization_cache_size = 128
+
+    kernel_cache_dir = None
+    kernel_cache_max_size = 256 * 1024 * 1024
+    _kernel_cache = None
+
+    tuning_table_dir = None
+    _tuning_table = None
+
+    thread_pool_size = 1
+    thread_chunk_size = 64 * 1024
+    _thread_pool = None
+
+    llvm_triple = None
+    llvm_cpu = None
+    llvm_features = None
+    llvm_batch_size = 16
+    llvm_tiered = False
+
     def __init__(self):
         self.init()
+        self.specialization_cache = minicache.SpecializationCache(
+                                        self.specialization_cache_size)
         if self.use_llvm:
             if llvm is None:
                 import llvm.core as llvm_py_not_available # llvm-py not available
 
-            self.llvm_module = llvm.core.Module.new('default_module')
-            # self.llvm_ee = llvm.ee.ExecutionEngine.new(self.llvm_module)
-            self.llvm_ee = llvm.ee.EngineBuilder.new(self.llvm_module).force_jit().opt(3).create()
-            # self.llvm_module.data_layout = data_layout
-            # self.llvm_module.target = target
-            self.llvm_fpm = llvm.passes.FunctionPassManager.new(self.llvm_module)
-            self.llvm_fpm.initialize()
+            passes = []
             if not self.debug:
-                for llvm_pass in self.llvm_passes():
-                    self.llvm_fpm.add(llvm_pass)
+                passes = self.llvm_passes()
+
+            self.llvm_target = self.resolve_llvm_target()
+            self.llvm_target_machine = self.create_llvm_target_machine()
+            self.llvm_modules = llvm_modules.ModuleManager(
+                    self.llvm_target_machine, passes, self.llvm_batch_size,
+                    self.llvm_tiered)
+            self.llvm_ee = self.llvm_modules.engine
+            self.llvm_module = self.llvm_modules.default_module
         else:
+            self.llvm_target = None
             self.llvm_ee = None
             self.llvm_module = None
+            self.llvm_modules = None
 
     def init(self):
         self.astbuilder = ASTBuilder(self)
@@ -150,15 +380,30 @@ class Context(object):
 
         The code_obj is the generated code (e.g. a string of C code),
         depending on the code formatter used.
+
+        Results are cached in ``self.specialization_cache`` on the structure
+        of the AST and the specializer class, so structurally equal ASTs
+        are only specialized once.
         """
+        ast_key = None
+        use_cache = self.specialization_cache.maxsize > 0
         for specializer_class in specializer_classes:
-            self.init()
-            pipeline = self.pipeline(specializer_class)
-
-            specialized_ast = specializers.specialize_ast(ast)
-            for transform in pipeline:
-                specialized_ast = transform.visit(specialized_ast)
-
+            cache_key = None
+            result = None
+            if use_cache or self.kernel_cache is not None:
+                if ast_key is None:
+                    ast_key = minicache.structural_key(ast)
+                cache_key = self.specialization_key(ast_key, specializer_class)
+
+            if use_cache:
+                result = self.specialization_cache.get(cache_key)
+
+            if result is None:
+                result = self.specialize(ast, specializer_class, cache_key)
+                if use_cache:
+                    self.specialization_cache.put(cache_key, result)
+
+            specialized_ast = result[1]
             if print_tree:
                 specialized_ast.print_tree(self)
 
@@ -166,12 +411,114 @@ class Context(object):
                 data = self.graphviz(specialized_ast)
                 graphviz_outfile.write(data)
 
-            codewriter = self.codewriter_cls(self)
-            codegen = self.codegen_cls(self, codewriter)
+            yield result
+
+    def run_batch(self, jobs, progress=None):
+        """
+        Specialize a list of ``(ast, specializer_class)`` pairs and return
+        the results of :py:meth:`run`, in the order of the jobs.
+
+        :param progress: a callable called as ``progress(n_done, n_jobs)``
+                         each time a job is complete
+        """
+        results = []
+        for ast, specializer_class in jobs:
+            results.extend(self.run(ast, [specializer_class]))
+            if progress is not None:
+                progress(len(results), len(jobs))
+
+        return results
+
+    def specialize(self, ast, specializer_class, cache_key=None):
+        """
+        Run the pipeline for a single specializer and generate code.
+        Returns ``(specializer, new_ast, codewriter, code_obj)``.
+
+        If a kernel cache is configured and ``cache_key`` is given, the code
+        generator loads previously generated code from the cache instead
+        of generating it.
+        """
+        self.init()
+        pipeline = self.pipeline(specializer_class)
+
+        specialized_ast = specializers.specialize_ast(ast)
+        for transform in pipeline:
+            specialized_ast = transform.visit(specialized_ast)
+
+        codewriter = self.codewriter_cls(self)
+        codegen = self.codegen_cls(self, codewriter)
+
+        kernel_digest = None
+        if cache_key is not None and self.kernel_cache is not None:
+            kernel_digest = minicache.digest(
+                    (minicache.kernel_format_version, type(self),
+                     type(codegen), self.llvm_target, cache_key))
+
+        cached_code = None
+        if kernel_digest is not None:
+            cached_code = self.kernel_cache.get(kernel_digest)
+
+        if (cached_code is None or
+                not codegen.load_cached_code(specialized_ast, cached_code)):
             codegen.visit(specialized_ast)
+            if kernel_digest is not None:
+                cached_code = codegen.dump_cached_code(specialized_ast)
+                if cached_code is not None:
+                    self.kernel_cache.put(kernel_digest, cached_code)
+
+        return (pipeline[0], specialized_ast, codewriter,
+                self.codeformatter_cls().format(codewriter))
 
-            yield (pipeline[0], specialized_ast, codewriter,
-                   self.codeformatter_cls().format(codewriter))
+    @property
+    def kernel_cache(self):
+        "The :py:class:`minivect.minicache.KernelCache` or None"
+        if self.kernel_cache_dir is None:
+            return None
+
+        if (self._kernel_cache is None or
+                self._kernel_cache.directory != self.kernel_cache_dir):
+            self._kernel_cache = minicache.KernelCache(
+                        self.kernel_cache_dir, self.kernel_cache_max_size)
+
+        self._kernel_cache.max_size = self.kernel_cache_max_size
+        return self._kernel_cache
+
+    @property
+    def tuning_table(self):
+        "The :py:class:`minivect.autotune.TuningTable` or None"
+        if self.tuning_table_dir is None:
+            return None
+
+        if (self._tuning_table is None or
+                self._tuning_table.directory != self.tuning_table_dir):
+            self._tuning_table = autotune.TuningTable(self.tuning_table_dir)
+
+        return self._tuning_table
+
+    @property
+    def thread_pool(self):
+        "A thread pool of thread_pool_size threads"
+        if self._thread_pool is not None:
+            pool_size, pool = self._thread_pool
+            if pool_size == self.thread_pool_size:
+                return pool
+            pool.close()
+
+        pool = multiprocessing.pool.ThreadPool(self.thread_pool_size)
+        self._thread_pool = self.thread_pool_size, pool
+        return pool
+
+    def specialization_key(self, ast_key, specializer_class):
+        """
+        Return the key under which the result of specializing an AST with
+        key ``ast_key`` (see :py:func:`minivect.minicache.structural_key`)
+        is cached. Override to add any setting that affects code generation.
+        """
+        return (ast_key, specializer_class, self.debug,
+                self.optimize_broadcasting, self.array_temp_cost,
+                self.masked_remainder, self.align_vectors,
+                self.streaming_store_threshold, self.prefetch_strided,
+                self.specializer_mixin_cls, self.variable_resolving_mixin_cls)
 
     def pipeline(self, specializer_class):
         # add specializer mixin and run specializer
@@ -205,8 +552,31 @@ class Context(object):
     ### Override in subclasses where needed
     #
 
+    def resolve_llvm_target(self):
+        """
+        Return the ``(triple, cpu, features)`` of the LLVM target for
+        llvm_triple, llvm_cpu and llvm_features, which default to the host.
+        The generated code, and hence the kernel cache, depends on it.
+        """
+        cpu = self.llvm_cpu
+        if cpu is None:
+            cpu = llvm.ee.get_host_cpu_name()
+
+        features = self.llvm_features
+        if features is None:
+            cpu_flags = host_cpu_flags()
+            features = cpu_flags is not None and llvm_features(cpu_flags) or ''
+
+        return self.llvm_triple or '', cpu, features
+
+    def create_llvm_target_machine(self):
+        "Create the LLVM target machine for ``self.llvm_target``"
+        triple, cpu, features = self.llvm_target
+        return llvm.ee.TargetMachine.new(triple=triple, cpu=cpu,
+                                         features=features, opt=3)
+
     def llvm_passes(self):
-        "Returns a list of LLVM optimization passes"
+        "Returns a list of LLVM passes to run after the standard pipeline"
         return []
         return [
             # llvm.passes.PASS_CFG_SIMPLIFICATION
@@ -279,8 +649,136 @@ class CContext(Context):
     codewriter_cls = minicode.CCodeWriter
     codeformatter_cls = minicode.CCodeStringFormatter
 
+class CJitContext(CContext):
+    """
+    Context that compiles the generated C code with the system C compiler
+    and loads it with ctypes. Like with :py:class:`LLVMContext`, the code
+    object of a specialization is a ``(impl, ctypes_func)`` pair, with
+    the C implementation instead of the LLVM function.
+
+    .. attribute:: cc
+
+        The C compiler command, ``$CC`` or ``cc`` by default
+
+    .. attribute:: cflags
+
+        List of compiler flags. Compiling with ``-fopenmp`` enables the
+        OpenMP loops, and ``-march=native`` the intrinsics of the host.
+
+    .. attribute:: build_dir
+
+        The directory for the compiled code, or ``None`` for a temporary
+        directory shared by the process and removed at exit (see
+        :py:func:`minivect.cjit.temp_build_dir`)
+
+    .. attribute:: build_processes
+
+        The number of compilers :py:meth:`run_batch` runs at once, or
+        ``None`` for the number of CPUs
+    """
+
+    codegen_cls = codegen.CJitCodeGen
+    codeformatter_cls = minicode.CJitCodeFormatter
+
+    cc = os.environ.get('CC', 'cc')
+    cflags = ['-O3', '-march=native', '-fopenmp']
+    build_dir = None
+    build_processes = None
+
+    # Whether the code generator leaves compilation to run_batch
+    defer_builds = False
+
+    _c_compiler = None
+
+    @property
+    def c_compiler(self):
+        "The :py:class:`minivect.cjit.CCompiler`"
+        compiler = self._c_compiler
+        build_dir = self.build_dir or cjit.temp_build_dir()
+        if (compiler is None or compiler.cc != self.cc or
+                compiler.cflags != list(self.cflags) or
+                compiler.build_dir != build_dir):
+            self._c_compiler = cjit.CCompiler(self.cc, self.cflags, build_dir)
+
+        return self._c_compiler
+
+    def specialization_key(self, ast_key, specializer_class):
+        "The compiled code also depends on the compiler and its flags"
+        key = super(CJitContext, self).specialization_key(ast_key,
+                                                          specializer_class)
+        return key + (self.cc, tuple(self.cflags))
+
+    def run_batch(self, jobs, progress=None):
+        """
+        Like :py:meth:`Context.run_batch`, but generate the code of all jobs
+        first and then compile it with ``build_processes`` compilers at
+        once. Jobs found in the specialization cache complete first.
+        """
+        use_cache = self.specialization_cache.maxsize > 0
+        results = [None] * len(jobs)
+        pending = {} # cache_key or job index -> list of job indices
+        n_done = 0
+
+        self.defer_builds = True
+        try:
+            for i, (ast, specializer_class) in enumerate(jobs):
+                cache_key = None
+                if use_cache or self.kernel_cache is not None:
+                    cache_key = self.specialization_key(
+                        minicache.structural_key(ast), specializer_class)
+
+                if use_cache:
+                    results[i] = self.specialization_cache.get(cache_key)
+
+                if results[i] is not None:
+                    n_done += 1
+                    if progress is not None:
+                        progress(n_done, len(jobs))
+                elif use_cache and cache_key in pending:
+                    pending[cache_key].append(i)
+                else:
+                    results[i] = self.specialize(ast, specializer_class,
+                                                 cache_key)
+                    pending[use_cache and cache_key or i] = [i]
+        finally:
+            self.defer_builds = False
+
+        compiler = self.c_compiler
+        def build(key):
+            specializer, specialized_ast, codewriter, (impl, _) = (
+                                                    results[pending[key][0]])
+            return key, compiler.build(impl)
+
+        pool = multiprocessing.pool.ThreadPool(
+                        self.build_processes or multiprocessing.cpu_count())
+        try:
+            for key, so_path in pool.imap_unordered(build, list(pending)):
+                indices = pending[key]
+                specializer, specialized_ast, codewriter, (impl, _) = (
+                                                        results[indices[0]])
+                codewriter.ctypes_func = compiler.load(so_path,
+                                                       specialized_ast)
+                result = (specializer, specialized_ast, codewriter,
+                          self.codeformatter_cls().format(codewriter))
+                if use_cache:
+                    self.specialization_cache.put(key, result)
+
+                for i in indices:
+                    results[i] = result
+                    n_done += 1
+                    if progress is not None:
+                        progress(n_done, len(jobs))
+        finally:
+            pool.close()
+
+        return results
+
 class LLVMContext(Context):
-    "Context with default for LLVM code generation"
+    """
+    Context with default for LLVM code generation. Vectorized
+    specializations are generated as LLVM vector IR. Masked remainders are
+    not supported, and streaming stores are regular stores.
+    """
 
     use_llvm = True
     codegen_cls = llvm_codegen.LLVMCodeGen
@@ -492,7 +990,8 @@ class ASTBuilder(object):
         return OpenMPLoopNode(self.pos, for_node=for_node,
                               if_clause=if_clause,
                               lastprivates=[for_node.init.lhs],
-                              privates=[])
+                              privates=[], reductions=[],
+                              reduction_operators=[])
 
     def omp_if(self, if_body, else_body=None):
         return OpenMPConditionalNode(self.pos, if_body=if_body,
@@ -601,6 +1100,21 @@ class ASTBuilder(object):
         cmp_node = self.binop(type, '<', lhs, rhs)
         return self.if_else_expr(cmp_node, lhs, rhs)
 
+    def reduction(self, lhs, rhs, operator='+', axes=None):
+        """
+        Reduce ``rhs`` into the array operand ``lhs``.
+
+        :param operator: one of '+', '*', 'min' or 'max'
+        :param axes: the dimensions of the broadcast shape to reduce over,
+                     or None to reduce over all dimensions. The ``lhs`` must
+                     broadcast in these dimensions (i.e., have extent 1).
+        """
+        assert operator in ReductionNode.operators, operator
+        if axes is not None:
+            axes = tuple(sorted(axes))
+        return ReductionNode(self.pos, lhs=lhs, rhs=rhs, operator=operator,
+                             axes=axes)
+
     def index(self, pointer, index, dest_pointer_type=None):
         """
         Index a pointer with the given index node.
@@ -801,15 +1315,39 @@ class ASTBuilder(object):
 
         return VectorVariable(self.pos, type, name, variable=variable)
 
-    def vector_load(self, data_pointer, size):
-        "Load a SIMD vector of size `size` given an array operand variable"
+    def vector_load(self, data_pointer, size, remainder=None, aligned=False,
+                    stride=None):
+        """
+        Load a SIMD vector of size `size` given an array operand variable.
+        If ``remainder`` is given, only that many leading elements are
+        loaded, the others are zero.
+
+        :param aligned: whether the data pointer is aligned to the vector
+                        size, or a boolean expression node to check at
+                        runtime
+        :param stride: the distance between the elements in elements, to
+                       gather the elements of a non-contiguous operand
+        """
         type = self._vector_type(data_pointer.type.base_type, size)
-        return VectorLoadNode(self.pos, type, data_pointer, size=size)
+        return VectorLoadNode(self.pos, type, data_pointer, size=size,
+                              remainder=remainder, aligned=aligned,
+                              stride=stride)
+
+    def vector_store(self, data_pointer, vector_expr, remainder=None,
+                     aligned=False, nontemporal=False):
+        """
+        Store a SIMD vector of size `size`. If ``remainder`` is given, only
+        that many leading elements are stored. See :py:meth:`vector_load`
+        for ``aligned``.
 
-    def vector_store(self, data_pointer, vector_expr):
-        "Store a SIMD vector of size `size`"
+        :param nontemporal: a boolean expression node, if true at runtime
+                            the (aligned) vector is stored bypassing the
+                            cache
+        """
         assert data_pointer.type.base_type == vector_expr.type.element_type
-        return VectorStoreNode(self.pos, None, "=", data_pointer, vector_expr)
+        return VectorStoreNode(self.pos, None, "=", data_pointer, vector_expr,
+                               remainder=remainder, aligned=aligned,
+                               nontemporal=nontemporal)
 
     def vector_binop(self, operator, lhs, rhs):
         "Perform a binary SIMD operation between two operands of the same type"
@@ -823,6 +1361,15 @@ class ASTBuilder(object):
     def vector_const(self, type, constant):
         return ConstantVectorNode(self.pos, type, constant=constant)
 
+    def vector_splat(self, type, operand):
+        "Broadcast a scalar to all elements of a SIMD vector"
+        return VectorSplatNode(self.pos, type, operand)
+
+    def vector_extract(self, vector, index):
+        "Extract the element at position ``index`` from a SIMD vector"
+        return VectorExtractNode(self.pos, vector.type.element_type, vector,
+                                 index=index)
+
     def noop_expr(self):
         return NoopExpr(self.pos, type=None)
 
@@ -908,6 +1455,17 @@ class Node(miniutils.ComparableObjectMixin):
 
         return h
 
+    def __deepcopy__(self, memo):
+        # Copy the attributes directly instead of through __reduce_ex__,
+        # specialization copies the AST once or more per specializer
+        result = object.__new__(type(self))
+        memo[id(self)] = result
+        attributes = vars(result)
+        for attr, value in vars(self).iteritems():
+            attributes[attr] = copy.deepcopy(value, memo)
+
+        return result
+
 class ExprNode(Node):
     "Base class for expressions. Each node has a type."
 
@@ -1073,6 +1631,8 @@ class ForNode(Node):
 
     should_vectorize = False
     is_fixup = False
+    # array operand to align vectors to by peeling iterations off this loop
+    alignment_variable = None
 
     def __init__(self, pos, init, condition, step, body, index=None):
         super(ForNode, self).__init__(pos)
@@ -1096,6 +1656,8 @@ class IfNode(Node):
 
     should_vectorize = False
     is_fixup = False
+    # number of elements processed by a masked fixup iteration
+    remainder = None
 
 class StatListNode(Node):
     """
@@ -1180,6 +1742,19 @@ class SingleOperandNode(ExprNode):
 class AssignmentExpr(BinaryOperationNode):
     is_assignment = True
 
+class ReductionNode(Node):
+    """
+    Reduce the rhs into the lhs array operand over the given axes (all axes
+    if None), see :py:class:`ASTBuilder.reduction`
+    """
+
+    child_attrs = ['lhs', 'rhs']
+    operators = ('+', '*', 'min', 'max')
+
+    @property
+    def comparison_objects(self):
+        return (self.operator, self.axes, self.lhs, self.rhs)
+
 class IfElseExprNode(ExprNode):
     child_attrs = ['cond', 'lhs', 'rhs']
 
@@ -1277,8 +1852,14 @@ class TempNode(Variable):
 class OpenMPLoopNode(Node):
     """
     Execute a loop in parallel.
+
+    .. attribute:: reductions
+
+        temporaries that are reduced over the threads with the corresponding
+        operator from the ``reduction_operators`` list
     """
-    child_attrs = ['for_node', 'if_clause', 'lastprivates', 'privates']
+    child_attrs = ['for_node', 'if_clause', 'lastprivates', 'privates',
+                   'reductions']
 
 class OpenMPConditionalNode(Node):
     """
@@ -1363,9 +1944,15 @@ class VectorVariable(Variable):
 
 class VectorLoadNode(SingleOperandNode):
     "Load a SIMD vector"
+    remainder = None
+    aligned = False
+    stride = None
 
 class VectorStoreNode(BinopNode):
     "Store a SIMD vector"
+    remainder = None
+    aligned = False
+    nontemporal = False
 
 class VectorBinopNode(BinopNode):
     "Binary operation on SIMD vectors"
@@ -1373,5 +1960,11 @@ class VectorBinopNode(BinopNode):
 class VectorUnopNode(SingleOperandNode):
     "Unary operation on SIMD vectors"
 
+class VectorSplatNode(SingleOperandNode):
+    "Broadcast a scalar to all elements of a SIMD vector"
+
+class VectorExtractNode(SingleOperandNode):
+    "Extract a single element from a SIMD vector"
+
 class ConstantVectorNode(ExprNode):
     "Load the constant into the vector register"
\ No newline at end of file
@@ -0,0 +1,337 @@
+"""
+Caching of specialization results. See :py:meth:`minivect.miniast.Context.run`.
+
+ASTs are cached on their structure: two separately built ASTs that are
+structurally equal (same node classes, attributes and types, including
+broadcasting information) map to the same key.
+
+:py:class:`SpecializationCache` keeps results in memory, and
+:py:class:`KernelCache` keeps generated code on disk across processes.
+"""
+
+import os
+import types
+import hashlib
+import tempfile
+import threading
+import collections
+import cPickle as pickle
+
+import minitypes
+
+# Version of the generated code stored in a KernelCache. Bump this whenever
+# the code generated for the same specialization key changes, so that
+# entries written by older versions are no longer used.
+kernel_format_version = 3
+
+def type_key(type):
+    """
+    Return a hashable key for a minitype. Unlike type equality, this takes
+    into account the number of dimensions, qualifiers and broadcasting
+    information of the type.
+    """
+    if type is None:
+        return None
+    elif type.is_typewrapper:
+        return ('typewrapper', type.opaque_type)
+    elif type.is_function:
+        return ('function', type_key(type.return_type),
+                tuple(type_key(arg_type) for arg_type in type.args),
+                type.is_vararg)
+    elif type.is_array:
+        return ('array', type_key(type.dtype), type.ndim, type.is_c_contig,
+                type.is_f_contig, type.inner_contig,
+                tuple(type.broadcasting))
+    elif type.is_pointer:
+        return ('pointer', type_key(type.base_type),
+                tuple(sorted(type.qualifiers)))
+    elif type.is_carray:
+        return ('carray', type_key(type.base_type), type.size)
+    elif type.is_vector:
+        return ('vector', type_key(type.element_type), type.vector_size)
+
+    return (_class_name(type), str(type), getattr(type, 'itemsize', None),
+            tuple(sorted(type.qualifiers)))
+
+def _class_name(obj):
+    cls = obj.__class__
+    return "%s.%s" % (cls.__module__, cls.__name__)
+
+_primitives = (basestring, int, long, float, bool, type(None))
+
+class _IdentityKey(object):
+    "Key for unhashable objects, which compare by identity"
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __eq__(self, other):
+        return isinstance(other, _IdentityKey) and self.obj is other.obj
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(id(self.obj))
+
+class _StructuralKeyBuilder(object):
+    """
+    Builds a nested tuple from an AST. Shared subtrees are only processed
+    once.
+    """
+
+    # Attributes that do not influence the generated code
+    ignored_attributes = frozenset(['pos'])
+
+    def __init__(self):
+        self.memo = {}
+
+    def key(self, value):
+        if isinstance(value, _primitives):
+            return value
+        elif isinstance(value, minitypes.Type):
+            return type_key(value)
+        elif isinstance(value, (list, tuple)):
+            return tuple(self.key(item) for item in value)
+        elif isinstance(value, dict):
+            return tuple(sorted((key, self.key(item))
+                                    for key, item in value.iteritems()))
+        elif hasattr(value, 'child_attrs'):
+            return self.node_key(value)
+
+        try:
+            hash(value)
+        except TypeError:
+            return _IdentityKey(value)
+        else:
+            return value
+
+    def node_key(self, node):
+        if id(node) in self.memo:
+            return self.memo[id(node)]
+
+        # Guard against cycles, the placeholder is replaced below
+        self.memo[id(node)] = ('cycle', _class_name(node))
+        attributes = tuple(sorted(
+            (attr, self.key(value))
+                for attr, value in vars(node).iteritems()
+                    if attr not in self.ignored_attributes))
+
+        result = (_class_name(node), attributes)
+        self.memo[id(node)] = result
+        return result
+
+def structural_key(ast):
+    """
+    Return a hashable key describing the given AST. Structurally equal ASTs
+    have equal keys.
+    """
+    return _StructuralKeyBuilder().key(ast)
+
+class _UnstableKeyError(Exception):
+    "Raised when a key has no representation that is stable across processes"
+
+def _stable_repr(key):
+    if isinstance(key, _primitives):
+        return repr(key)
+    elif isinstance(key, tuple):
+        return "(%s)" % ", ".join(_stable_repr(item) for item in key)
+    elif isinstance(key, (type, types.ClassType)):
+        return "<class %s.%s>" % (key.__module__, key.__name__)
+
+    raise _UnstableKeyError(key)
+
+def digest(key):
+    """
+    Return a hex digest for a key (as returned by :py:func:`structural_key`)
+    that is the same across processes, or None if the key refers to objects
+    (e.g. foreign AST nodes) without such a representation.
+    """
+    try:
+        return hashlib.sha1(_stable_repr(key)).hexdigest()
+    except _UnstableKeyError:
+        return None
+
+class SpecializationCache(object):
+    """
+    Bounded LRU cache mapping a key (see :py:func:`structural_key`) to the
+    ``(specializer, specialized_ast, codewriter, code_obj)`` tuples produced
+    by :py:meth:`minivect.miniast.Context.run`.
+
+    .. attribute:: maxsize
+
+        maximum number of entries. A size of 0 disables the cache.
+
+    .. attribute:: hits
+
+        number of lookups that found an entry
+
+    .. attribute:: misses
+
+        number of lookups that did not find an entry
+
+    .. attribute:: evictions
+
+        number of entries discarded to stay within ``maxsize``
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        "Return the cached value for key, or None"
+        with self.lock:
+            try:
+                value = self.entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+
+            # Re-insert to mark as most recently used
+            self.entries[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        "Cache a value, evicting the least recently used entries if needed"
+        if self.maxsize <= 0:
+            return
+
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = value
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        "Remove all entries. The counters are preserved."
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        "Return a dict with the hit, miss and eviction counters"
+        return dict(hits=self.hits, misses=self.misses,
+                    evictions=self.evictions, size=len(self.entries),
+                    maxsize=self.maxsize)
+
+class KernelCache(object):
+    """
+    Content-addressed cache of generated code on disk, keyed by a
+    :py:func:`digest`. The cached values are produced and consumed by the
+    code generators (see :py:meth:`minivect.codegen.CodeGen.dump_cached_code`),
+    e.g. the C prototype and implementation, or LLVM bitcode.
+
+    Entries are written to a temporary file which is atomically renamed,
+    so multiple processes can share one directory. When the total size
+    exceeds ``max_size`` bytes, the least recently used entries are removed.
+    Reading an entry counts as a use.
+    """
+
+    suffix = '.kernel'
+    temp_prefix = '.tmp-'
+
+    def __init__(self, directory, max_size=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest + self.suffix)
+
+    def get(self, digest):
+        "Return the cached value for a digest or None"
+        path = self.path(digest)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            return None
+
+        try:
+            value = pickle.loads(data)
+        except Exception:
+            # Corrupt entry, e.g. written by an incompatible version
+            self.remove(path)
+            return None
+
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass # evicted by another process in the meantime
+
+        return value
+
+    def put(self, digest, value):
+        "Atomically write a value to the cache and evict old entries"
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory,
+                                         prefix=self.temp_prefix,
+                                         suffix=self.suffix)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.rename(temp_path, self.path(digest))
+        except:
+            self.remove(temp_path)
+            raise
+
+        self.evict()
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def entries(self):
+        "Return a list of (mtime, size, path) tuples for all cache entries"
+        result = []
+        for filename in os.listdir(self.directory):
+            if (not filename.endswith(self.suffix) or
+                    filename.startswith(self.temp_prefix)):
+                continue
+
+            path = os.path.join(self.directory, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+
+            result.append((stat.st_mtime, stat.st_size, path))
+
+        return result
+
+    def size(self):
+        "Total size in bytes of all entries"
+        return sum(size for mtime, size, path in self.entries())
+
+    def evict(self):
+        "Remove the least recently used entries until we fit in max_size"
+        entries = self.entries()
+        total_size = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+
+            self.remove(path)
+            total_size -= size
+
+    def clear(self):
+        "Remove all entries"
+        for mtime, size, path in self.entries():
+            self.remove(path)
@@ -145,6 +145,15 @@ class CCodeStringFormatter(CodeStringFormatter):
         return ("".join(codewriter.proto_code.buffer.getvalue()),
                 "".join(codewriter.buffer.getvalue()))
 
+class CJitCodeFormatter(CodeStringFormatter):
+    """
+    Format the code implementation and its ctypes function (see
+    :py:class:`minivect.codegen.CJitCodeGen`)
+    """
+
+    def format(self, codewriter):
+        return ("".join(codewriter.buffer.getvalue()), codewriter.ctypes_func)
+
 class _CodeTree(object):
     """
     See Cython/StringIOTree
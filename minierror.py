@@ -16,6 +16,9 @@ class UnmappableFormatSpecifierError(Error):
 class InvalidTypeSpecification(Error):
     "Raised when a type is sliced incorrectly."
 
+class CCompilerError(Error):
+    "Raised when the C compiler fails to compile generated code"
+
 class CompileError(Error):
     "Raised for miscellaneous errors"
 
@@ -224,6 +224,11 @@ class Type(miniutils.ComparableObjectMixin):
     """
     Base class for all types.
 
+    Types are not modified once they are part of an AST. Copies of an AST
+    (see :py:func:`minivect.specializers.specialize_ast`) share their types
+    with the original, modifying a shared type raises an AssertionError.
+    Use :py:meth:`qualify` and friends to derive new types instead.
+
     .. attribute:: subtypes
 
         The list of subtypes to allow comparing and hashing them recursively
@@ -254,19 +259,42 @@ class Type(miniutils.ComparableObjectMixin):
         vars(self).update(kwds)
         self.qualifiers = kwds.get('qualifiers', frozenset())
 
+    def __setattr__(self, attr, value):
+        assert not vars(self).get('_shared'), (
+                "Type %r is shared between ASTs and cannot be modified" % self)
+        super(Type, self).__setattr__(attr, value)
+
+    def __deepcopy__(self, memo):
+        # Share the type and its subtypes between copies of an AST, and
+        # disallow further modifications
+        if not vars(self).get('_shared'):
+            vars(self)['_shared'] = True
+            for subtype in self.subtype_list:
+                if not isinstance(subtype, list):
+                    subtype = [subtype]
+                for type in subtype:
+                    if isinstance(type, Type):
+                        type.__deepcopy__(memo)
+
+        return self
+
+    def _derive(self, **kwds):
+        "Create an unshared type with the attributes of this type"
+        attribs = dict(vars(self), **kwds)
+        attribs.pop('_shared', None)
+        return type(self)(**attribs)
+
     def qualify(self, *qualifiers):
         "Qualify this type with a qualifier such as ``const`` or ``restrict``"
         qualifiers = list(qualifiers)
         qualifiers.extend(self.qualifiers)
-        attribs = dict(vars(self), qualifiers=qualifiers)
-        return type(self)(**attribs)
+        return self._derive(qualifiers=qualifiers)
 
     def unqualify(self, *unqualifiers):
         "Remove the given qualifiers from the type"
         unqualifiers = set(unqualifiers)
         qualifiers = [q for q in self.qualifiers if q not in unqualifiers]
-        attribs = dict(vars(self), qualifiers=qualifiers)
-        return type(self)(**attribs)
+        return self._derive(qualifiers=qualifiers)
 
     def pointer(self):
         "Get a pointer to this type"
@@ -381,6 +409,10 @@ class PointerType(Type):
         return "%s *%s" % (self.base_type, " ".join(self.qualifiers))
 
     def to_llvm(self, context):
+        if self.base_type.is_void:
+            # LLVM has no void pointers, use i8 * like C compilers do
+            return llvm.core.Type.pointer(llvm.core.Type.int(8))
+
         return llvm.core.Type.pointer(self.base_type.to_llvm(context))
 
 class CArrayType(Type):
@@ -410,9 +442,6 @@ class TypeWrapper(Type):
     def __repr__(self):
         return self.context.declare_type(self)
 
-    def __deepcopy__(self, memo):
-        return self
-
 class NamedType(Type):
     name = None
 
@@ -579,26 +608,29 @@ class VectorType(Type):
         self.element_type = element_type
         self.vector_size = vector_size
 
+    @property
+    def element_count(self):
+        "The number of elements, the vector size is in 32-bit operands"
+        return self.vector_size * 4 // self.element_type.itemsize
+
     def to_llvm(self, context):
         return lc.Type.vector(self.element_type.to_llvm(context),
-                              self.vector_size)
+                              self.element_count)
 
     @property
     def comparison_type_list(self):
         return self.subtype_list + [self.vector_size]
 
     def __str__(self):
-        itemsize = self.element_type.itemsize
-        if self.element_type.is_float:
-            if itemsize == 4:
-                return '__m128'
-            else:
-                return '__m128d'
+        # vector_size is the number of 32-bit operands, e.g. __m256d for 8
+        if self.element_type.is_int:
+            suffix = 'i'
+        elif self.element_type.itemsize == 8:
+            suffix = 'd'
         else:
-            if itemsize == 4:
-                return '__m128i'
-            else:
-                raise NotImplementedError
+            suffix = ''
+
+        return '__m%d%s' % (self.vector_size * 32, suffix)
 
 #
 ### Internal types
@@ -1,5 +1,7 @@
 # -*- encoding: UTF-8 -*-
 
+import copy
+
 import minivisitor
 import miniutils
 import minitypes
@@ -39,6 +41,105 @@ def partially_hoistable(broadcasting_tuple, n_loops):
 def broadcasting(broadcasting_tuple1, broadcasting_tuple2):
     return broadcasting_tuple1 != broadcasting_tuple2
 
+def combine_broadcasting(broadcasting_tuple1, broadcasting_tuple2):
+    """
+    Return the broadcasting tuple of an expression with two operands, which
+    broadcasts in the dimensions where both operands broadcast.
+    """
+    return tuple(broadcasting1 and broadcasting2
+                    for broadcasting1, broadcasting2 in zip(broadcasting_tuple1,
+                                                            broadcasting_tuple2))
+
+class ExpressionCost(minivisitor.TreeVisitor):
+    """
+    Estimate the number of operations needed to evaluate an expression.
+    Loads of array elements are not counted.
+    """
+
+    cost = 0
+
+    operator_costs = { '/': 4, '%': 4 }
+    function_call_cost = 10
+
+    def visit_Node(self, node):
+        self.visitchildren(node)
+
+    def visit_BinopNode(self, node):
+        self.cost += self.operator_costs.get(node.operator, 1)
+        self.visitchildren(node)
+
+    def visit_UnopNode(self, node):
+        self.cost += 1
+        self.visitchildren(node)
+
+    def visit_FuncCallNode(self, node):
+        self.cost += self.function_call_cost
+        self.visitchildren(node)
+
+def expression_cost(context, node):
+    cost_visitor = ExpressionCost(context)
+    cost_visitor.visit(node)
+    return cost_visitor.cost
+
+class ElementResolver(specializers.BaseSpecializer):
+    """
+    Resolve the array operands of an expression to the element at the given
+    indices (a dict mapping dimensions of the broadcast shape to index
+    nodes). Array operands must broadcast in all other dimensions.
+    """
+
+    def __init__(self, context, function, indices):
+        super(ElementResolver, self).__init__(context)
+        self.function = function
+        self.indices = indices
+
+    def visit_Variable(self, node):
+        if not node.type.is_array:
+            return node
+
+        b = self.astbuilder
+        offset = self.function.ndim - node.type.ndim
+        data_pointer = b.data_pointer(node)
+
+        offsets = []
+        for dim, broadcasting in enumerate(node.type.broadcasting):
+            if not broadcasting:
+                offsets.append(b.mul(self.indices[offset + dim],
+                                     b.stride(node, dim)))
+
+        if offsets:
+            element = b.index_multiple(
+                b.cast(data_pointer, minitypes.char.pointer()), offsets,
+                dest_pointer_type=data_pointer.type)
+        else:
+            element = b.index(data_pointer, b.constant(0))
+
+        return b.resolved_variable(node.name, node.type, element)
+
+class VectorScalarizer(specializers.BaseSpecializer):
+    """
+    Rewrite an expression of a vectorized specialization to compute a single
+    element. Hoisted vector temporaries are replaced by the scalar they
+    were splatted from (see the ``splats`` dict).
+    """
+
+    def __init__(self, context, splats):
+        super(VectorScalarizer, self).__init__(context)
+        self.splats = splats
+
+    def visit_VectorVariable(self, node):
+        # Don't share the variable with the vectorized expression, the copy
+        # will be marked as hoisted
+        return copy.copy(node.variable)
+
+    def visit_VectorBinopNode(self, node):
+        self.visitchildren(node)
+        return self.astbuilder.binop(node.lhs.type, node.operator,
+                                     node.lhs, node.rhs)
+
+    def visit_TempNode(self, node):
+        return self.splats.get(node, node)
+
 class HoistBroadcastingExpressions(specializers.BaseSpecializer):
     """
     This transform hoists out part of sub-expressions which are broadcasting.
@@ -100,8 +201,10 @@ class HoistBroadcastingExpressions(specializers.BaseSpecializer):
     More generally, if the index sequence of array A is not an admissible prefix
     of the total index sequence, we have situation 2). For instance,
     ``(True, False, True)`` would mean we could hoist out the expression one
-    level, but we would still have repeated computation. What we could do in
-    this case, in addition to 2), is reduce indexing overhead, i.e. generate::
+    level, but we would still have repeated computation. In this case we
+    either hoist the expression one level and recompute it for each outer
+    iteration, or we compute it into a temporary array and load an element
+    into a scalar at the hoisting level::
 
         for j in shape[1]:
             temp[j] = A[0, j, 0] * A[0, j, 0]
@@ -112,31 +215,81 @@ class HoistBroadcastingExpressions(specializers.BaseSpecializer):
                 for k in shape[2]:
                     temp_scalar * B[i, j, k]
 
-    This is bonus points.
+    We use the temporary array if the expression costs more operations than
+    ``context.array_temp_cost`` (see :py:func:`expression_cost`).
+
+    Broadcasting tuples are ordered by dimension. Admissibility is determined
+    in the order of the loops of the specialization (which is reversed for
+    Fortran order).
+
+    In vectorized specializations, we hoist the scalar equivalent of a
+    vector expression and splat the result into a vector temporary at the
+    hoisting level. The fixup loops of vectorized specializations are
+    processed like the inner loop.
     """
 
     def visit_FunctionNode(self, node):
         self.function = node
+
+        # Map each dimension to the level of the innermost loop over that
+        # dimension (the loop that selects the element for tiled
+        # specializations). The contiguous loop iterates over all dimensions.
+        self.loop_levels = {}
+        for level, for_node in enumerate(node.for_loops):
+            dim = getattr(for_node, 'dim', None)
+            if dim is None:
+                dims = range(node.ndim)
+            else:
+                dims = [dim]
+
+            for dim in dims:
+                self.loop_levels[dim] = level
+
+        self.loop_dims = sorted(range(node.ndim), key=self.loop_levels.get)
+
+        # (hoisting level, expression) -> hoisted scalar temporary
+        self.hoisted_temps = {}
+        # hoisted scalar temporary -> assignment statement
+        self.hoisted_stats = {}
+        # hoisted scalar temporary -> vector temporary and vice versa
+        self.vector_temps = {}
+        self.splats = {}
+        # (array temporary, size temporary, size, loop nest filling it)
+        self.array_temps = []
+
         inner_loop = node.for_loops[-1]
         self.visitchildren(inner_loop)
+        for fixup_loop in list(self.treepath(node, '//*[@is_fixup=True]')):
+            self.visitchildren(fixup_loop)
+
+        if self.array_temps:
+            self.allocate_array_temps()
+
         return node
 
     def visit_Variable(self, node):
         type = node.type
         if type.is_array and type.broadcasting is not None:
-            n_loops = len(self.function.for_loops)
-            if admissible(type.broadcasting, n_loops):
+            node.broadcasting = self.pad(type.broadcasting)
+            loop_broadcasting = self.in_loop_order(node.broadcasting)
+
+            n_loops = len(loop_broadcasting)
+            if admissible(loop_broadcasting, n_loops):
                 node.hoistable = True
-            elif partially_hoistable(type.broadcasting, n_loops):
-                # TODO: see whether `node` should be fully (array temporary)
-                # TODO: or partially hoisted
+            elif partially_hoistable(loop_broadcasting, n_loops):
+                # Variables are not computed, so we can always partially
+                # hoist them. Expressions are handled in should_make_temp()
                 node.hoistable = True
-            elif miniutils.any(type.broadcasting):
-                pass # enable when temporaries are implemented in minivect
-                # node.need_temp = True
+            elif miniutils.any(loop_broadcasting):
+                node.need_temp = True
 
-            node.broadcasting = type.broadcasting
+        return node
 
+    def visit_VectorVariable(self, node):
+        variable = self.visit(node.variable)
+        node.hoistable = variable.hoistable
+        node.need_temp = variable.need_temp
+        node.broadcasting = getattr(variable, 'broadcasting', None)
         return node
 
     def visit_ArrayAtribute(self, node):
@@ -154,34 +307,45 @@ class HoistBroadcastingExpressions(specializers.BaseSpecializer):
         lhs_hoisting_level = self.hoisting_level(node.lhs)
         rhs_hoisting_level = self.hoisting_level(node.rhs)
 
+        broadcasting = combine_broadcasting(node.lhs.broadcasting,
+                                            node.rhs.broadcasting)
         if lhs_hoisting_level == rhs_hoisting_level:
             node.hoistable = True
-            node.broadcasting = node.lhs.broadcasting
+            node.broadcasting = broadcasting
             return node
 
         def binop():
-            result = b.binop(node.type, node.operator, node.lhs, node.rhs)
+            if node.type.is_vector:
+                result = b.vector_binop(node.operator, node.lhs, node.rhs)
+            else:
+                result = b.binop(node.type, node.operator, node.lhs, node.rhs)
             result.broadcasting = broadcasting
             result.hoistable = True
             return result
 
         if lhs_hoisting_level < rhs_hoisting_level:
-            broadcasting = node.rhs.broadcasting
             node.lhs = self.hoist(node.lhs)
             return self.hoist(binop())
         else: # lhs_hoisting_level > rhs_hoisting_level
-            broadcasting = node.lhs.broadcasting
             node.rhs = self.hoist(node.rhs)
             return self.hoist(binop())
 
     def _make_temp_binop_operands(self, node):
-        if broadcasting(node.lhs.broadcasting, node.rhs.broadcasting):
-            node.need_temp = True
-        else:
-            if node.lhs.need_temp:
-                node.lhs = self.make_temp(node.lhs)
-            if node.rhs.need_temp:
-                node.rhs = self.make_temp(node.rhs)
+        lhs_broadcasting = getattr(node.lhs, 'broadcasting', None)
+        rhs_broadcasting = getattr(node.rhs, 'broadcasting', None)
+        if lhs_broadcasting is not None and rhs_broadcasting is not None:
+            broadcasting = combine_broadcasting(lhs_broadcasting,
+                                                rhs_broadcasting)
+            if miniutils.any(broadcasting):
+                # The trailing dimension does not broadcast, so the
+                # combined expression is not hoistable either
+                node.need_temp = True
+                node.broadcasting = broadcasting
+                return node
+
+        node.lhs = self.process_expr(node.lhs)
+        node.rhs = self.process_expr(node.rhs)
+        return node
 
     def visit_BinaryOperationNode(self, node):
         b = self.astbuilder
@@ -211,6 +375,10 @@ class HoistBroadcastingExpressions(specializers.BaseSpecializer):
         node.rhs = self.process_expr(rhs)
         return node
 
+    # The lhs of a reduction broadcasts along the reduced axes, only hoist
+    # from the rhs
+    visit_ReductionNode = visit_AssignmentExpr
+
     def visit_UnopNode(self, node):
         o = node.operand = self.visit(node.operand)
 
@@ -223,42 +391,235 @@ class HoistBroadcastingExpressions(specializers.BaseSpecializer):
     def process_expr(self, expr):
         if expr.hoistable:
             return self.hoist(expr)
-        elif expr.need_temp:
+        elif expr.need_temp and not expr.type.is_vector:
             return self.make_temp(expr)
         else:
             return expr
 
+    def pad(self, broadcasting_tuple):
+        "Pad the broadcasting tuple with leading broadcasting dimensions"
+        n_leading = self.function.ndim - len(broadcasting_tuple)
+        return (True,) * n_leading + tuple(broadcasting_tuple)
+
+    def in_loop_order(self, broadcasting_tuple):
+        "Order a (padded) broadcasting tuple from the outermost loop inwards"
+        return tuple(broadcasting_tuple[dim] for dim in self.loop_dims)
+
+    def should_make_temp(self, node):
+        """
+        Decide whether to compute a partially hoistable expression into an
+        array temporary instead of recomputing it in each iteration of the
+        outer loops it broadcasts in. We compare the cost of evaluating the
+        expression with the cost of loading the element from the temporary
+        (which includes the amortized allocation).
+        """
+        loop_broadcasting = self.in_loop_order(node.broadcasting)
+        if node.is_variable or admissible(loop_broadcasting,
+                                          len(loop_broadcasting)):
+            # No repeated computation
+            return False
+
+        if self.treepath_first(node, '//TempNode') is not None:
+            # The expression uses values hoisted into the loop nest
+            return False
+
+        cost = expression_cost(self.context, node)
+        return cost > self.context.array_temp_cost
+
     def make_temp(self, node):
-        "Not implemented yet"
-        return node
+        """
+        Evaluate the expression once for each element in its non-broadcasting
+        dimensions before the loop nest, into a temporary array. Returns an
+        expression that loads the element for the current iteration. The
+        temporary array is allocated by :py:meth:`allocate_array_temps`.
+        """
+        if node.is_variable:
+            # Nothing to compute, don't copy
+            return node
 
-    def hoisting_level(self, node):
-        i = 0
-        for i, broadcasting in enumerate(node.broadcasting[::-1]):
-            if not broadcasting:
-                break
+        b = self.astbuilder
+        function = self.function
+        dtype = node.type.dtype
+        dims = [dim for dim, broadcasting in enumerate(node.broadcasting)
+                        if not broadcasting]
+
+        extents = [b.shape_index(dim, function) for dim in dims]
+        size = reduce(b.mul, extents, b.sizeof(dtype))
+
+        array_temp = b.temp(dtype.pointer(), name='array_temp')
+        size_temp = b.temp(minitypes.size_t, name='alloc_size')
+
+        # Generate a C-contiguous loop nest to compute the temporary
+        fill_body = b.stats()
+        fill_loop = fill_body
+        indices = {}
+        for dim, extent in reversed(zip(dims, extents)):
+            fill_loop = b.for_range_upwards(fill_loop, upper=extent)
+            indices[dim] = fill_loop.target
+
+        expr = ElementResolver(self.context, function, indices).visit(node)
+        fill_body.stats.append(
+            b.assign(b.index(array_temp, self.temp_index(dims, indices)),
+                     expr))
+
+        self.array_temps.append((array_temp, size_temp, size, fill_loop))
+
+        # Index the temporary with the indices of the loop nest. The last
+        # loop for a dimension has the index of the element (the first
+        # loops of tiled specializations only step over the tiles).
+        loop_indices = {}
+        for dim in dims:
+            loop_indices[dim] = function.for_loops[self.loop_levels[dim]].index
+
+        result = b.index(array_temp, self.temp_index(dims, loop_indices))
+        result.need_temp = False
+        return result
+
+    def allocate_array_temps(self):
+        """
+        Allocate the array temporaries and fill them before the loop nest,
+        and free them before the function returns. If an allocation fails,
+        the temporaries are freed and the function returns its error value.
+        malloc(0) may return NULL, which is not an error.
+        """
+        b = self.astbuilder
+        function = self.function
+
+        malloc_type = minitypes.FunctionType(
+                return_type=minitypes.void.pointer(), args=[minitypes.size_t])
+        free_type = minitypes.FunctionType(
+                return_type=minitypes.void, args=[minitypes.void.pointer()])
+        malloc = b.funcname(malloc_type, 'malloc')
+        free = b.funcname(free_type, 'free')
+
+        allocations = []
+        fill_loops = []
+        frees = []
+        failed = None
+        for array_temp, size_temp, size, fill_loop in self.array_temps:
+            allocations.append(b.assign(size_temp, size))
+            allocations.append(
+                b.assign(array_temp, b.cast(b.funccall(malloc, [size_temp]),
+                                            array_temp.type)))
+            fill_loops.append(fill_loop)
+            frees.append(b.expr_stat(b.funccall(free, [array_temp])))
+
+            failure = b.binop(minitypes.bool_, '&&',
+                              b.unop(minitypes.bool_, '!', array_temp),
+                              size_temp)
+            if failed is None:
+                failed = failure
+            else:
+                failed = b.binop(minitypes.bool_, '||', failed, failure)
+
+        check = b.if_(failed, b.stats(*frees + [
+                                        b.return_(function.error_value)]))
+        function.body = b.stats(*allocations + [check] + fill_loops +
+                                [function.body])
+
+        # Free the temporaries before returning
+        return_stat = function.body.stats.pop()
+        function.body.stats.extend(
+            [b.expr_stat(b.funccall(free, [array_temp]))
+                 for array_temp, _, _, _ in self.array_temps])
+        function.body.stats.append(return_stat)
+
+    def temp_index(self, dims, indices):
+        "Index into a C-contiguous temporary array over the given dimensions"
+        b = self.astbuilder
+        index = indices[dims[0]]
+        for dim in dims[1:]:
+            extent = b.shape_index(dim, self.function)
+            index = b.add(b.mul(index, extent), indices[dim])
+
+        return index
 
-        return self.function.ndim - 1 - i
+    def hoisting_level(self, node):
+        """
+        Return the level of the loop the node can be hoisted into, or -1 if
+        the node can be hoisted out of the loop nest entirely.
+        """
+        levels = [self.loop_levels[dim]
+                      for dim, broadcasting in enumerate(node.broadcasting)
+                          if not broadcasting]
+        return max(levels or [-1])
 
     def hoist(self, node):
+        """
+        Hoist the node to the outermost loop possible, see hoisting_level().
+        Structurally equal expressions hoisted to the same loop are only
+        computed once, e.g. for the vectorized and the fixup loop.
+        """
         if not node.hoistable:
             return node
 
-        b = self.astbuilder
+        vector_type = None
+        if node.type.is_vector:
+            # Compute a single element and splat it
+            vector_type = node.type
+            scalar_node = VectorScalarizer(self.context, self.splats).visit(node)
+            scalar_node.broadcasting = node.broadcasting
+            scalar_node.hoistable = True
+            node = scalar_node
 
         hoisting_level = self.hoisting_level(node)
+        key = hoisting_level, node
+        if key not in self.hoisted_temps:
+            self.hoisted_temps[key] = self.hoist_scalar(node, hoisting_level)
+
+        temp = self.hoisted_temps[key]
+        if vector_type is not None:
+            temp = self.splat(temp, vector_type, hoisting_level)
+
+        return self.visit(temp)
+
+    def hoisting_loop(self, hoisting_level):
         if hoisting_level < 0:
-            for_loop = self.function
+            return self.function
         else:
-            for_loop = self.function.for_loops[hoisting_level]
+            return self.function.for_loops[hoisting_level]
 
-        temp = b.temp(node.type.dtype, name='hoisted_temp')
+    def hoist_scalar(self, node, hoisting_level):
+        "Assign a scalar expression to a temporary at the hoisting level"
+        b = self.astbuilder
+        dtype = node.type.dtype if node.type.is_array else node.type
+
+        if self.should_make_temp(node):
+            # Load the element from the temporary at the hoisting level
+            node = self.make_temp(node)
+
+        temp = b.temp(dtype, name='hoisted_temp')
         temp.broadcasting = None
 
         # TODO: keep track of the variables
-        for variable in self.treepath(node, '//Variable'):
+        variables = list(self.treepath(node, '//Variable'))
+        if node.is_variable:
+            variables.append(node)
+
+        for variable in variables:
             variable.hoisted = True
 
+        for_loop = self.hoisting_loop(hoisting_level)
         stat = b.assign(temp, node, may_reorder=False)
         for_loop.body = b.stats(stat, for_loop.body)
-        return self.visit(temp)
+        self.hoisted_stats[temp] = stat
+        return temp
+
+    def splat(self, temp, vector_type, hoisting_level):
+        "Splat a hoisted scalar into a vector at the hoisting level"
+        b = self.astbuilder
+
+        if temp not in self.vector_temps:
+            vector_temp = b.temp(vector_type, name='hoisted_vector')
+            vector_temp.broadcasting = None
+
+            # Insert after the assignment to the scalar
+            stats = self.hoisting_loop(hoisting_level).body.stats
+            index = [i for i, stat in enumerate(stats)
+                         if stat is self.hoisted_stats[temp]][0]
+            stats.insert(index + 1, b.assign(vector_temp,
+                                             b.vector_splat(vector_type, temp)))
+            self.vector_temps[temp] = vector_temp
+            self.splats[vector_temp] = temp
+
+        return self.vector_temps[temp]
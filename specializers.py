@@ -25,8 +25,59 @@ def debug(*args):
     sys.stderr.write(" ".join(str(arg) for arg in args) + '\n')
 
 def specialize_ast(ast):
+    """
+    Copy an AST for a specializer to modify. The nodes are copied, since
+    specializers and the transforms that follow them modify the nodes they
+    visit in place. The types are shared with the original AST, see
+    :py:class:`minivect.minitypes.Type`.
+    """
     return copy.deepcopy(ast)
 
+def reduction_axes(function, reduction):
+    "The axes of the broadcast shape a ReductionNode reduces over"
+    if reduction.axes is None:
+        return range(function.ndim)
+    return reduction.axes
+
+def reduces_loop(function, for_node, axes):
+    """
+    Whether a loop of a specialized function iterates over reduced axes only.
+    A loop without a dimension iterates over all elements (contiguous
+    specializations).
+    """
+    dim = getattr(for_node, 'dim', None)
+    if dim is None:
+        return len(axes) == function.ndim
+    return dim in axes
+
+def n_reduced_loops(function, axes):
+    "The number of innermost loops that iterate over reduced axes only"
+    n = 0
+    for for_node in function.for_loops[::-1]:
+        if not reduces_loop(function, for_node, axes):
+            break
+        n += 1
+
+    return n
+
+def broadcasts_in_inner_dim(context, function, type, order=None):
+    """
+    Whether an array operand of the given type broadcasts in the contiguous
+    dimension of the specializations for the given order ('C' or 'F'), or in
+    all dimensions if the order is None (contiguous specializations). The
+    elements of such operands are loaded outside the contiguous loop. The
+    broadcasting information of types is only used if the context
+    optimizes broadcasting.
+    """
+    if not context.optimize_broadcasting:
+        return False
+    elif order is None:
+        return miniutils.all(type.broadcasting)
+    elif order == 'F':
+        return type.ndim == function.ndim and type.broadcasting[0]
+    else:
+        return type.broadcasting[-1]
+
 class ASTMapper(minivisitor.VisitorTransform):
     """
     Base class to map foreign ASTs onto a minivect AST, or vice-versa.
@@ -139,6 +190,7 @@ class BaseSpecializer(ASTMapper):
         return node
 
     visit_AssignmentExpr = visit_Node
+    visit_ReductionNode = visit_Node
     visit_ErrorHandler = visit_Node
     visit_BinopNode = visit_Node
     visit_UnopNode = visit_Node
@@ -161,6 +213,13 @@ class Specializer(BaseSpecializer):
     is_inner_contig_specializer = False
     is_strided_specializer = False
 
+    # number of inner loop iterations to prefetch strided operands ahead,
+    # see miniast.Context.prefetch_strided
+    prefetch_distance = None
+    # minimum data size of a parallel section, overrides the omp_size of
+    # the function (see minivect.autotune.OpenMPCalibrator)
+    omp_size = None
+
     vectorized_equivalents = None
 
     def __init__(self, context, specialization_name=None):
@@ -257,12 +316,17 @@ class Specializer(BaseSpecializer):
         Insert an OpenMP for loop with an 'if' clause that checks to see
         whether the total data size exceeds the given OpenMP auto-tuned size.
         The caller needs to adjust the size, set in the FunctionNode's
-        'omp_size' attribute, depending on the number of computations.
+        'omp_size' attribute, depending on the number of computations, or
+        in the 'omp_size' attribute of the specializer.
         """
-        if_clause = self.astbuilder.binop(minitypes.bool_, '>',
-                                          self.function.total_shape,
-                                          self.function.omp_size)
-        return self.astbuilder.omp_for(node, if_clause)
+        b = self.astbuilder
+        omp_size = self.function.omp_size
+        if self.omp_size is not None:
+            omp_size = b.constant(self.omp_size, omp_size.type)
+
+        if_clause = b.binop(minitypes.bool_, '>', self.function.total_shape,
+                            omp_size)
+        return b.omp_for(node, if_clause)
 
 class FinalSpecializer(BaseSpecializer):
     """
@@ -275,6 +339,12 @@ class FinalSpecializer(BaseSpecializer):
     vectorized_equivalents = None
     in_lhs_expr = False
     should_vectorize = False
+    # number of elements of the current masked fixup iteration
+    remainder = None
+    # operand whose vectors are aligned after peeling, see misaligned()
+    alignment_variable = None
+    alignment_pointer = None
+    store_aligned = False
 
     def __init__(self, context, previous_specializer):
         super(FinalSpecializer, self).__init__(context)
@@ -288,14 +358,26 @@ class FinalSpecializer(BaseSpecializer):
         self.strides = {}
         self.outer_pointers = {}
         self.vector_temps = {}
+        # array operand name -> pointer to the current row
+        self.row_pointers = {}
+        # names of the operands prefetched in the inner loop
+        self.prefetched = set()
+        # id(for node) -> prefetch statements, emitted once the loop body
+        # has set up the data pointers
+        self.prefetches = {}
+        # array operand name -> pointer to the start of the current row in
+        # the inner tiling loop of vectorized tiled specializations
+        self.tile_row_pointers = {}
+
+        # lhs name -> (operator, accumulator, outer node, store statement)
+        self.accumulators = {}
+        # lhs name -> vector accumulator
+        self.vector_accumulators = {}
 
     def run_optimizations(self, node):
         import optimize
 
-        # TODO: support vectorized specializations
-        if (self.context.optimize_broadcasting and not
-                self.sp.is_contig_specializer or
-                self.sp.is_vectorizing_specializer):
+        if self.context.optimize_broadcasting:
             optimizer = optimize.HoistBroadcastingExpressions(self.context)
             node = optimizer.visit(node)
 
@@ -312,27 +394,42 @@ class FinalSpecializer(BaseSpecializer):
                                (self.sp.is_vectorizing_specializer and not
                                 self.should_vectorize))
             inner_contig = (
-                self.sp.is_inner_contig_specializer and
-                (last_loop_level or node.hoisted) and
+                self.sp.is_inner_contig_specializer and last_loop_level and
                 (not self.sp.is_strided_specializer or
                  self.sp.matching_contiguity(node.type)))
 
-            contig = self.sp.is_contig_specializer
+            # Hoisted variables are loaded outside the contiguous loop
+            contig = self.sp.is_contig_specializer and not node.hoisted
 
             arg_data_pointer = self.function.args[node.name].data_pointer
             if self.sp.is_contig_specializer:
                 data_pointer = arg_data_pointer
+            elif self.in_vectorized_tiles() and not node.hoisted:
+                return self.handle_tiled_variable(node, arg_data_pointer)
             else:
                 self.compute_temp_strides(node, inner_contig, tiled=tiled)
                 data_pointer = self.compute_data_pointer(
                             node, arg_data_pointer, inner_contig, tiled)
 
+            if self.sp.is_contig_specializer:
+                order = None
+            else:
+                order = self.sp.order
+
+            if ((inner_contig or contig) and not self.in_lhs_expr and
+                    broadcasts_in_inner_dim(self.context, self.function,
+                                            node.type, order)):
+                return self.handle_broadcasting_variable(node, data_pointer)
+
             for_node = self.function.for_loops[self.loop_level - 1]
 
-            if self.should_vectorize:
+            if self.should_vectorize and not node.hoisted:
                 return self.handle_vector_variable(node, data_pointer, for_node,
                                                    inner_contig, contig)
             else:
+                if not (inner_contig or contig):
+                    self.prefetch(node, data_pointer, for_node)
+
                 element = self.element_location(data_pointer, for_node,
                                                 inner_contig, contig,
                                                 tiled=tiled)
@@ -353,8 +450,95 @@ class FinalSpecializer(BaseSpecializer):
             # strided access
             return self.astbuilder.dereference(data_pointer)
 
+    def handle_broadcasting_variable(self, variable, data_pointer):
+        """
+        Load the single element of an operand that broadcasts in the
+        contiguous dimension. Such operands are usually hoisted, but we may
+        be dispatched to even if they are not (see
+        :py:func:`broadcasts_in_inner_dim`).
+        """
+        b = self.astbuilder
+
+        element = b.dereference(data_pointer)
+        if self.should_vectorize:
+            vector_type = b.vector_variable(variable,
+                                            self.sp.vector_size).type
+            return b.vector_splat(vector_type, element)
+
+        return b.resolved_variable(variable.name, variable.type, element)
+
+    def in_vectorized_tiles(self):
+        """
+        Whether we are in the inner tiling loop (or its peel or fixup loops)
+        of a vectorized tiled specialization.
+        """
+        return (self.sp.is_tiled_specializer and
+                self.sp.is_vectorizing_specializer and
+                self.loop_level == len(self.function.for_loops))
+
+    def handle_tiled_variable(self, variable, argument_data_pointer):
+        """
+        Load or store an element or a vector of an operand in the inner
+        tiling loop of a vectorized tiled specialization. Operands are
+        indexed from the start of their current row with the index of the
+        loop, or gathered if they are not contiguous in the row.
+        """
+        b = self.astbuilder
+
+        for_node = self.function.for_loops[-1]
+        self.compute_temp_strides(variable, False, tiled=True)
+        data_pointer = self.tile_row_pointer(variable, argument_data_pointer)
+
+        dim = for_node.dim - (self.function.ndim - variable.type.ndim)
+        if dim < 0 or (not self.in_lhs_expr and
+                       broadcasts_in_inner_dim(self.context, self.function,
+                                               variable.type, self.sp.order)):
+            return self.handle_broadcasting_variable(variable, data_pointer)
+
+        inner_contig = self.sp.matching_contiguity(variable.type)
+        stride = None
+        if not inner_contig:
+            stride = self.strides[variable][dim]
+            data_pointer = b.add(data_pointer, b.mul(for_node.index, stride))
+
+        if self.should_vectorize:
+            return self.handle_vector_variable(variable, data_pointer,
+                                               for_node, inner_contig, False,
+                                               stride=stride)
+
+        element = self.element_location(data_pointer, for_node,
+                                        inner_contig, False, tiled=True)
+        return b.resolved_variable(variable.name, variable.type, element)
+
+    def tile_row_pointer(self, variable, argument_data_pointer):
+        """
+        Return a pointer to the first element of the current row of the
+        operand, i.e. the pointer to the current tile less the lower limit
+        of the inner tiling loop times the stride.
+        """
+        b = self.astbuilder
+
+        if variable.name in self.tile_row_pointers:
+            return self.tile_row_pointers[variable.name]
+
+        pointer = self.compute_data_pointer(variable, argument_data_pointer,
+                                            True, True)
+        for_node = self.function.for_loops[-1]
+        dim = for_node.dim - (self.function.ndim - variable.type.ndim)
+        if dim >= 0:
+            lower = self.function.lower_tiling_limits[for_node.dim]
+            offset = b.mul(lower, self.strides[variable][dim])
+            row_pointer = b.temp(pointer.type.unqualify("const"),
+                                 name='%s_row' % variable.name)
+            self.function.for_loops[-2].prepending.stats.append(
+                    b.assign(row_pointer, b.sub(pointer, offset)))
+            pointer = row_pointer
+
+        self.tile_row_pointers[variable.name] = pointer
+        return pointer
+
     def handle_vector_variable(self, variable, data_pointer, for_node,
-                               inner_contig, is_contig):
+                               inner_contig, is_contig, stride=None):
         b = self.astbuilder
 
         # For array operands, load reads into registers, and store
@@ -362,17 +546,30 @@ class FinalSpecializer(BaseSpecializer):
         # we use a vector type, for assignment to a data pointer, the
         # data pointer type
 
+        self.row_pointers[variable.name] = data_pointer
+        if stride is None:
+            aligned = self.vector_alignment(variable, data_pointer)
+        else:
+            # Gathers don't need alignment
+            aligned = False
+
         if inner_contig or is_contig:
             data_pointer = b.add(data_pointer, for_node.index)
 
         if self.in_lhs_expr:
+            self.store_aligned = aligned
             return data_pointer
+        elif self.remainder is not None:
+            # Masked fixup iteration
+            return b.vector_load(data_pointer, self.sp.vector_size,
+                                 self.remainder)
         else:
             variable = b.vector_variable(variable, self.sp.vector_size)
             if variable in self.vector_temps:
                 return self.vector_temps[variable]
 
-            rhs = b.vector_load(data_pointer, self.sp.vector_size)
+            rhs = b.vector_load(data_pointer, self.sp.vector_size,
+                                aligned=aligned, stride=stride)
             temp = b.temp(variable.type, 'xmm')
             self.vector_temps[variable] = temp
 
@@ -380,6 +577,37 @@ class FinalSpecializer(BaseSpecializer):
 
             return self.visit(temp)
 
+    def prefetch(self, variable, data_pointer, for_node):
+        """
+        Prefetch the element of a strided operand that the inner loop
+        accesses prefetch_distance iterations ahead, using the stride
+        computed by compute_temp_strides(). The prefetch is emitted after
+        the data pointers are (re)computed at the start of the loop body,
+        see visit_ForNode().
+        """
+        b = self.astbuilder
+
+        distance = self.sp.prefetch_distance
+        if (not self.context.prefetch_strided or not distance or
+                for_node is not self.function.for_loops[-1] or
+                variable.name in self.prefetched):
+            return
+
+        dim = for_node.dim - (self.function.ndim - variable.type.ndim)
+        if dim < 0 or variable.type.broadcasting[dim]:
+            return
+
+        self.prefetched.add(variable.name)
+        stride = self.strides[variable][dim]
+        address = b.add(data_pointer, b.mul(stride, b.constant(distance)))
+        functype = minitypes.FunctionType(
+                return_type=minitypes.void,
+                args=[minitypes.void.pointer(), minitypes.int_])
+        prefetch = b.funcname(functype, '__builtin_prefetch')
+        write = b.constant(int(self.in_lhs_expr))
+        self.prefetches.setdefault(id(for_node), []).append(
+                b.expr_stat(b.funccall(prefetch, [address, write])))
+
     def compute_temp_strides(self, variable, handle_inner_dim, tiled=False):
         b = self.astbuilder
 
@@ -419,29 +647,42 @@ class FinalSpecializer(BaseSpecializer):
 
         offset = self.function.ndim - variable.type.ndim
         stop = loop_level - handle_inner_dim
-        if self.outer_pointers.get(variable):
-            start = len(self.outer_pointers[variable])
-            if stop <= start:
-                return self.outer_pointers[variable][stop - 1]
-        else:
-            self.outer_pointers[variable] = []
-            start = offset
 
-        outer_pointers = self.outer_pointers[variable]
+        # The pointer in each loop, operands with fewer dimensions keep the
+        # pointer of the enclosing loop in loops over dimensions they
+        # broadcast in. (Tiled specializations have more loops than
+        # dimensions.)
+        loop_pointers = self.outer_pointers.setdefault(variable, [])
+        start = len(loop_pointers)
+        if stop <= 0:
+            return argument_data_pointer
+        elif stop <= start:
+            return loop_pointers[stop - 1]
+
+        outer_pointers = [p for p in loop_pointers
+                              if p is not argument_data_pointer]
         temp = argument_data_pointer
+        if loop_pointers:
+            temp = loop_pointers[-1]
         for_loops = self.function.for_loops[start:stop]
 
         for i, for_node in zip(range(start, stop), for_loops):
             if for_node.dim < offset:
+                loop_pointers.append(temp)
                 continue
 
             temp = b.temp(pointer_type)
             dim = for_node.dim - offset
 
-            if not outer_pointers: #i == offset:
+            if not outer_pointers and i == 0:
                 outer_node = self.function
                 outer_pointer = self.function.args[variable.name].data_pointer
                 may_reorder = True
+            elif not outer_pointers:
+                # Restart for each iteration of the enclosing loop
+                outer_node = self.function.for_loops[i - 1]
+                outer_pointer = self.function.args[variable.name].data_pointer
+                may_reorder = False
             else:
                 outer_node = self.function.for_loops[i - 1]
                 outer_pointer = outer_pointers[-1]
@@ -471,7 +712,8 @@ class FinalSpecializer(BaseSpecializer):
             else:
                 for_node.appending.stats.append(stat)
 
-            self.outer_pointers[variable].append(temp)
+            outer_pointers.append(temp)
+            loop_pointers.append(temp)
 
         return temp
 
@@ -524,6 +766,10 @@ class FinalSpecializer(BaseSpecializer):
         self.visitchildren(node)
         # node.prepending_stats.append(node.body)
         # node.body = self.astbuilder.stats(*node.prepending_stats)
+        if node.appending.stats:
+            # Execute any appending statements before returning
+            node.appending.stats.append(node.body.stats.pop())
+
         self.handle_pending_stats(node)
 
         return node
@@ -541,14 +787,79 @@ class FinalSpecializer(BaseSpecializer):
 
         self.init_pending_stats(node)
         self._visit_set_vectorizing_flag(node)
+        node.prepending.stats.extend(self.prefetches.pop(id(node), []))
         self.handle_pending_stats(node)
 
+        if node.alignment_variable is not None:
+            # Peel iterations until the stored operand is aligned
+            node.condition = self.astbuilder.binop(
+                    minitypes.bool_, '&&', node.condition,
+                    self.misaligned(node.alignment_variable))
+
         self.loop_level -= is_nd_fornode
         return node
 
+    def misaligned(self, variable):
+        """
+        Return an expression that is true if the element of the array operand
+        in the current iteration of the inner loop is not aligned to the
+        vector size. The vector loads and stores of operands with the same
+        misalignment are aligned after the peeled iterations.
+        """
+        in_lhs_expr, should_vectorize = self.in_lhs_expr, self.should_vectorize
+        self.in_lhs_expr = self.should_vectorize = True
+        pointer = self.visit(variable)
+        self.in_lhs_expr, self.should_vectorize = in_lhs_expr, should_vectorize
+
+        self.alignment_variable = variable
+        self.alignment_pointer = self.row_pointers[variable.name]
+        return self.misalignment(self.astbuilder.cast(pointer,
+                                                      minitypes.size_t))
+
+    def misalignment(self, address):
+        "Return the offset of the address from the vector size alignment"
+        b = self.astbuilder
+        alignment = b.constant(self.sp.vector_size * 4, minitypes.size_t)
+        return b.binop(minitypes.size_t, '%', address, alignment)
+
+    def nontemporal(self, aligned):
+        """
+        Return whether to store the vectors of the aligned operand with
+        non-temporal stores: an expression comparing the size of the data
+        to the context's streaming_store_threshold, or False.
+        """
+        threshold = self.context.streaming_store_threshold
+        if aligned is not True or threshold is None:
+            return False
+
+        b = self.astbuilder
+        itemsize = self.alignment_variable.type.dtype.itemsize
+        return b.binop(minitypes.bool_, '>', self.function.total_shape,
+                       b.constant(threshold // itemsize))
+
+    def vector_alignment(self, variable, pointer):
+        """
+        Return whether vector loads and stores of the array operand with the
+        given pointer to the current row are aligned: a boolean, or an
+        expression comparing its misalignment to the aligned operand.
+        """
+        if self.alignment_variable is None:
+            return False
+        elif variable.name == self.alignment_variable.name:
+            return True
+
+        b = self.astbuilder
+        offset = b.binop(minitypes.size_t, '-',
+                         b.cast(pointer, minitypes.size_t),
+                         b.cast(self.alignment_pointer, minitypes.size_t))
+        return b.binop(minitypes.bool_, '==', self.misalignment(offset),
+                       b.constant(0, minitypes.size_t))
+
     def visit_IfNode(self, node):
         self.loop_level += node.is_fixup
+        self.remainder = node.remainder
         result = self._visit_set_vectorizing_flag(node)
+        self.remainder = None
         self.loop_level -= node.is_fixup
         return result
 
@@ -561,10 +872,195 @@ class FinalSpecializer(BaseSpecializer):
 
         if node.lhs.type.is_pointer and node.rhs.type.is_vector:
             # This expression must be a statement
-            return self.astbuilder.vector_store(node.lhs, node.rhs)
+            return self.astbuilder.vector_store(
+                        node.lhs, node.rhs, self.remainder, self.store_aligned,
+                        self.nontemporal(self.store_aligned))
 
         return node
 
+    def visit_ReductionNode(self, node):
+        """
+        Reduce into the lhs operand. If the innermost loops iterate over
+        reduced axes, we accumulate in a temporary that is loaded from the
+        lhs before these loops and stored back after them. When vectorized,
+        we keep a partial result for each element of the SIMD vector, which
+        are combined before the store. Otherwise, each iteration of the
+        innermost loop updates a different element of the lhs.
+        """
+        b = self.astbuilder
+
+        axes = reduction_axes(self.function, node)
+        n_loops = len(self.function.for_loops)
+        level = n_loops - n_reduced_loops(self.function, axes)
+        assert level == 0 or not self.sp.is_contig_specializer, (
+                    "Contiguous specializations only support full reductions")
+
+        if level == n_loops:
+            self.handle_parallel_reduction(node, axes)
+            return self.update_elementwise(node)
+
+        rhs = self.visit(node.rhs)
+        accumulator = self.accumulator(node, axes, level)
+        if rhs.type.is_vector:
+            vector_accumulator = self.vector_accumulator(node, rhs.type)
+            return self.reduce_into(node.operator, vector_accumulator, rhs)
+
+        stats, operand = self.reduction_operand(node, rhs)
+        stats.append(self.reduce_into(node.operator, accumulator, operand))
+        return b.stats(*stats)
+
+    def update_elementwise(self, node):
+        "Combine the rhs with the lhs element of the current iteration"
+        b = self.astbuilder
+
+        rhs = self.visit(node.rhs)
+        self.in_lhs_expr = True
+        lhs = self.visit(node.lhs)
+        self.in_lhs_expr = False
+
+        if rhs.type.is_vector:
+            # lhs is a data pointer, load the elements in a vector
+            aligned = self.store_aligned
+            result = b.vector_binop(node.operator, self.visit(node.lhs), rhs)
+            return b.expr_stat(b.vector_store(lhs, result, self.remainder,
+                                              aligned,
+                                              self.nontemporal(aligned)))
+
+        stats, operand = self.reduction_operand(node, rhs)
+        stats.append(self.reduce_into(node.operator, lhs, operand))
+        return b.stats(*stats)
+
+    def reduction_operand(self, node, rhs):
+        """
+        Return a list of statements and the operand to combine with the
+        lhs or accumulator. The rhs of min and max reductions is assigned
+        to a temporary, since it is evaluated twice.
+        """
+        b = self.astbuilder
+        if node.operator not in ('min', 'max'):
+            return [], rhs
+
+        temp = b.temp(node.lhs.type.dtype, name='reduction_operand')
+        return [b.assign(temp, rhs)], temp
+
+    def reduce_into(self, operator, target, value):
+        """
+        Return a statement that combines ``value`` into ``target``. The value
+        is evaluated twice for the min and max operators.
+        """
+        b = self.astbuilder
+
+        if target.type.is_vector:
+            return b.assign(target, b.vector_binop(operator, target, value))
+        elif operator in ('min', 'max'):
+            comparison = dict(min='<', max='>')[operator]
+            cond = b.binop(minitypes.bool_, comparison, value, target)
+            return b.if_(cond, b.assign(target, value))
+        else:
+            type = self.get_type(target.type)
+            return b.assign(target, b.binop(type, operator, target, value))
+
+    def accumulator(self, node, axes, level):
+        """
+        Return the scalar accumulator for the reduction into node.lhs. The
+        first time, load it from the lhs element before the loop at the
+        given level and store it back after the loop. The loops from the
+        given level onwards iterate over reduced axes only.
+        """
+        b = self.astbuilder
+
+        name = node.lhs.name
+        if name in self.accumulators:
+            operator, accumulator, outer_node, store = self.accumulators[name]
+            assert operator == node.operator, (
+                        "Different reductions into operand %s" % name)
+            return accumulator
+
+        data_pointer = self.function.args[name].data_pointer
+        if level == 0:
+            outer_node = self.function
+        else:
+            outer_node = self.function.for_loops[level - 1]
+
+            loop_level = self.loop_level
+            self.loop_level = level
+            self.compute_temp_strides(node.lhs, False)
+            data_pointer = self.compute_data_pointer(
+                    node.lhs, data_pointer, False, self.sp.is_tiled_specializer)
+            self.loop_level = loop_level
+
+        accumulator = b.temp(node.lhs.type.dtype, name='%s_acc' % name)
+        load = b.assign(accumulator, b.dereference(data_pointer))
+        store = b.assign(b.dereference(data_pointer), accumulator)
+
+        # The store goes before any pointer increments
+        outer_node.prepending.stats.append(load)
+        outer_node.appending.stats.insert(0, store)
+
+        self.accumulators[name] = node.operator, accumulator, outer_node, store
+        self.handle_parallel_reduction(node, axes, accumulator, level)
+        return accumulator
+
+    def vector_accumulator(self, node, vector_type):
+        """
+        Return a vector of partial results for the reduction into node.lhs,
+        and combine the partial results into the scalar accumulator before
+        it is stored.
+        """
+        b = self.astbuilder
+
+        name = node.lhs.name
+        if name in self.vector_accumulators:
+            return self.vector_accumulators[name]
+
+        operator, accumulator, outer_node, store = self.accumulators[name]
+        if operator == '+':
+            init = b.vector_const(vector_type, 0)
+        elif operator == '*':
+            init = b.vector_const(vector_type, 1)
+        else:
+            init = b.vector_splat(vector_type, accumulator)
+
+        vector_accumulator = b.temp(vector_type, name='%s_vacc' % name)
+        outer_node.prepending.stats.append(b.assign(vector_accumulator, init))
+
+        n_elements = vector_type.vector_size * 4 / accumulator.type.itemsize
+        combine = [
+            self.reduce_into(operator, accumulator,
+                             b.vector_extract(vector_accumulator, i))
+                for i in range(n_elements)]
+
+        appending = outer_node.appending.stats
+        for i, stat in enumerate(appending):
+            if stat is store:
+                appending[i:i] = combine
+                break
+
+        self.vector_accumulators[name] = vector_accumulator
+        return vector_accumulator
+
+    def handle_parallel_reduction(self, node, axes, accumulator=None,
+                                  level=None):
+        """
+        If the parallel loop iterates over a reduced axis, reduce a scalar
+        accumulator outside the parallel loop with an OpenMP reduction
+        clause: each thread accumulates in a private copy, and the copies
+        are combined at the end of the loop. In any other case, the
+        threads would update the same lhs elements, and we execute the
+        loop sequentially.
+        """
+        omp_for = self.treepath_first(self.function, '//OpenMPLoopNode')
+        parallel_loop = self.function.for_loops[0]
+        if (omp_for is None or
+                not reduces_loop(self.function, parallel_loop, axes)):
+            return
+
+        if level == 0 and not self.sp.is_vectorizing_specializer:
+            omp_for.reductions.append(accumulator)
+            omp_for.reduction_operators.append(node.operator)
+        else:
+            omp_for.if_clause = self.astbuilder.constant(0)
+
     def visit_TempNode(self, node):
         self.visitchildren(node)
         return node
@@ -699,7 +1195,14 @@ class FinalSpecializer(BaseSpecializer):
         return node
 
     def visit_PragmaForLoopNode(self, node):
-        if self.previous_specializer.is_vectorizing_specializer:
+        # Pragmas like '#pragma simd' assert there are no loop-carried
+        # dependencies, which accumulating reductions have
+        accumulates = [
+            reduction for reduction in self.treepath(node, '//ReductionNode')
+                if n_reduced_loops(self.function,
+                                   reduction_axes(self.function, reduction))]
+
+        if self.previous_specializer.is_vectorizing_specializer or accumulates:
             return self.visit(node.for_node)
         else:
             self.visitchildren(node)
@@ -764,7 +1267,9 @@ class OrderedSpecializer(Specializer):
     def ordered_loop(self, node, result_indices, lower=None, upper=None,
                      step=None, loop_order=None):
         """
-        Return a ForNode ordered in C or Fortran order.
+        Return a ForNode ordered in C or Fortran order. The lower and upper
+        bounds are functions of the dimension, the step is an expression or
+        a function of the dimension.
         """
         b = self.astbuilder
 
@@ -772,6 +1277,8 @@ class OrderedSpecializer(Specializer):
             lower = lambda i: None
         if upper is None:
             upper = lambda i: b.shape_index(i, self.function)
+        if not callable(step):
+            step = lambda i, step=step: step
         if loop_order is None:
             loop_order = self.loop_order(self.order)
 
@@ -779,7 +1286,7 @@ class OrderedSpecializer(Specializer):
         for_loops = []
         for i in range(*loop_order):
             node = b.for_range_upwards(node, lower=lower(i), upper=upper(i),
-                                       step=step)
+                                       step=step(i))
             node.dim = i
             for_loops.append(node)
             indices.append(node.target)
@@ -827,14 +1334,39 @@ def get_any_array_argument(arguments):
 class CanVectorizeVisitor(minivisitor.TreeVisitor):
     """
     Determines whether we can vectorize a given expression.
+
+    Integer expressions are vectorized, except for 64-bit multiplication,
+    minimum and maximum and ordered comparisons of unsigned integers,
+    which need AVX-512.
     """
 
     can_vectorize = True
 
+    # Set to the vector size of the vectorizing specializer
+    vector_size = None
+
+    comparison_operators = frozenset(['<', '<=', '==', '!=', '>=', '>'])
+    float_operators = frozenset(['+', '-', '*', '/', 'min', 'max'])
+    int_operators = frozenset(['+', '-', '*', '&', '|', '^', 'min', 'max'])
+
     def _valid_type(self, type):
         if type.is_array:
             type = type.dtype
-        return type.is_float and type.itemsize in (4, 8)
+        return (type.is_float or type.is_int) and type.itemsize in (4, 8)
+
+    def _valid_operator(self, type, operator):
+        if type.is_array:
+            type = type.dtype
+
+        if operator in self.comparison_operators:
+            return (type.is_float or type.signed or operator in ('==', '!=')
+                    or self.vector_size >= 16)
+        elif type.is_float:
+            return operator in self.float_operators
+        elif type.itemsize == 8 and operator in ('*', 'min', 'max'):
+            return self.vector_size >= 16
+        else:
+            return operator in self.int_operators
 
     def visit_FunctionNode(self, node):
         array_dtypes = [
@@ -848,18 +1380,43 @@ class CanVectorizeVisitor(minivisitor.TreeVisitor):
         if self.can_vectorize:
             self.visitchildren(node)
 
+    def _element_type(self, type):
+        "Operands of different layouts are vectorized alike"
+        if type.is_array:
+            return type.dtype
+        return type
+
     def visit_BinopNode(self, node):
-        if node.lhs.type != node.rhs.type or not self._valid_type(node.lhs.type):
+        if (self._element_type(node.lhs.type) !=
+                    self._element_type(node.rhs.type) or
+                not self._valid_type(node.lhs.type) or
+                not self._valid_operator(node.lhs.type, node.operator)):
             self.can_vectorize = False
         else:
             self.visitchildren(node)
 
     def visit_UnopNode(self, node):
-        if self._valid_type(node.type):
+        type = node.type
+        if type.is_array:
+            type = type.dtype
+
+        if (self._valid_type(type) and
+                (node.operator == '+' or
+                 (node.operator == '~' and type.is_int))):
+            self.visitchildren(node)
+        else:
+            self.can_vectorize = False
+
+    def visit_ReductionNode(self, node):
+        if self._valid_operator(node.lhs.type, node.operator):
             self.visitchildren(node)
         else:
             self.can_vectorize = False
 
+    def visit_IfElseExprNode(self, node):
+        # The condition would be a vector
+        self.can_vectorize = False
+
     def visit_FuncCallNode(self, node):
         self.can_vectorize = False
 
@@ -870,6 +1427,29 @@ class CanVectorizeVisitor(minivisitor.TreeVisitor):
     def visit_Node(self, node):
         self.visitchildren(node)
 
+class TiledCanVectorizeVisitor(CanVectorizeVisitor):
+    """
+    Determines whether we can vectorize the inner tiling loop of a tiled
+    specialization. Operands that are not contiguous in the inner tiling
+    dimension are gathered, element by element for 4-lane vectors and with
+    AVX2 gathers for wider ones, but cannot be stored to.
+    Reductions are not vectorized.
+    """
+
+    # Set to the order of the tiled specializer
+    order = None
+
+    def visit_AssignmentExpr(self, node):
+        type = node.lhs.type
+        if type.is_array and not ((type.is_c_contig and self.order == 'C') or
+                                  (type.is_f_contig and self.order == 'F')):
+            self.can_vectorize = False
+        else:
+            self.visitchildren(node)
+
+    def visit_ReductionNode(self, node):
+        self.can_vectorize = False
+
 def visit_if_should_vectorize(func):
     @functools.wraps(func)
     def wrapper(self, node):
@@ -907,6 +1487,7 @@ class VectorizingSpecializer(Specializer):
     @classmethod
     def can_vectorize(cls, context, ast):
         visitor = cls.can_vectorize_visitor(context)
+        visitor.vector_size = cls.vector_size
         visitor.visit(ast)
         return visitor.can_vectorize
 
@@ -939,10 +1520,22 @@ class VectorizingSpecializer(Specializer):
             if node.operator == '+':
                 node = node.operand
             else:
+                # ~x == x ^ -1
                 assert node.operator == '~'
-                raise NotImplementedError
-                node = self.astbuilder.vector_unop(node.type, node.operator,
-                                                   self.visit(node.operand))
+                ones = self.astbuilder.vector_const(node.operand.type, -1)
+                node = self.astbuilder.vector_binop('^', node.operand, ones)
+
+        return node
+
+    @visit_if_should_vectorize
+    def visit_ReductionNode(self, node):
+        if n_reduced_loops(self.function, reduction_axes(self.function, node)):
+            # Accumulate the rhs in partial results, see
+            # FinalSpecializer.visit_ReductionNode
+            node.rhs = self.visit(node.rhs)
+        else:
+            # Elementwise update of the lhs
+            self.visitchildren(node)
 
         return node
 
@@ -978,15 +1571,108 @@ class VectorizingSpecializer(Specializer):
 
         return N, i
 
+    def accumulates_in_vectors(self):
+        "Whether a reduction accumulates partial results in vectors"
+        for node in self.treepath(self.function, '//ReductionNode'):
+            if n_reduced_loops(self.function,
+                               reduction_axes(self.function, node)):
+                return True
+
+        return False
+
+    def mask_remainder(self):
+        """
+        Whether to process the remaining elements with masked loads and
+        stores. The partial results of reductions accumulated in vectors
+        would include the masked out elements.
+        """
+        return (self.context.masked_remainder and
+                not self.accumulates_in_vectors())
+
+    def alignment_variable(self, expr):
+        """
+        Return the array operand that is stored to in the inner loop, to
+        align the vectors to, or None if we don't align vectors.
+        """
+        if self.accumulates_in_vectors():
+            return None
+        elif (not self.context.align_vectors and
+                  self.context.streaming_store_threshold is None):
+            return None
+
+        for xpath in ('//AssignmentExpr', '//ReductionNode'):
+            for node in self.treepath(expr, xpath):
+                if node.lhs.type.is_array:
+                    return node.lhs
+
+        return None
+
+    def peel_loop(self, node, original_expression):
+        """
+        Generate a loop over the leading elements of the inner loop, up to
+        the first element of the stored operand that is aligned to the
+        vector size. The vectorized loop continues from there. Returns an
+        empty statement list if we don't align vectors.
+
+        Call this before :py:meth:`process_inner_forloop`.
+        """
+        b = self.astbuilder
+
+        variable = self.alignment_variable(original_expression)
+        if variable is None:
+            return b.stats()
+
+        i = node.step.lhs
+        N = node.condition.rhs
+
+        body = specialize_ast(original_expression)
+        init = b.assign_expr(i, node.init.rhs)
+        cond = b.binop(minitypes.bool_, '<', i, N)
+        step = b.assign_expr(i, b.add(i, b.constant(1)))
+        peel_loop = b.for_(body, init, cond, step, index=i)
+        peel_loop.is_fixup = True
+        # The condition is completed in FinalSpecializer.visit_ForNode
+        peel_loop.alignment_variable = copy.copy(variable)
+
+        self.should_vectorize = False
+        peel_loop = self.visit(peel_loop)
+        self.should_vectorize = True
+
+        peeled = b.temp(i.type, name='peeled')
+        node.init = b.assign_expr(i, peeled)
+        return b.stats(peel_loop, b.assign(peeled, i))
+
+    def store_fence(self, original_expression):
+        """
+        Return a statement that orders the non-temporal stores of the
+        vectorized loop before any later stores, or an empty statement list.
+        """
+        b = self.astbuilder
+        if (self.context.streaming_store_threshold is None or
+                self.alignment_variable(original_expression) is None):
+            return b.stats()
+
+        functype = minitypes.FunctionType(return_type=minitypes.void, args=[])
+        sfence = b.funcname(functype, '_mm_sfence')
+        return b.expr_stat(b.funccall(sfence, []))
+
     def fixup_loop(self, i, N, body, elements_per_vector):
         """
         Generate a loop to fix up any remaining elements that didn't fit into
-        our SIMD vectors.
+        our SIMD vectors, or a single vectorized iteration that loads and
+        stores only the remaining elements.
         """
         b = self.astbuilder
 
         cond = b.binop(minitypes.bool_, '<', i, N)
-        if elements_per_vector - 1 == 1:
+        if self.mask_remainder():
+            remainder = b.temp(i.type, name='remainder')
+            body = b.stats(b.assign(remainder, b.sub(N, i)), body)
+            fixup_loop = b.if_(cond, body)
+            fixup_loop.is_fixup = True
+            fixup_loop.remainder = remainder
+            return self.visit(fixup_loop)
+        elif elements_per_vector - 1 == 1:
             fixup_loop = b.if_(cond, body)
         else:
             # fixup_loop = b.for_range_upwards(body, lower=i, upper=N)
@@ -1021,6 +1707,29 @@ class VectorizingSpecializer(Specializer):
         N, i = self._modify_inner_loop(b, elements_per_vector, node, step)
         return self.fixup_loop(i, N, original_expression, elements_per_vector)
 
+class TiledVectorizingSpecializer(VectorizingSpecializer):
+    """
+    Vectorize the inner tiling loop of the tiled specializations.
+    """
+
+    can_vectorize_visitor = TiledCanVectorizeVisitor
+
+    @classmethod
+    def can_vectorize(cls, context, ast):
+        visitor = cls.can_vectorize_visitor(context)
+        visitor.vector_size = cls.vector_size
+        visitor.order = cls.order
+        visitor.visit(ast)
+        return visitor.can_vectorize
+
+    def mask_remainder(self):
+        "Gathered operands are not loaded with masks"
+        return (super(TiledVectorizingSpecializer, self).mask_remainder() and
+                miniutils.all(self.matching_contiguity(arg.type)
+                                  for arg in self.function.arguments
+                                      if arg.type is not None and
+                                          arg.type.is_array))
+
 class StridedCInnerContigSpecializer(OrderedSpecializer):
     """
     Specialize on the first or last dimension being contiguous (depending
@@ -1060,12 +1769,14 @@ class StridedCInnerContigSpecializer(OrderedSpecializer):
     def _vectorize_inner_loop(self, b, loop, node, original_expr):
         "Vectorize the inner loop and insert the fixup loop"
         if self.is_vectorizing_specializer:
+            peel_loop = self.peel_loop(self.inner_loop, original_expr)
+            fence = self.store_fence(original_expr)
             fixup_loop = self.process_inner_forloop(self.inner_loop,
                                                     original_expr)
             if len(self.indices) > 1:
-                loop.body = b.stats(loop.body, fixup_loop)
+                loop.body = b.stats(peel_loop, loop.body, fence, fixup_loop)
             else:
-                node = b.stats(node, fixup_loop)
+                node = b.stats(peel_loop, node, fence, fixup_loop)
 
         return node
 
@@ -1076,7 +1787,9 @@ class StridedCInnerContigSpecializer(OrderedSpecializer):
         """
         b = self.astbuilder
 
-        original_expr = specialize_ast(node.body)
+        original_expr = None
+        if self.is_vectorizing_specializer:
+            original_expr = specialize_ast(node.body)
 
         # start by generating a C or Fortran ordered loop
         self.function.for_loops, node = self.ordered_loop(node.body,
@@ -1135,6 +1848,7 @@ class StrengthReducingStridedSpecializer(StridedCInnerContigSpecializer):
     order = "C"
 
     is_strided_specializer = True
+    prefetch_distance = 16
     vectorized_equivalents = None
 
     def matching_contiguity(self, type):
@@ -1214,6 +1928,7 @@ class StridedSpecializer(StridedCInnerContigSpecializer):
 
     vectorized_equivalents = None
     is_strided_specializer = True
+    prefetch_distance = 16
 
     def matching_contiguity(self, type):
         """
@@ -1278,7 +1993,9 @@ class ContigSpecializer(OrderedSpecializer):
         Generate a single ForNode over the total data size.
         """
         b = self.astbuilder
-        original_expr = specialize_ast(node.body)
+        original_expr = None
+        if self.is_vectorizing_specializer:
+            original_expr = specialize_ast(node.body)
         node = super(ContigSpecializer, self).visit_NDIterate(node)
 
         for_node = b.for_range_upwards(node.body,
@@ -1291,8 +2008,10 @@ class ContigSpecializer(OrderedSpecializer):
         node = self.visit(node)
 
         if self.is_vectorizing_specializer:
+            peel_loop = self.peel_loop(for_node, original_expr)
+            fence = self.store_fence(original_expr)
             fixup_loop = self.process_inner_forloop(for_node, original_expr)
-            node = b.stats(node, fixup_loop)
+            node = b.stats(peel_loop, node, fence, fixup_loop)
 
         return node
 
@@ -1316,10 +2035,19 @@ class CTiledStridedSpecializer(StridedSpecializer):
     Generate tiled code for the last two (C) or first two (F) dimensions.
     The blocksize may be overridden through the get_blocksize method, in
     a specializer subclass or mixin (see miniast.Context.specializer_mixin_cls).
+
+    .. attribute:: blocksizes
+
+        the tile size in each of the two tiled dimensions, in ascending
+        order of dimension, or None to use get_blocksize() for both. See
+        :py:mod:`minivect.autotune`.
     """
     specialization_name = "tiled_c"
     order = "C"
     is_tiled_specializer = True
+    # the inner loop runs for at most a tile
+    prefetch_distance = 8
+    blocksizes = None
 
     vectorized_equivalents = None
 
@@ -1330,6 +2058,16 @@ class CTiledStridedSpecializer(StridedSpecializer):
         """
         return self.astbuilder.constant(128)
 
+    def get_blocksizes(self):
+        "Get the tile size of each tiled dimension as a dict dim -> expr"
+        tiled_order = sorted(range(*self.tiled_order()))
+        if self.blocksizes is None:
+            blocksize = self.get_blocksize()
+            return dict((dim, blocksize) for dim in tiled_order)
+
+        return dict((dim, self.astbuilder.constant(blocksize))
+                        for dim, blocksize in zip(tiled_order, self.blocksizes))
+
     def tiled_order(self):
         "Tile in the last two dimensions"
         return self.function.ndim - 1, self.function.ndim - 1 - 2, -1
@@ -1338,7 +2076,21 @@ class CTiledStridedSpecializer(StridedSpecializer):
         return self.function.ndim - 1 - 2, -1, -1
 
     def visit_NDIterate(self, node):
-        return self._tile_in_two_dimensions(node)
+        if not self.is_vectorizing_specializer:
+            return self._tile_in_two_dimensions(node)
+
+        b = self.astbuilder
+        original_expr = specialize_ast(node.body)
+        node = self._tile_in_two_dimensions(node)
+
+        # Vectorize the inner tiling loop
+        outer_loop, inner_loop = self.function.tiling_loops
+        peel_loop = self.peel_loop(inner_loop, original_expr)
+        fence = self.store_fence(original_expr)
+        fixup_loop = self.process_inner_forloop(inner_loop, original_expr)
+        outer_loop.body = b.stats(peel_loop, outer_loop.body, fence,
+                                  fixup_loop)
+        return node
 
     def _tile_in_two_dimensions(self, node):
         """
@@ -1349,12 +2101,12 @@ class CTiledStridedSpecializer(StridedSpecializer):
 
         self.tiled_indices = []
         self.indices = []
-        self.blocksize = self.get_blocksize()
+        blocksizes = self.get_blocksizes()
 
         # Generate the two outer tiling loops
         tiled_loop_body = b.stats(b.constant(0)) # fake empty loop body
         controlling_loops, body = self.ordered_loop(
-                tiled_loop_body, self.tiled_indices, step=self.blocksize,
+                tiled_loop_body, self.tiled_indices, step=blocksizes.get,
                 loop_order=self.tiled_order())
         del tiled_loop_body.stats[:]
 
@@ -1368,7 +2120,7 @@ class CTiledStridedSpecializer(StridedSpecializer):
         for i, index in zip(tiled_order, self.tiled_indices):
             upper_limit = b.temp(index.type)
             tiled_loop_body.stats.append(
-                b.assign(upper_limit, b.min(b.add(index, self.blocksize),
+                b.assign(upper_limit, b.min(b.add(index, blocksizes[i]),
                                             b.shape_index(i, self.function))))
             upper_limits[i] = upper_limit
 
@@ -1414,16 +2166,16 @@ class CTiledStridedSpecializer(StridedSpecializer):
         # if strength_reduction:
         #     body = self.strength_reduce_inner_dimension(body, innermost_loop)
 
-        for dim, for_node in enumerate(controlling_loops):
-            for_node.is_controlling_loop = True
-            for_node.blocksize = self.blocksize
-
         for dim, for_node in enumerate(tiling_loops):
             for_node.is_tiling_loop = True
 
         self.set_dims(controlling_loops)
         self.set_dims(tiling_loops)
 
+        for for_node in controlling_loops:
+            for_node.is_controlling_loop = True
+            for_node.blocksize = blocksizes[for_node.dim]
+
         self.function.controlling_loops = controlling_loops
         self.function.tiling_loops = tiling_loops
         self.function.outer_loops = outer_loops
@@ -1523,13 +2275,15 @@ class FTiledStridedSpecializer(StridedFortranSpecializer,
 #
 ### Vectorized specializer equivalents
 #
-def create_vectorized_specializers(specializer_cls):
-    bases = (VectorizingSpecializer, specializer_cls)
+def create_vectorized_specializers(specializer_cls,
+                                   vectorizing_cls=VectorizingSpecializer):
+    bases = (vectorizing_cls, specializer_cls)
     d = dict(vectorized_equivalents=None)
     name = 'Vectorized%%d%s' % specializer_cls.__name__
     cls1 = type(name % 4, bases, dict(d, vector_size=4))
     cls2 = type(name % 8, bases, dict(d, vector_size=8))
-    return cls1, cls2
+    cls3 = type(name % 16, bases, dict(d, vector_size=16))
+    return cls1, cls2, cls3
 
 ContigSpecializer.vectorized_equivalents = (
                 create_vectorized_specializers(ContigSpecializer))
@@ -1537,3 +2291,9 @@ StridedCInnerContigSpecializer.vectorized_equivalents = (
                 create_vectorized_specializers(StridedCInnerContigSpecializer))
 StridedFortranInnerContigSpecializer.vectorized_equivalents = (
                 create_vectorized_specializers(StridedFortranInnerContigSpecializer))
+CTiledStridedSpecializer.vectorized_equivalents = (
+                create_vectorized_specializers(CTiledStridedSpecializer,
+                                               TiledVectorizingSpecializer))
+FTiledStridedSpecializer.vectorized_equivalents = (
+                create_vectorized_specializers(FTiledStridedSpecializer,
+                                               TiledVectorizingSpecializer))
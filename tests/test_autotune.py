@@ -0,0 +1,209 @@
+from testutils import *
+
+import shutil
+import tempfile
+
+import numpy as np
+
+import autotune
+import dispatch
+
+from test_strided import build_strided_function
+
+def build_add_function():
+    "Build a function computing op0 = op0 + op1"
+    type1, type2 = double[:, :], double[:, :]
+    type1.broadcasting = type2.broadcasting = (False, False)
+    var1, var2 = vars = build_vars(type1, type2)
+    return build_function(vars, b.assign(var1, b.add(var1, var2)))
+
+def steps(impl):
+    return [line.split('+=')[1].strip(' );{') for line in impl.splitlines()
+                if line.strip().startswith('for (') and '+= ' in line]
+
+def test_blocksizes():
+    """
+    >>> test_blocksizes()
+    """
+    function = build_strided_function()
+    ast, impl = specialize(ctiled, function)
+    assert steps(impl) == ['128', '128']
+
+    # Rows of 16 and columns of 64 elements in C order
+    tuned = autotune.tuned_specializer(ctiled, (16, 64))
+    assert tuned is autotune.tuned_specializer(ctiled, [16, 64])
+    ast, impl = specialize(tuned, function)
+    assert steps(impl) == ['16', '64']
+    assert '__mini_mangle_shape[1]; __mini_mangle_temp1 += 64)' in impl
+
+    ftiled = specializers.FTiledStridedSpecializer
+    ast, impl = specialize(autotune.tuned_specializer(ftiled, (16, 64)),
+                           function)
+    assert steps(impl) == ['64', '16']
+
+def test_tuning_table():
+    """
+    >>> test_tuning_table()
+    """
+    table_dir = tempfile.mkdtemp()
+    try:
+        key = autotune.tuning_key(ctiled, double, (3, 100, 1000))
+        assert key == ('CTiledStridedSpecializer', 'double', 3, (7, 10))
+
+        table = autotune.TuningTable(table_dir)
+        assert table.get(key) is None
+        table.put(key, (32, 64))
+
+        # The table persists, but only for the machine that recorded it
+        assert autotune.TuningTable(table_dir).get(key) == (32, 64)
+        other_table = autotune.TuningTable(table_dir, machine='other')
+        assert other_table.get(key) is None
+        other_table.put(key, (16, 16))
+        assert table.get(key) == (32, 64)
+        assert len(table.entries()) == 2
+    finally:
+        shutil.rmtree(table_dir)
+
+def test_dispatch_tuned():
+    """
+    >>> test_dispatch_tuned()
+    """
+    tuning_context = getcontext()
+    tuning_context.tuning_table_dir = tempfile.mkdtemp()
+    try:
+        function = build_add_function()
+        dispatcher = dispatch.Dispatcher(tuning_context, function)
+        a = np.empty((200, 50))
+        specializer_cls = dispatcher.select(a, a.T.copy().T)
+        assert specializer_cls is ctiled
+        assert dispatcher.tuned(specializer_cls, a.shape) is ctiled
+
+        # Entries are looked up once per shape class
+        key = dispatcher.tuning_key(ctiled, (255, 32))
+        tuning_context.tuning_table.put(key, (64, 32))
+        dispatcher = dispatch.Dispatcher(tuning_context, function)
+        tuned = dispatcher.tuned(ctiled, a.shape)
+        assert tuned.blocksizes == (64, 32)
+        assert dispatcher.tuned(ctiled, (128, 63)) is tuned
+        assert dispatcher.tuned(ctiled, (256, 63)) is ctiled
+        assert dispatcher.tuned(cinner, a.shape) is cinner
+
+        # OpenMP thresholds are recorded per specialization of the function
+        tuning_context.tuning_table.put(dispatcher.kernel_key(ctiled), 4096)
+        dispatcher = dispatch.Dispatcher(tuning_context, function)
+        tuned = dispatcher.tuned(ctiled, a.shape)
+        assert (tuned.blocksizes, tuned.omp_size) == ((64, 32), 4096)
+        assert dispatcher.tuned(ctiled, (256, 63)).omp_size == 4096
+        assert dispatcher.tuned(cinner, a.shape) is cinner
+    finally:
+        shutil.rmtree(tuning_context.tuning_table_dir)
+
+def test_blocksize_tuner():
+    """
+    >>> test_blocksize_tuner()
+    """
+    jit_context = miniast.CJitContext()
+    jit_context.tuning_table_dir = tempfile.mkdtemp()
+    try:
+        function = build_add_function()
+        op1 = np.arange(70.0 * 90).reshape(70, 90)
+        op2 = np.asfortranarray(op1 % 13)
+        dispatcher = dispatch.Dispatcher(jit_context, function)
+        specializer_cls = dispatcher.select(op1, op2)
+        assert specializer_cls.is_tiled_specializer
+
+        tuner = autotune.BlocksizeTuner(dispatcher, candidates=(8, 16))
+        tuner.repeat = 1
+        blocksizes = tuner.tune(op1.copy(), op2)
+        assert blocksizes in [(8, 8), (16, 16)]
+        timed = [candidate for seconds, candidate in tuner.timings]
+        assert timed == [(8, 8), (16, 16)]
+        key = dispatcher.tuning_key(specializer_cls, op1.shape)
+        assert jit_context.tuning_table.get(key) == blocksizes
+
+        # A new dispatcher compiles the tuned specialization
+        dispatcher = dispatch.Dispatcher(jit_context, function)
+        result = op1.copy()
+        dispatcher(result, op2)
+        tuned, = dispatcher.compiled
+        assert tuned.__name__ == '%s_%dx%d' % ((specializer_cls.__name__,) +
+                                               blocksizes)
+        assert np.all(result == op1 + op2)
+    finally:
+        shutil.rmtree(jit_context.tuning_table_dir)
+
+def test_omp_size():
+    """
+    >>> test_omp_size()
+    """
+    function = build_strided_function()
+    ast, impl = specialize(cinner, function)
+    assert 'omp parallel for if((__mini_mangle_temp0 > 1024))' in impl
+
+    tuned = autotune.tuned_specializer(cinner, omp_size=4096)
+    assert tuned.__name__ == 'StridedCInnerContigSpecializer_omp4096'
+    ast, impl = specialize(tuned, function)
+    assert 'omp parallel for if((__mini_mangle_temp0 > 4096))' in impl
+
+def test_calibration_views():
+    """
+    >>> test_calibration_views()
+    """
+    dispatcher = dispatch.Dispatcher(context, build_strided_function())
+    calibrator = autotune.OpenMPCalibrator(dispatcher)
+
+    # The outermost dimension is halved, the 1D operand broadcasts in it
+    operands = np.empty((5, 8)), np.empty((5, 8)), np.empty(8)
+    shape, layouts = dispatcher.layouts(operands)
+    views = calibrator.views(operands, shape, layouts)
+    assert [size for size, view_operands in views] == [8, 16, 40]
+    assert [view_operands[0].shape for size, view_operands in views] == [
+                                                    (1, 8), (2, 8), (5, 8)]
+    assert all(view_operands[2] is operands[2]
+                   for size, view_operands in views)
+
+    # Fortran ordered operands keep their layout
+    operands = np.empty((8, 4), order='F'), np.empty((8, 4), order='F')
+    dispatcher = dispatch.Dispatcher(context, build_add_function())
+    shape, layouts = dispatcher.layouts(operands)
+    size, view_operands = autotune.OpenMPCalibrator(dispatcher).views(
+                                                operands, shape, layouts)[1]
+    assert size == 16
+    assert view_operands[0].shape == (8, 2)
+    assert view_operands[0].flags['F_CONTIGUOUS']
+
+def test_openmp_calibrator():
+    """
+    >>> test_openmp_calibrator()
+    """
+    jit_context = miniast.CJitContext()
+    jit_context.tuning_table_dir = tempfile.mkdtemp()
+    try:
+        function = build_add_function()
+        op1 = np.arange(64.0 * 32).reshape(64, 32)
+        op2 = op1 % 13
+        dispatcher = dispatch.Dispatcher(jit_context, function)
+        specializer_cls = dispatcher.select(op1, op2)
+
+        calibrator = autotune.OpenMPCalibrator(dispatcher)
+        calibrator.repeat = 1
+        omp_size = calibrator.calibrate(op1.copy(), op2)
+        sizes = [size for size, serial, parallel in calibrator.timings]
+        assert sizes == sorted(sizes) and sizes[-1] == op1.size
+        assert omp_size == 0 or omp_size in sizes
+        key = dispatcher.kernel_key(specializer_cls)
+        assert jit_context.tuning_table.get(key) == omp_size
+
+        # A new dispatcher compiles the calibrated specialization
+        dispatcher = dispatch.Dispatcher(jit_context, function)
+        result = op1.copy()
+        dispatcher(result, op2)
+        tuned, = dispatcher.compiled
+        assert tuned.omp_size == omp_size
+        assert np.all(result == op1 + op2)
+    finally:
+        shutil.rmtree(jit_context.tuning_table_dir)
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
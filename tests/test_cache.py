@@ -0,0 +1,153 @@
+from testutils import *
+
+import shutil
+import tempfile
+
+import minicache
+
+def build_expr(broadcasting=(False, False)):
+    type1 = double[:, :]
+    type2 = double[:, :]
+    type1.broadcasting = (False, False)
+    type2.broadcasting = broadcasting
+
+    var1, var2 = vars = build_vars(type1, type2)
+    body = b.assign(var1, b.add(var1, var2))
+    return build_function(vars, body)
+
+def test_structural_key():
+    """
+    >>> test_structural_key()
+    """
+    key1 = minicache.structural_key(build_expr())
+    key2 = minicache.structural_key(build_expr())
+    key3 = minicache.structural_key(build_expr(broadcasting=(False, True)))
+    assert key1 == key2
+    assert hash(key1) == hash(key2)
+    assert key1 != key3
+
+def test_specialize_ast():
+    """
+    >>> test_specialize_ast()
+    """
+    function = build_expr()
+    copy = specializers.specialize_ast(function)
+    assign = function.body.body.expr
+    copied_assign = copy.body.body.expr
+
+    # Nodes are copied, types are shared
+    assert copied_assign is not assign
+    assert copied_assign.lhs is not assign.lhs
+    assert copied_assign.lhs.type is assign.lhs.type
+    assert copy.type is function.type
+
+    # Nodes that occur more than once in the AST are copied once
+    assert copied_assign.lhs is copied_assign.rhs.lhs
+    assert minicache.structural_key(copy) == minicache.structural_key(
+                                                                function)
+
+    # Shared types cannot be modified, derived types can
+    try:
+        copy.type.name = 'other'
+    except AssertionError:
+        pass
+    else:
+        raise Exception("Modified a shared type")
+
+    dtype = assign.lhs.type.dtype
+    qualified = dtype.qualify('const')
+    qualified.name = 'other'
+    assert dtype.name == 'double'
+
+def test_specialization_cache():
+    """
+    >>> test_specialization_cache()
+    """
+    context = getcontext()
+    cache = context.specialization_cache
+
+    result1, = context.run(build_expr(), [cinner])
+    result2, = context.run(build_expr(), [cinner])
+    assert result1 is result2
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    result3, = context.run(build_expr(), [contig])
+    result4, = context.run(build_expr(broadcasting=(False, True)), [cinner])
+    assert result3[0].specialization_name == "contig"
+    assert result4 is not result1
+    assert (cache.hits, cache.misses) == (1, 3)
+
+def test_eviction():
+    """
+    >>> test_eviction()
+    """
+    cache = minicache.SpecializationCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+
+    # 'b' was the least recently used entry
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.evictions == 1
+    assert cache.stats() == dict(hits=3, misses=1, evictions=1,
+                                 size=2, maxsize=2)
+
+def test_kernel_cache():
+    """
+    >>> test_kernel_cache()
+    """
+    cache_dir = tempfile.mkdtemp()
+    try:
+        context1 = getcontext()
+        context1.kernel_cache_dir = cache_dir
+        _, ast1, _, (proto1, impl1) = iter(
+                        context1.run(build_expr(), [cinner])).next()
+        assert len(context1.kernel_cache.entries()) == 1
+
+        # A new context (e.g. in another process) reuses the generated code
+        context2 = getcontext()
+        context2.func_counter = 10
+        context2.kernel_cache_dir = cache_dir
+        _, ast2, _, (proto2, impl2) = iter(
+                        context2.run(build_expr(), [cinner])).next()
+
+        assert ast1.mangled_name != ast2.mangled_name
+        assert ast2.mangled_name in proto2 and ast2.mangled_name in impl2
+        assert impl1.replace(ast1.mangled_name, ast2.mangled_name) == impl2
+
+        # Evict the least recently used entry
+        context2.run(build_expr(broadcasting=(False, True)), [cinner]).next()
+        kernel_cache = context2.kernel_cache
+        (_, _, path1), (_, _, path2) = sorted(kernel_cache.entries())
+        kernel_cache.max_size = kernel_cache.size() - 1
+        kernel_cache.evict()
+        assert [path for _, _, path in kernel_cache.entries()] == [path2]
+    finally:
+        shutil.rmtree(cache_dir)
+
+def test_kernel_cache_version():
+    """
+    >>> test_kernel_cache_version()
+    """
+    cache_dir = tempfile.mkdtemp()
+    format_version = minicache.kernel_format_version
+    try:
+        context1 = getcontext()
+        context1.kernel_cache_dir = cache_dir
+        context1.run(build_expr(), [cinner]).next()
+
+        # Code generated by another version is not reused
+        minicache.kernel_format_version = format_version + 1
+        context2 = getcontext()
+        context2.kernel_cache_dir = cache_dir
+        context2.run(build_expr(), [cinner]).next()
+        assert len(context2.kernel_cache.entries()) == 2
+    finally:
+        minicache.kernel_format_version = format_version
+        shutil.rmtree(cache_dir)
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,117 @@
+from testutils import *
+
+import shutil
+import tempfile
+
+import numpy as np
+
+import cjit
+import dispatch
+import minierror
+
+from test_autotune import build_add_function
+
+def test_cjit():
+    """
+    >>> test_cjit()
+    """
+    jit_context = miniast.CJitContext()
+    jit_context.build_dir = tempfile.mkdtemp()
+    try:
+        function = build_add_function()
+        impl, ctypes_func = jit_context.specialize(function, cinner)[3]
+        assert 'static' not in impl
+        assert callable(ctypes_func)
+
+        dispatcher = dispatch.Dispatcher(jit_context, function, vectorize=True)
+        for op1, op2 in [(np.arange(70.0).reshape(7, 10),
+                          np.arange(70.0).reshape(7, 10)),
+                         (np.arange(200.0).reshape(10, 20)[:, ::2],
+                          np.arange(100.0).reshape(10, 10).T)]:
+            expected = op1 + op2
+            dispatcher(op1, op2)
+            assert np.all(op1 == expected)
+
+        # Sources are compiled once per build directory
+        compiler = cjit.CCompiler(jit_context.cc, jit_context.cflags,
+                                  jit_context.build_dir)
+        n_objects = len(os.listdir(jit_context.build_dir))
+        compiler.build(impl)
+        assert len(os.listdir(jit_context.build_dir)) == n_objects
+
+        # Specializations are compiled again with other flags
+        result = jit_context.run(function, [cinner]).next()
+        assert jit_context.run(function, [cinner]).next() is result
+        jit_context.cflags = jit_context.cflags + ['-DMINIVECT_TEST']
+        assert jit_context.run(function, [cinner]).next() is not result
+    finally:
+        shutil.rmtree(jit_context.build_dir)
+
+def test_run_batch():
+    """
+    >>> test_run_batch()
+    """
+    jit_context = miniast.CJitContext()
+    jit_context.build_dir = tempfile.mkdtemp()
+    jit_context.build_processes = 2
+    try:
+        function = build_add_function()
+        jobs = [(function, cinner), (function, ctiled), (function, cinner)]
+        calls = []
+        progress = lambda n_done, n_jobs: calls.append((n_done, n_jobs))
+
+        results = jit_context.run_batch(jobs, progress)
+        assert [result[0].__class__ for result in results] == [
+                                                    cinner, ctiled, cinner]
+        assert results[0] is results[2]
+        assert calls == [(1, 3), (2, 3), (3, 3)]
+
+        dispatcher = dispatch.Dispatcher(jit_context, function)
+        op1, op2 = np.ones((4, 5)), np.ones((4, 5))
+        for specializer, ast, codewriter, (impl, ctypes_func) in results:
+            _, args = dispatcher.prepare_specializer(type(specializer),
+                                                     op1, op2)
+            ctypes_func(*args)
+        assert np.all(op1 == 4)
+
+        # Compiled jobs are taken from the specialization cache
+        assert jit_context.run(function, [ctiled]).next() is results[1]
+        del calls[:]
+        assert jit_context.run_batch(jobs[:2], progress) == results[:2]
+        assert calls == [(1, 2), (2, 2)]
+    finally:
+        shutil.rmtree(jit_context.build_dir)
+
+def test_cjit_error():
+    """
+    >>> test_cjit_error()
+    """
+    compiler = cjit.CCompiler('cc', ['-O0'], tempfile.mkdtemp())
+    try:
+        try:
+            compiler.build("int f(void) { return undeclared; }")
+        except minierror.CCompilerError, e:
+            assert 'undeclared' in str(e)
+        else:
+            raise Exception("Expected a compile error")
+
+        assert os.listdir(compiler.build_dir) == []
+    finally:
+        shutil.rmtree(compiler.build_dir)
+
+def test_temp_build_dir():
+    """
+    >>> test_temp_build_dir()
+    """
+    # Compilers without a build directory share one temporary directory
+    jit_context = miniast.CJitContext()
+    compiler = jit_context.c_compiler
+    assert compiler.build_dir == cjit.temp_build_dir()
+    jit_context.cflags = jit_context.cflags + ['-DMINIVECT_TEST']
+    assert jit_context.c_compiler is not compiler
+    assert jit_context.c_compiler.build_dir == compiler.build_dir
+    assert cjit.CCompiler('cc', ['-O0']).build_dir == compiler.build_dir
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,22 @@
+from testutils import *
+
+import ctypes
+import ctypes.util
+
+from ctypes_conversion import set_function_pointer
+
+def test_set_function_pointer():
+    """
+    >>> test_set_function_pointer()
+    """
+    libm = ctypes.CDLL(ctypes.util.find_library('m'))
+    address = lambda func: ctypes.cast(func, ctypes.c_void_p).value
+    func = ctypes.CFUNCTYPE(ctypes.c_double, ctypes.c_double)(
+                                                address(libm.ceil))
+    assert func(1.5) == 2.0
+    set_function_pointer(func, address(libm.floor))
+    assert func(1.5) == 1.0
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
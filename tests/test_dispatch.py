@@ -0,0 +1,303 @@
+from testutils import *
+
+import numpy as np
+
+import dispatch
+
+def build_dispatcher(type1=None, type2=None, vectorize=False,
+                     max_vector_size=8):
+    type1 = type1 or double[:, :]
+    type2 = type2 or double[:, :]
+    type1.broadcasting = (False,) * type1.ndim
+    type2.broadcasting = (False,) * type2.ndim
+
+    var1, var2 = vars = build_vars(type1, type2)
+    body = b.assign(var1, b.add(var1, var2))
+    dispatch_context = getcontext()
+    dispatch_context.max_vector_size = max_vector_size
+    return dispatch.Dispatcher(dispatch_context, build_function(vars, body),
+                               vectorize=vectorize)
+
+def test_broadcast_shape():
+    """
+    >>> dispatch.broadcast_shape([(10, 1), (1, 5)])
+    (10, 5)
+    >>> dispatch.broadcast_shape([(10, 1), (4, 5)])
+    Traceback (most recent call last):
+        ...
+    ValueError: Differing extents in dim 0 (4, 10)
+    """
+
+def test_select():
+    """
+    >>> test_select()
+    """
+    dispatcher = build_dispatcher()
+    select = dispatcher.select
+    a = np.empty((20, 20))
+    rows = np.empty((40, 20))[::2]
+    strided = np.empty((20, 40))[:, ::2]
+
+    assert select(a, a) is contig
+    assert select(a.T, a.T) is contig
+    assert select(a, rows) is cinner
+    assert select(a, a[:1]) is cinner
+    assert select(a.T, rows.T) is specializers.StridedFortranInnerContigSpecializer
+    assert select(a, a.T) is ctiled
+    assert select(strided, strided) is specializers.StridedSpecializer
+    assert select(strided.T, strided.T) is specializers.StridedFortranSpecializer
+
+    assert len(dispatcher.selections) == 8
+
+    # 1D operands broadcast along the leading dimension
+    dispatcher = build_dispatcher(type2=double[:])
+    assert dispatcher.select(a, a[0]) is cinner
+    assert dispatcher.select(a.T, a[0]) is specializers.StridedFortranSpecializer
+
+def test_select_vectorized():
+    """
+    >>> test_select_vectorized()
+    """
+    dispatcher = build_dispatcher(vectorize=True)
+    a = np.empty((20, 20))
+    assert dispatcher.select(a, a) is contig.vectorized_equivalents[1]
+    assert dispatcher.select(a, a[:1]) is cinner.vectorized_equivalents[1]
+    assert dispatcher.select(a, a.T) is ctiled
+
+    # Tiled specializations are vectorized if the stored operand is
+    # contiguous in the inner tiling dimension
+    dispatcher = build_dispatcher(double[:, ::1], vectorize=True)
+    assert dispatcher.select(a, a.T) is ctiled.vectorized_equivalents[1]
+
+    # 16-lane (AVX-512) specializations must be enabled in the context
+    avx512_context = getcontext()
+    avx512_context.max_vector_size = 16
+    dispatcher = dispatch.Dispatcher(avx512_context, dispatcher.function)
+    assert dispatcher.select(a, a) is contig.vectorized_equivalents[2]
+    assert dispatcher.select(a, a[:1]) is cinner.vectorized_equivalents[2]
+
+    ast, impl = specialize(contig.vectorized_equivalents[2],
+                           build_dispatcher(float_[:, :], float_[:, :],
+                                            vectorize=True).function)
+    assert '__m512 ' in impl
+    assert '_mm512_add_ps(' in impl
+
+def test_select_reduction():
+    """
+    >>> test_select_reduction()
+    """
+    type1 = double[:, :]
+    type2 = double[:, :]
+    var1, var2 = vars = build_vars(type1, type2)
+    a = np.empty((20, 20))
+
+    # Reduce over all dimensions
+    type1.broadcasting = (True, True)
+    type2.broadcasting = (False, False)
+    function = build_function(vars, b.reduction(var1, var2))
+    dispatcher = dispatch.Dispatcher(context, function, vectorize=False)
+    assert dispatcher.select(np.empty((1, 1)), a) is contig
+    assert dispatcher.select(np.empty((1, 1)), a.T) is contig
+
+    # Reduce over the rows or the columns
+    type1.broadcasting = (False, True)
+    function = build_function(vars, b.reduction(var1, var2, axes=[1]))
+    dispatcher = dispatch.Dispatcher(context, function, vectorize=False)
+    assert dispatcher.select(np.empty((20, 1)), a) is cinner
+    assert dispatcher.select(np.empty((20, 1)), a.T) is (
+                            specializers.StridedFortranInnerContigSpecializer)
+
+    type1.broadcasting = (True, False)
+    function = build_function(vars, b.reduction(var1, var2, axes=[0]))
+    dispatcher = dispatch.Dispatcher(context, function, vectorize=False)
+    assert dispatcher.select(np.empty((1, 20)), a) is cinner
+
+def test_select_broadcasting():
+    """
+    >>> test_select_broadcasting()
+    """
+    type1 = double[:, :]
+    type2 = double[:, :]
+    type1.broadcasting = (False, False)
+    var1, var2 = vars = build_vars(type1, type2)
+    function = build_function(vars, b.assign(var1, b.add(var1, var2)))
+    a = np.empty((20, 20))
+
+    # Operands broadcasting in the inner dimension are hoisted out of the
+    # inner loop
+    type2.broadcasting = (False, True)
+    dispatcher = dispatch.Dispatcher(context, function, vectorize=False)
+    assert dispatcher.select(a, np.empty((20, 1))) is cinner
+
+    type2.broadcasting = (True, True)
+    dispatcher = dispatch.Dispatcher(context, function, vectorize=False)
+    assert dispatcher.select(a, np.empty((1, 1))) is contig
+
+    # Without the optimization, only the strided specializations apply
+    unoptimized_context = getcontext()
+    unoptimized_context.optimize_broadcasting = False
+    dispatcher = dispatch.Dispatcher(unoptimized_context, function,
+                                     vectorize=False)
+    assert dispatcher.select(a, np.empty((1, 1))) is (
+                                    specializers.StridedSpecializer)
+
+def test_verify_layout():
+    """
+    >>> dispatcher = build_dispatcher(type2=double[:, ::1])
+    >>> a = np.empty((10, 20))
+    >>> dispatcher.select(a, np.empty((10, 40))[:, ::2])
+    Traceback (most recent call last):
+        ...
+    ValueError: Operand op1 is not contiguous
+    >>> dispatcher.select(a, np.empty((10, 20), dtype=np.float32))
+    Traceback (most recent call last):
+        ...
+    ValueError: Operand op1 has itemsize 4, expected 8
+    """
+
+def test_posinfo():
+    """
+    >>> function = build_posinfo_function()
+    >>> dispatch.Dispatcher(context, function)
+    Traceback (most recent call last):
+        ...
+    ValueError: Functions with position information cannot be dispatched
+    """
+
+def build_posinfo_function():
+    var1, var2 = vars = build_vars(double[:, :], double[:, :])
+    posvars = [b.variable(char.pointer().pointer(), 'filename'),
+               b.variable(int_.pointer(), 'lineno'),
+               b.variable(int_.pointer(), 'column')]
+    posinfo = b.funcarg(b.variable(char.pointer().pointer(), 'posinfo'),
+                        *posvars)
+    args = [b.array_funcarg(var) for var in vars]
+    return b.function('function', b.assign(var1, var2), args,
+                      posinfo=posinfo)
+
+def test_chunks():
+    """
+    >>> test_chunks()
+    """
+    threaded_context = getcontext()
+    threaded_context.thread_pool_size = 4
+    threaded_context.thread_chunk_size = 100
+
+    function = build_dispatcher().function
+    dispatcher = dispatch.Dispatcher(threaded_context, function)
+    a = np.empty((20, 30))
+    chunks = dispatcher.chunks(a, a[:1])
+    assert [op1.shape for op1, op2 in chunks] == [(3, 30), (3, 30), (4, 30),
+                                                  (3, 30), (3, 30), (4, 30)]
+    assert all(op2.shape == (1, 30) for op1, op2 in chunks)
+    assert chunks[1][0].ctypes.data == a.ctypes.data + 3 * a.strides[0]
+
+    # Fortran ordered operands are split in the last dimension
+    a = np.empty((30, 20), order='F')
+    assert [op1.shape for op1, op2 in dispatcher.chunks(a, a)][:2] == [
+                                                        (30, 3), (30, 3)]
+
+    assert dispatcher.chunks(a[:3, :3], a[:3, :3]) is None
+    assert dispatch.Dispatcher(context, function).chunks(a, a) is None
+
+    # Slicing must preserve declared contiguity
+    dispatcher = dispatch.Dispatcher(
+        threaded_context, build_dispatcher(type2=double[::1, :]).function)
+    assert dispatcher.chunks(a, a) is not None
+    assert dispatcher.chunks(np.empty((30, 20)), a) is None
+
+def test_threaded_call():
+    """
+    >>> test_threaded_call()
+    """
+    jit_context = miniast.CJitContext()
+    jit_context.thread_pool_size = 4
+    jit_context.thread_chunk_size = 100
+
+    dispatcher = dispatch.Dispatcher(jit_context, build_dispatcher().function)
+    a = np.arange(40.0 * 30).reshape(40, 30)
+    for op1, op2 in [(a, a % 7), (a.T, (a % 7).T), (a, np.asfortranarray(a))]:
+        assert dispatcher.chunks(op1, op2) is not None
+        result = op1.copy(order='A')
+        assert dispatcher(result, op2) == 0
+        assert np.all(result == op1 + op2)
+
+    # Reduce over the inner axis
+    type1, type2 = double[:, :], double[:, :]
+    type1.broadcasting = (False, True)
+    type2.broadcasting = (False, False)
+    var1, var2 = vars = build_vars(type1, type2)
+    function = build_function(vars, b.reduction(var1, var2, axes=[1]))
+    dispatcher = dispatch.Dispatcher(jit_context, function)
+    result = np.zeros((40, 1))
+    assert dispatcher.chunks(result, a) is not None
+    assert dispatcher(result, a) == 0
+    assert np.all(result == a.sum(axis=1)[:, None])
+
+def test_c_dispatcher():
+    """
+    >>> test_c_dispatcher()
+    """
+    function = build_dispatcher().function
+    generator = dispatch.CDispatcherGenerator(getcontext())
+    proto, impl = generator.generate(function, [cinner, contig, contig_sse,
+                                                ctiled])
+    assert proto.startswith("int %s(" % function.name)
+    assert impl.count(proto[:-2] + " {") == 1
+
+    # The scalar contig specialization is shadowed by the vectorized one
+    calls = [line.split('(')[0].strip()
+                 for line in impl.splitlines() if 'return __mini' in line]
+    assert calls == ['return __mini_mangle_%s_%d%s' % (function.name, i, name)
+                        for i, name in [(2, 'contig'), (0, 'inner_contig_c'),
+                                        (3, 'tiled_c'), (3, 'tiled_c')]]
+    assert impl.count("static int __mini_mangle_%s" % function.name) == 3
+
+    # Without a strided specialization we may have to give up
+    proto, impl = generator.generate(function, [contig], name="contig_only")
+    assert impl.rstrip().endswith("return -1;\n}")
+
+    # The entry point computes the right result for each layout
+    import ctypes
+    import shutil
+    import tempfile
+    import cjit
+
+    proto, impl = generator.generate(
+        function, [contig, contig_sse, cinner, ctiled,
+                   specializers.StridedSpecializer], name="entry_point")
+    jit_context = miniast.CJitContext()
+    compiler = cjit.CCompiler(jit_context.cc, jit_context.cflags,
+                              tempfile.mkdtemp())
+    try:
+        entry_point = ctypes.CDLL(compiler.build(impl)).entry_point
+
+        def call(op1, op2):
+            shape = np.broadcast(op1, op2).shape
+            shape_array = ctypes.c_ssize_t * len(shape)
+            args = [shape_array(*shape)]
+            for op in op1, op2:
+                strides = [0 if extent == 1 else stride
+                               for extent, stride in zip(op.shape, op.strides)]
+                args.append(op.ctypes.data_as(ctypes.c_void_p))
+                args.append(shape_array(*strides))
+            return entry_point(*args)
+
+        a = np.arange(20.0 * 30).reshape(20, 30)
+        b = a % 7
+        strided = np.zeros((40, 90))[::2, ::3]
+        for op1, op2 in [(a, b), (a.T, b.T), (a, np.asfortranarray(b)),
+                         (a, b[:1]), (a, b[:, :1]), (strided, b[:, ::-1]),
+                         (a[::2, ::3], b[1::2, 1::3])]:
+            expected = op1 + op2
+            result = op1.copy(order='A')
+            if op1 is strided:
+                result = strided
+            assert call(result, op2) == 0
+            assert np.all(result == expected), (op1.strides, op2.strides)
+    finally:
+        shutil.rmtree(compiler.build_dir)
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
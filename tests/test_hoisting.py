@@ -53,6 +53,199 @@ def test_hoist_3d():
     result_ast, code_output = specialize(cinner, func)
     print code_output
 
+def test_array_temp():
+    """
+    >>> test_array_temp()
+    """
+    type1 = double[:, :, :]
+    type2 = double[:, :, :]
+    type1.broadcasting = (True, True, False)
+    type2.broadcasting = (False, False, False)
+
+    out, var1, var2 = vars = build_vars(type2, type1, type2)
+    body = b.assign(out, b.mul(b.mul(var1, var1), var2))
+    func = build_function(vars, body)
+
+    result_ast, code_output = specialize(cinner, func)
+    array_temp, = set(temp.name for temp in xpath(result_ast, '//TempNode')
+                                    if 'array_temp' in temp.name)
+
+    # Compute the temporary once, before the loop nest
+    lines = [line.strip() for line in code_output.splitlines()]
+    fill_line, = [i for i, line in enumerate(lines)
+                        if line.startswith('%s[' % array_temp)]
+    loops = [i for i, line in enumerate(lines) if line.startswith('for (')]
+    assert loops[0] < fill_line < loops[1]
+    assert len(loops) == 4
+
+    # Load from the temporary in the inner loop, and free it when done or
+    # when the allocation fails
+    assert code_output.count('%s[' % array_temp) == 2
+    free_lines = [i for i, line in enumerate(lines)
+                        if line == 'free(%s);' % array_temp]
+    assert lines[free_lines[0] + 1] == 'return -1;'
+    assert free_lines[1] == lines.index('return 0;') - 1
+
+def test_array_temp_allocation():
+    """
+    >>> test_array_temp_allocation()
+    """
+    import numpy as np
+
+    type1, type2, type3 = double[:, :, :], double[:, :, :], double[:, :, :]
+    type1.broadcasting = (True, False, True)
+    type2.broadcasting = (False, True, False)
+    type3.broadcasting = (False, False, False)
+
+    out, var1, var2 = vars = build_vars(type3, type1, type2)
+    build_expr = lambda var: b.add(b.mul(var, var), var)
+    body = b.assign(out, b.add(build_expr(var1), build_expr(var2)))
+    func = build_function(vars, body)
+
+    # A failed allocation frees all temporaries
+    result_ast, code_output = specialize(cinner, func)
+    array_temps = set(temp.name for temp in xpath(result_ast, '//TempNode')
+                                    if 'array_temp' in temp.name)
+    assert len(array_temps) == 2
+    lines = [line.strip() for line in code_output.splitlines()]
+    check = [i for i, line in enumerate(lines)
+                   if line.startswith('if (') and 'array_temp' in line]
+    assert len(check) == 1
+    assert set(lines[check[0] + 1:check[0] + 3]) == set(
+                        'free(%s);' % array_temp for array_temp in array_temps)
+
+    # Empty temporaries are not an error
+    jit_context = miniast.CJitContext()
+    for shape in (3, 4, 5), (0, 4, 5), (3, 0, 5):
+        op1 = np.arange(shape[1], dtype=np.double).reshape(1, shape[1], 1)
+        op2 = np.arange(shape[0] * shape[2], dtype=np.double).reshape(
+                                                    shape[0], 1, shape[2])
+        result = np.zeros(shape)
+        assert jit_call(jit_context, func, cinner, result, op1, op2) == 0
+        assert np.all(result == op1 * op1 + op1 + op2 * op2 + op2)
+
+def build_partially_hoistable(build_expr):
+    type1 = double[:, :, :]
+    type2 = double[:, :, :]
+    type1.broadcasting = (True, False, True)
+    type2.broadcasting = (False, False, False)
+
+    out, var1, var2 = vars = build_vars(type2, type1, type2)
+    body = b.assign(out, b.mul(build_expr(var1), var2))
+    return build_function(vars, body)
+
+def test_partial_hoisting():
+    """
+    >>> test_partial_hoisting()
+    """
+    import numpy as np
+
+    def middle_loop_stat(code_output, name):
+        lines = [line.strip() for line in code_output.splitlines()]
+        loops = [i for i, line in enumerate(lines) if line.startswith('for (')]
+        stat, = [i for i, line in enumerate(lines) if line.startswith(name)]
+        assert loops[-2] < stat < loops[-1]
+        return lines[stat]
+
+    # Cheap expressions are recomputed for each outer iteration
+    func = build_partially_hoistable(lambda var: b.mul(var, var))
+    result_ast, code_output = specialize(cinner, func)
+    assert 'array_temp' not in code_output
+    hoisted_temp, = set(temp.name for temp in xpath(result_ast, '//TempNode')
+                                      if 'hoisted_temp' in temp.name)
+    assert ' * ' in middle_loop_stat(code_output, hoisted_temp)
+
+    # Expensive expressions are computed once and reloaded
+    build_expr = lambda var: b.add(b.mul(var, var), var)
+    result_ast, code_output = specialize(cinner,
+                                         build_partially_hoistable(build_expr))
+    hoisted_temp, = set(temp.name for temp in xpath(result_ast, '//TempNode')
+                                      if 'hoisted_temp' in temp.name)
+    array_temp, = set(temp.name for temp in xpath(result_ast, '//TempNode')
+                                    if 'array_temp' in temp.name)
+    stat = middle_loop_stat(code_output, hoisted_temp)
+    assert stat.startswith('%s = %s[' % (hoisted_temp, array_temp))
+
+    context = getcontext()
+    context.array_temp_cost = 2
+    result_ast, code_output = specialize(
+            cinner, build_partially_hoistable(build_expr), context)
+    assert 'array_temp' not in code_output
+
+    # Both sides of the cutoff compute the same results
+    specializer_classes = (runnable_specializers(cinner) +
+                           [specializers.StridedSpecializer, ctiled])
+    op1 = np.arange(4.0).reshape(1, 4, 1) - 1.5
+    op2 = np.arange(3.0 * 4 * 5).reshape(3, 4, 5)
+    cases = [(lambda var: b.mul(var, var), 1, op1 * op1 * op2),
+             (build_expr, 1, (op1 * op1 + op1) * op2),
+             (build_expr, 2, (op1 * op1 + op1) * op2)]
+    for build_expr, array_temp_cost, expected in cases:
+        jit_context = miniast.CJitContext()
+        jit_context.array_temp_cost = array_temp_cost
+        func = build_partially_hoistable(build_expr)
+        for specializer_cls in specializer_classes:
+            result = np.zeros((3, 4, 5))
+            assert jit_call(jit_context, func, specializer_cls,
+                            result, op1, op2) == 0
+            assert np.all(result == expected), (array_temp_cost,
+                                                specializer_cls)
+
+def test_hoist_vectorized():
+    """
+    >>> test_hoist_vectorized()
+    """
+    type1 = double[:, :]
+    type2 = double[:, :]
+    type1.broadcasting = (False, True)
+    type2.broadcasting = (False, False)
+
+    out, var1, var2 = vars = build_vars(type2, type1, type2)
+    body = b.assign(out, b.mul(b.mul(var1, var1), var2))
+    func = build_function(vars, body)
+
+    result_ast, code_output = specialize(cinner_sse, func)
+    hoisted_temp, = set(temp.name for temp in xpath(result_ast, '//TempNode')
+                                      if 'hoisted_temp' in temp.name)
+    hoisted_vector, = set(temp.name for temp in xpath(result_ast, '//TempNode')
+                                        if 'hoisted_vector' in temp.name)
+
+    # Splat the hoisted scalar once per row
+    lines = [line.strip() for line in code_output.splitlines()]
+    outer_loop, inner_loop = [i for i, line in enumerate(lines)
+                                    if line.startswith('for (')]
+    splat = lines.index('%s = _mm_set1_pd(%s);' % (hoisted_vector,
+                                                    hoisted_temp))
+    assert outer_loop < splat < inner_loop
+    assert '_mm_mul_pd(%s, ' % hoisted_vector in code_output
+
+    # The fixup loop uses the same scalar
+    fixup_loop = [i for i, line in enumerate(lines)
+                        if line.startswith('if (') and i > inner_loop][0]
+    assert '(%s * ' % hoisted_temp in lines[fixup_loop + 1]
+    assert code_output.count('%s = (' % hoisted_temp) == 1
+
+def test_hoist_scalar_operands():
+    """
+    >>> test_hoist_scalar_operands()
+    """
+    import numpy as np
+
+    # Both operands are hoisted, the product is already a scalar
+    out_type, type1, type2 = double[:, :, :], double[:, :, :], double[:, :, :]
+    out_type.broadcasting = (False, False, False)
+    type1.broadcasting = (False, True, True)
+    type2.broadcasting = (True, False, True)
+    out, var1, var2 = vars = build_vars(out_type, type1, type2)
+    func = build_function(vars, b.assign(out, b.mul(var1, var2)))
+
+    jit_context = miniast.CJitContext()
+    op1 = np.arange(1.0, 4.0).reshape(3, 1, 1)
+    op2 = np.arange(5.0).reshape(1, 5, 1)
+    for specializer_cls in runnable_specializers(cinner):
+        result = np.zeros((3, 5, 19))
+        jit_call(jit_context, func, specializer_cls, result, op1, op2)
+        assert np.all(result == op1 * op2), specializer_cls
 
 if __name__ == '__main__':
     import doctest
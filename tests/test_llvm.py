@@ -42,6 +42,86 @@ def test_llvm():
     # print code_output[0]
     # print code_output[1]
 
+def test_vectorized():
+    """
+    >>> test_vectorized()
+    """
+    import numpy as np
+    import dispatch
+
+    llvm_context = get_llvm_context()
+    type1, type2 = double[:, :], double[:, :]
+    type1.broadcasting = (False, False)
+    type2.broadcasting = (False, False)
+    var1, var2 = vars = build_vars(type1, type2)
+    body = b.assign(var1, b.add(b.mul(var1, var2), var2))
+    func = build_function(vars, body)
+
+    cinner_avx = cinner.vectorized_equivalents[1]
+    result_ast, (lfunc, ctypes_func) = specialize(cinner_avx, func,
+                                                  llvm_context)
+    assert '<4 x double>' in str(lfunc)
+
+    llvm_context.max_vector_size = 8
+    dispatcher = dispatch.Dispatcher(llvm_context, func)
+    op1 = np.arange(70.0).reshape(7, 10)
+    op2 = np.arange(70.0).reshape(10, 7).T
+    expected = op1 * op2 + op2
+    assert dispatcher.select(op1, op1) is contig.vectorized_equivalents[1]
+    dispatcher(op1, op2)
+    assert np.all(op1 == expected)
+
+def test_module_batches():
+    """
+    >>> test_module_batches()
+    """
+    import gc
+    import llvm_modules
+
+    llvm_context = Context()
+    manager = llvm_modules.ModuleManager(llvm_context.llvm_target_machine,
+                                         batch_size=2)
+    llvm_context.llvm_modules = manager
+
+    type1 = double[:, :]
+    type1.broadcasting = (False, False)
+    var1, = vars = build_vars(type1)
+    func = build_function(vars, b.assign(var1, b.add(var1, var1)))
+
+    results = [llvm_context.specialize(func, S) for i in range(5)]
+    assert [batch.size for batch in manager.batches] == [2, 2, 1]
+    assert [batch.live for batch in manager.batches] == [2, 2, 1]
+
+    # Full batches are freed once none of their kernels are referenced
+    del results[:3]
+    gc.collect()
+    results.append(llvm_context.specialize(func, S))
+    assert [batch.size for batch in manager.batches] == [2, 2, 0]
+    assert [batch.live for batch in manager.batches] == [1, 2, 0]
+
+def test_tiered():
+    """
+    >>> test_tiered()
+    """
+    import numpy as np
+    import dispatch
+
+    class TieredContext(miniast.LLVMContext):
+        llvm_tiered = True
+
+    tiered_context = TieredContext()
+    type1, type2 = double[:, :], double[:, :]
+    type1.broadcasting = (False, False)
+    type2.broadcasting = (False, False)
+    var1, var2 = vars = build_vars(type1, type2)
+    func = build_function(vars, b.assign(var1, b.add(var1, var2)))
+
+    dispatcher = dispatch.Dispatcher(tiered_context, func)
+    op1, op2 = np.ones((10, 10)), np.ones((10, 10))
+    dispatcher(op1, op2)
+    tiered_context.llvm_modules.wait()
+    dispatcher(op1, op2)
+    assert np.all(op1 == 3)
 
 #if __name__ == '__main__':
 #    import doctest
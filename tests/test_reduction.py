@@ -0,0 +1,108 @@
+from testutils import *
+
+def build_reduction(operator='+', axes=None, ndim=2):
+    """
+    Build a function reducing op1 * op1 into op0. op0 broadcasts in the
+    reduced axes.
+    """
+    type1 = double[(slice(None),) * ndim]
+    type2 = double[(slice(None),) * ndim]
+    if axes is None:
+        type1.broadcasting = (True,) * ndim
+    else:
+        type1.broadcasting = tuple(dim in axes for dim in range(ndim))
+    type2.broadcasting = (False,) * ndim
+
+    var1, var2 = vars = build_vars(type1, type2)
+    body = b.reduction(var1, b.mul(var2, var2), operator, axes)
+    return build_function(vars, body)
+
+def pragma(impl):
+    pragma, = [line for line in impl.splitlines() if 'omp parallel' in line]
+    return pragma
+
+def test_full_reduction():
+    """
+    >>> test_full_reduction()
+    """
+    ast, impl = specialize(contig, build_reduction())
+    assert not xpath(ast, '//ReductionNode')
+
+    # Accumulate in a private copy in each thread
+    accumulator, = set(temp.name for temp in xpath(ast, '//TempNode')
+                                     if 'op0_acc' in temp.name)
+    assert 'reduction(+:%s)' % accumulator in pragma(impl)
+    assert '%s += ' % accumulator in impl
+
+    # Store the result before returning
+    store = '(*op0_data) = %s;' % accumulator
+    assert impl.index(store) > impl.index('for (')
+    assert impl.index(store) < impl.index('return 0;')
+
+def test_vectorized_reduction():
+    """
+    >>> test_vectorized_reduction()
+    """
+    ast, impl = specialize(contig_sse, build_reduction('min'))
+    assert '= _mm_set1_pd(' in impl
+    assert '= _mm_min_pd(' in impl
+
+    # Combine the partial results of both elements of the vector
+    vector_accumulator, = set(temp.name for temp in xpath(ast, '//TempNode')
+                                            if 'op0_vacc' in temp.name)
+    for i in range(2):
+        element = '((double *) &%s)[%d]' % (vector_accumulator, i)
+        assert impl.count(element) == 2
+
+    # We cannot reduce vectors in an OpenMP reduction clause
+    assert 'if(0)' in pragma(impl)
+
+def test_partial_reduction():
+    """
+    >>> test_partial_reduction()
+    """
+    # Sum the rows, each thread handles different rows
+    ast, impl = specialize(cinner_sse, build_reduction(axes=(1,)))
+    assert 'if(0)' not in pragma(impl)
+    accumulator_init, = [line for line in impl.splitlines()
+                                  if '_acc' in line and '= (*' in line]
+    outer_loop, inner_loop = [i for i, line in enumerate(impl.splitlines())
+                                    if line.strip().startswith('for (')]
+    assert outer_loop < impl.splitlines().index(accumulator_init) < inner_loop
+    assert '= _mm_add_pd(' in impl
+
+    # Sum the columns, update the lhs elements in the inner loop
+    ast, impl = specialize(cinner, build_reduction('max', axes=(0,)))
+    assert not [temp for temp in xpath(ast, '//TempNode')
+                         if '_acc' in temp.name]
+    assert 'if(0)' in pragma(impl)
+
+def test_reduction_results():
+    """
+    >>> test_reduction_results()
+    """
+    import numpy as np
+
+    jit_context = miniast.CJitContext()
+    np_operators = {'+': np.add, '*': np.multiply,
+                    'min': np.minimum, 'max': np.maximum}
+    op1 = 1.0 + (np.arange(5 * 19) % 7).reshape(5, 19) / 50.0
+    for operator, np_operator in sorted(np_operators.items()):
+        for specializer_cls, axes in [(contig, None), (cinner, None),
+                                      (cinner, (0,)), (cinner, (1,))]:
+            function = build_reduction(operator, axes)
+            # The reduction includes the initial value of op0
+            reduced = np_operator.reduce(op1 * op1, axis=axes or (0, 1),
+                                         keepdims=True)
+            initial = np.linspace(1.0, 2.0, reduced.size).reshape(
+                                                            reduced.shape)
+            expected = np_operator(initial, reduced)
+
+            for cls in runnable_specializers(specializer_cls):
+                result = initial.copy()
+                jit_call(jit_context, function, cls, result, op1)
+                assert np.allclose(result, expected), (operator, axes, cls)
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
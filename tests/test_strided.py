@@ -0,0 +1,103 @@
+from testutils import *
+
+def build_strided_function():
+    "Build a function computing op0 = op1 * op1 + op2"
+    type1, type2, type3 = double[:, :], double[:, :], double[:]
+    type1.broadcasting = (False, False)
+    type2.broadcasting = (False, False)
+    type3.broadcasting = (False,)
+
+    var1, var2, var3 = vars = build_vars(type1, type2, type3)
+    body = b.assign(var1, b.add(b.mul(var2, var2), var3))
+    return build_function(vars, body)
+
+def prefetches(impl):
+    return [line.strip() for line in impl.splitlines()
+                             if '__builtin_prefetch(' in line]
+
+def test_prefetch():
+    """
+    >>> test_prefetch()
+    """
+    function = build_strided_function()
+    ast, impl = specialize(specializers.StridedSpecializer, function)
+    assert not prefetches(impl)
+
+    prefetch_context = getcontext()
+    prefetch_context.prefetch_strided = True
+
+    # Prefetch each operand once in the inner loop, for writing if stored to
+    ast, impl = specialize(specializers.StridedSpecializer, function,
+                           context=prefetch_context)
+    op0, op1, op2 = prefetches(impl)
+    assert '_op0_stride' in op0 and op0.endswith(' * 16)), 1);')
+    assert '_op1_stride' in op1 and op1.endswith(' * 16)), 0);')
+    assert impl.index(op0) > impl.rindex('for (')
+
+    # The distance is an attribute of the specializer
+    ast, impl = specialize(ctiled, function, context=prefetch_context)
+    assert all(' * 8)), ' in line for line in prefetches(impl))
+
+    class PrefetchMixin(object):
+        prefetch_distance = 32
+
+    prefetch_context.specializer_mixin_cls = PrefetchMixin
+    ast, impl = specialize(ctiled, function, context=prefetch_context)
+    assert len(prefetches(impl)) == 3
+    assert all(' * 32)), ' in line for line in prefetches(impl))
+
+    # Contiguous accesses are left to the hardware prefetcher
+    ast, impl = specialize(cinner, function, context=prefetch_context)
+    assert not prefetches(impl)
+
+    # The pointers restarted by OpenMP threads are prefetched afterwards
+    type1, type2 = double[:], double[:]
+    type1.broadcasting = type2.broadcasting = (False,)
+    var1, var2 = vars = build_vars(type1, type2)
+    function_1d = build_function(vars, b.assign(var1, b.mul(var2, var2)))
+    ast, impl = specialize(specializers.StridedSpecializer, function_1d,
+                           context=prefetch_context)
+    op0, op1 = prefetches(impl)
+    assert impl.index(' = (op0_data + ') < impl.index(op0)
+    assert impl.index(' = (op1_data + ') < impl.index(op1)
+
+    # Results of the prefetching specializations, with and without OpenMP
+    import numpy as np
+
+    specializer_classes = [specializers.StridedSpecializer, ctiled,
+                           specializers.FTiledStridedSpecializer]
+    for cflags in [['-O2', '-fopenmp'], ['-O2']]:
+        jit_context = miniast.CJitContext()
+        jit_context.prefetch_strided = True
+        jit_context.cflags = cflags
+        for shape in [(40, 60), (3, 5)]:
+            op1 = np.arange(np.prod(shape) * 2.0).reshape(shape[1] * 2,
+                                                          shape[0]).T[:, ::2]
+            op2 = np.arange(shape[1] * 3.0)[::3]
+            expected = op1 * op1 + op2
+            for specializer_cls in specializer_classes:
+                result = np.zeros((shape[0], shape[1] * 2))[:, ::2]
+                jit_call(jit_context, function, specializer_cls,
+                         result, op1, op2)
+                assert np.all(result == expected), (cflags, shape,
+                                                    specializer_cls)
+
+            x = np.arange(shape[0] * 2.0)[::2]
+            result = np.zeros(shape[0] * 3)[::3]
+            jit_call(jit_context, function_1d,
+                     specializers.StridedSpecializer, result, x)
+            assert np.all(result == x * x)
+
+def test_tiled_lower_dimensional_operand():
+    """
+    >>> test_tiled_lower_dimensional_operand()
+    """
+    # op2 is 1D, its pointer restarts for each row of tiles
+    ast, impl = specialize(ctiled, build_strided_function())
+    outer_loop = impl.index('for (')
+    restart = impl.index(' = op2_data;')
+    assert outer_loop < restart < impl.index('for (', outer_loop + 1)
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,303 @@
+from testutils import *
+
+def build_binop(dtype, operator):
+    "Build a function computing op0 = op1 <operator> op2"
+    types = [dtype[:, :] for i in range(3)]
+    for type in types:
+        type.broadcasting = (False, False)
+
+    var0, var1, var2 = vars = build_vars(*types)
+    body = b.assign(var0, b.binop(var1.type, operator, var1, var2))
+    return build_function(vars, body)
+
+numeric_dtypes = [(float_, 'float32'), (double, 'float64'), (int_, 'intc'),
+                  (minitypes.longlong, 'int64')]
+
+def test_integer_vectorization():
+    """
+    >>> test_integer_vectorization()
+    """
+    cinner_avx = cinner.vectorized_equivalents[1]
+    cinner_avx512 = cinner.vectorized_equivalents[2]
+
+    ast, impl = specialize(cinner_sse, build_binop(int32, '+'))
+    assert '__m128i ' in impl
+    assert '_mm_loadu_si128((__m128i *) ' in impl
+    assert '_mm_storeu_si128((__m128i *) ' in impl
+    assert '_mm_add_epi32(' in impl
+
+    ast, impl = specialize(cinner_avx, build_binop(int64, '&'))
+    assert '_mm256_and_si256(' in impl
+
+    # Comparisons result in 1 or 0, like the scalar comparisons
+    ast, impl = specialize(cinner_avx, build_binop(int64, '<='))
+    assert '_mm256_add_epi64(_mm256_cmpgt_epi64(' in impl
+    assert '_mm256_set1_epi64x(1)' in impl
+    ast, impl = specialize(cinner_avx512, build_binop(uint32, '<'))
+    assert '_mm512_maskz_set1_epi32(_mm512_cmp_epu32_mask(' in impl
+    assert '_MM_CMPINT_LT' in impl
+
+    # Only AVX-512 multiplies 64-bit integers or compares unsigned integers
+    for dtype, operator in [(int64, '*'), (uint32, '>'), (int32, '/'),
+                            (int32, '%')]:
+        function = build_binop(dtype, operator)
+        assert not cinner_avx.can_vectorize(context, function)
+
+    assert cinner_avx.can_vectorize(context, build_binop(uint32, '!='))
+    assert cinner_avx512.can_vectorize(context, build_binop(int64, '*'))
+    assert not cinner_avx.can_vectorize(context, build_binop(double, '&'))
+
+def test_masked_remainder():
+    """
+    >>> test_masked_remainder()
+    """
+    masked_context = getcontext()
+    masked_context.masked_remainder = True
+    cinner_avx = cinner.vectorized_equivalents[1]
+
+    # The remaining elements are processed in a single vectorized iteration
+    ast, impl = specialize(cinner_avx, build_binop(double, '+'),
+                           context=masked_context)
+    fixup, = xpath(ast, '//*[@is_fixup=True]')
+    assert type(fixup).__name__ == 'IfNode'
+    assert impl.count('_mm256_maskload_pd(') == 2
+    assert impl.count('_mm256_maskstore_pd(') == 1
+    assert '_mm256_set_epi64x(3, 2, 1, 0)' in impl
+
+    ast, impl = specialize(contig.vectorized_equivalents[2],
+                           build_binop(int32, '-'), context=masked_context)
+    assert '_mm512_maskz_loadu_epi32((__mmask16) ' in impl
+    assert '_mm512_mask_storeu_epi32(' in impl
+
+    # Vector accumulators would include the masked out elements
+    type1, type2 = double[:, :], double[:, :]
+    type1.broadcasting = (False, True)
+    type2.broadcasting = (False, False)
+    var1, var2 = vars = build_vars(type1, type2)
+    function = build_function(vars, b.reduction(var1, var2, axes=[1]))
+    ast, impl = specialize(cinner_sse, function, context=masked_context)
+    assert 'mask' not in impl
+
+    # Extents that are not a multiple of the vector size
+    import numpy as np
+
+    jit_context = miniast.CJitContext()
+    jit_context.masked_remainder = True
+    specializer_classes = (runnable_specializers(cinner) +
+                           runnable_specializers(contig))
+    for dtype, np_dtype in numeric_dtypes:
+        function = build_binop(dtype, '-')
+        for shape in [(5, 19), (3, 7), (2, 1)]:
+            op1 = np.arange(np.prod(shape), dtype=np_dtype).reshape(shape)
+            op2 = (op1 % 5).astype(np_dtype)
+            for specializer_cls in specializer_classes:
+                result = np.zeros(shape, dtype=np_dtype)
+                jit_call(jit_context, function, specializer_cls,
+                         result, op1, op2)
+                assert np.all(result == op1 - op2), (dtype, shape,
+                                                     specializer_cls)
+
+def test_align_vectors():
+    """
+    >>> test_align_vectors()
+    """
+    aligned_context = getcontext()
+    aligned_context.align_vectors = True
+    cinner_avx = cinner.vectorized_equivalents[1]
+
+    ast, impl = specialize(cinner_avx, build_binop(double, '*'),
+                           context=aligned_context)
+    peel, fixup = xpath(ast, '//*[@is_fixup=True]')
+    assert peel.alignment_variable.name == 'op0'
+
+    # The stored operand is aligned after the peeled iterations, the
+    # alignment of the others is checked at runtime
+    outer_loop, peel_loop, loop, fixup_loop = [
+        line for line in impl.splitlines() if line.strip().startswith('for (')]
+    assert '% 32)' in peel_loop
+    assert impl.count('_mm256_store_pd(') == 1
+    assert impl.count('_mm256_loadu_pd(') == 2
+    assert impl.count(' ? _mm256_load_pd(') == 2
+
+    # Reductions accumulating in vectors load the only operand unaligned
+    type1, type2 = double[:, :], double[:, :]
+    type1.broadcasting = (True, True)
+    type2.broadcasting = (False, False)
+    var1, var2 = vars = build_vars(type1, type2)
+    function = build_function(vars, b.reduction(var1, var2))
+    ast, impl = specialize(contig_sse, function, context=aligned_context)
+    assert len(xpath(ast, '//*[@is_fixup=True]')) == 1
+    assert '_mm_loadu_pd(' in impl
+
+    # Misaligned views run the peel loop and the unaligned loads
+    import numpy as np
+
+    jit_context = miniast.CJitContext()
+    jit_context.align_vectors = True
+    for dtype, np_dtype in numeric_dtypes:
+        function = build_binop(dtype, '*')
+        data = np.arange(5 * 24, dtype=np_dtype).reshape(5, 24)
+        for offset1, offset2 in [(1, 1), (1, 0), (0, 3), (2, 5)]:
+            op1 = data[:, offset1:offset1 + 19]
+            op2 = data[:, offset2:offset2 + 19] % 7
+            expected = op1 * op2
+            for specializer_cls in runnable_specializers(cinner):
+                out = np.zeros((5, 24), dtype=np_dtype)
+                result = out[:, offset1:offset1 + 19]
+                jit_call(jit_context, function, specializer_cls,
+                         result, op1, op2)
+                assert np.all(result == expected), (dtype, offset1, offset2,
+                                                    specializer_cls)
+
+def test_streaming_stores():
+    """
+    >>> test_streaming_stores()
+    """
+    streaming_context = getcontext()
+    streaming_context.streaming_store_threshold = 1024
+    cinner_avx = cinner.vectorized_equivalents[1]
+
+    # Streaming stores need the stored operand to be aligned
+    ast, impl = specialize(cinner_avx, build_binop(double, '*'),
+                           context=streaming_context)
+    peel, fixup = xpath(ast, '//*[@is_fixup=True]')
+    assert peel.alignment_variable.name == 'op0'
+    assert ' > 128) ? _mm256_stream_pd(' in impl
+    assert impl.index('_mm_sfence();') < impl.rindex('for (')
+
+    ast, impl = specialize(cinner_avx, build_binop(int32, '+'),
+                           context=streaming_context)
+    assert '_mm256_stream_si256((__m256i *) ' in impl
+
+    # Outputs above and below the threshold, starting at an offset
+    import numpy as np
+
+    jit_context = miniast.CJitContext()
+    jit_context.streaming_store_threshold = 1024
+    for dtype, np_dtype in numeric_dtypes:
+        function = build_binop(dtype, '+')
+        for shape in [(7, 61), (2, 3)]:
+            op1 = np.arange(np.prod(shape), dtype=np_dtype).reshape(shape)
+            op2 = (op1 % 3).astype(np_dtype)
+            for specializer_cls in runnable_specializers(cinner):
+                out = np.zeros((shape[0], shape[1] + 1), dtype=np_dtype)
+                result = out[:, 1:]
+                jit_call(jit_context, function, specializer_cls,
+                         result, op1, op2)
+                assert np.all(result == op1 + op2), (dtype, shape,
+                                                     specializer_cls)
+
+def build_transpose_add(dtype, lhs_type=None, order='C'):
+    "Build a function computing op0 = op1 + op2.T in C or Fortran order"
+    if order == 'C':
+        types = [lhs_type or dtype[:, ::1], dtype[:, ::1], dtype[::1, :]]
+    else:
+        types = [lhs_type or dtype[::1, :], dtype[::1, :], dtype[:, ::1]]
+    for type in types:
+        type.broadcasting = (False, False)
+
+    var0, var1, var2 = vars = build_vars(*types)
+    return build_function(vars, b.assign(var0, b.add(var1, var2)))
+
+def test_vectorized_tiling():
+    """
+    >>> test_vectorized_tiling()
+    """
+    import dispatch
+
+    ctiled_sse, ctiled_avx, ctiled_avx512 = ctiled.vectorized_equivalents
+
+    # Operands not contiguous in the inner tiling dimension are gathered
+    ast, impl = specialize(ctiled_avx, build_transpose_add(double))
+    assert '_mm256_loadu_pd(' in impl
+    assert '_mm256_i64gather_pd(' in impl
+    assert '_mm256_storeu_pd(' in impl
+    fixup, = xpath(ast, '//*[@is_fixup=True]')
+
+    ast, impl = specialize(ctiled_avx512, build_transpose_add(float_))
+    assert '_mm512_i32gather_ps(_mm512_set_epi32(' in impl
+
+    # SSE has no gathers
+    ast, impl = specialize(ctiled_sse, build_transpose_add(double))
+    assert 'gather' not in impl
+    assert '_mm_set_pd((' in impl
+
+    # Gathered operands cannot be stored to
+    function = build_transpose_add(double, lhs_type=double[:, :])
+    assert not ctiled_avx.can_vectorize(context, function)
+
+    # Shapes that are not a multiple of the tile or vector size
+    import numpy as np
+
+    jit_context = miniast.CJitContext()
+    dtypes = [(float_, np.float32), (double, np.float64), (int_, np.intc)]
+    for tiled_cls in (ctiled, specializers.FTiledStridedSpecializer):
+        order = tiled_cls.order
+        for dtype, np_dtype in dtypes:
+            function = build_transpose_add(dtype, order=order)
+            for shape in [(37, 53), (5, 3)]:
+                op1 = np.arange(np.prod(shape), dtype=np_dtype).reshape(
+                                                        shape, order=order)
+                op2 = np.asarray(op1.T % 11, order=order).T
+                for specializer_cls in runnable_specializers(tiled_cls):
+                    result = np.zeros(shape, dtype=np_dtype, order=order)
+                    jit_call(jit_context, function, specializer_cls,
+                             result, op1, op2)
+                    assert np.all(result == op1 + op2), (dtype, shape,
+                                                         specializer_cls)
+
+    # Hosts without AVX2 select the 4-lane specializations
+    sse_context = miniast.CJitContext()
+    sse_context.cflags = ['-O2', '-march=sandybridge']
+    sse_context.max_vector_size = 4
+    dispatcher = dispatch.Dispatcher(sse_context, build_transpose_add(double))
+    op1 = np.arange(20.0 * 30).reshape(20, 30)
+    op2 = np.asfortranarray(op1 % 7)
+    result = np.zeros((20, 30))
+    assert dispatcher.select(result, op1, op2) is ctiled_sse
+    dispatcher(result, op1, op2)
+    assert np.all(result == op1 + op2)
+
+def test_vectorized_comparisons():
+    """
+    >>> test_vectorized_comparisons()
+    """
+    import numpy as np
+    import dispatch
+
+    jit_context = miniast.CJitContext()
+    operators = [('<', np.less), ('<=', np.less_equal), ('==', np.equal),
+                 ('!=', np.not_equal), ('>=', np.greater_equal),
+                 ('>', np.greater)]
+    dtypes = [(float_, np.float32), (double, np.float64),
+              (int_, np.intc), (minitypes.longlong, np.int64)]
+    for dtype, np_dtype in dtypes:
+        op1 = (np.arange(5 * 19) % 7).reshape(5, 19).astype(np_dtype)
+        op2 = (np.arange(5 * 19) % 5).reshape(5, 19).astype(np_dtype)
+        for operator, np_operator in operators:
+            function = build_binop(dtype, operator)
+            expected = np_operator(op1, op2).astype(np_dtype)
+            for specializer_cls in runnable_specializers(cinner):
+                result = np.zeros((5, 19), dtype=np_dtype)
+                jit_call(jit_context, function, specializer_cls,
+                         result, op1, op2)
+                assert np.all(result == expected), (dtype, operator,
+                                                    specializer_cls)
+
+    # Conditional expressions are not vectorized
+    type0, type1, type2 = types = [int_[:, :] for i in range(3)]
+    for type in types:
+        type.broadcasting = (False, False)
+    var0, var1, var2 = vars = build_vars(*types)
+    function = build_function(vars, b.assign(var0, b.min(var1, var2)))
+    for vectorized_cls in cinner.vectorized_equivalents:
+        assert not vectorized_cls.can_vectorize(context, function)
+
+    dispatcher = dispatch.Dispatcher(jit_context, function, vectorize=True)
+    result = np.zeros((5, 19), dtype=np.intc)
+    dispatcher(result, op1.astype(np.intc), op2.astype(np.intc))
+    assert np.all(result == np.minimum(op1, op2))
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
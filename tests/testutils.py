@@ -31,6 +31,23 @@ def specialize(specializer_cls, ast, context=None, print_tree=False):
         prototype, code_result = code_result
     return specialized_ast, code_result
 
+def runnable_specializers(specializer_cls):
+    "The specializer and its vectorized equivalents the host can run"
+    max_vector_size = miniast.host_vector_size()
+    return [specializer_cls] + [
+        vectorized_cls
+            for vectorized_cls in specializer_cls.vectorized_equivalents
+            if vectorized_cls.vector_size <= max_vector_size]
+
+def jit_call(jit_context, function, specializer_cls, *operands):
+    "Compile and call a specialization with a CJitContext"
+    import dispatch
+
+    dispatcher = dispatch.Dispatcher(jit_context, function)
+    ctypes_func, args = dispatcher.prepare_specializer(specializer_cls,
+                                                       *operands)
+    return ctypes_func(*args)
+
 def run(specializers, ast):
     context = getcontext()
     for result in context.run(ast, specializers):
@@ -44,6 +44,12 @@ class TypePromoter(minivisitor.GenericTransform):
         self.visitchildren(node)
         return node
 
+    def visit_VectorBinopNode(self, node):
+        # The operands of vector operations have the same type, and
+        # comparisons result in a vector of that type
+        self.visitchildren(node)
+        return node
+
     def handle_binop(self, dst_type, node):
         node.lhs = self.promote(dst_type, node.lhs)
         node.rhs = self.promote(dst_type, node.rhs)